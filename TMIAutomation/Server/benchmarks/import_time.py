@@ -0,0 +1,95 @@
+"""Import-time budget report of the server, measured with python -X importtime.
+
+Only what is needed to bind the port and load the sessions should be imported at the server start:
+the pipeline dependencies listed in --lazy are imported at the first request or by the warm-up.
+The report lists the modules with the largest cumulative import time, the lazy modules imported
+at start, and exits with status 1 if one is found or the total exceeds --budget-ms.
+The import of src.app includes the load of the models.
+
+Run from the server folder, e.g.:
+    python -m benchmarks.import_time --budget-ms 1000 --top 20
+"""
+
+import sys
+import argparse
+import subprocess
+
+# Modules imported lazily by the pipeline or by the warm-up (see src.serving.warmup),
+# or only by the benchmarks and the tests (imgaug)
+LAZY_MODULES: tuple[str, ...] = (
+    "imgaug",
+    "scipy.ndimage",
+    "gradient_free_optimizers",
+    "src.local_optimization",
+    "src.visualize",
+    "src.dicom.watcher",
+)
+
+
+def measure(module: str) -> dict[str, tuple[float, float]]:
+    """Import a module in a new interpreter and parse the output of -X importtime.
+
+    Args:
+        module (str): The module imported.
+
+    Returns:
+        dict[str, tuple[float, float]]: Self and cumulative import time in ms of each imported module.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        if not self_us.strip().isdigit():
+            continue  # header
+        times[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+
+    return times
+
+
+def main() -> None:
+    """Script entry point."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--module", default="src.app")
+    parser.add_argument("--budget-ms", type=float, default=1000.0)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--lazy", nargs="*", default=list(LAZY_MODULES))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Minimum over the runs, the first one including the cold file-system cache
+    times: dict[str, tuple[float, float]] = {}
+    for _ in range(args.repeat):
+        for name, (self_ms, cumulative_ms) in measure(args.module).items():
+            best = times.get(name, (self_ms, cumulative_ms))
+            times[name] = (min(best[0], self_ms), min(best[1], cumulative_ms))
+
+    print(f"{'module':<50} {'self [ms]':>9} {'cumulative [ms]':>15}")
+    ranked = sorted(times.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (self_ms, cumulative_ms) in ranked[: args.top]:
+        print(f"{name:<50} {self_ms:>9.1f} {cumulative_ms:>15.1f}")
+
+    total = times.get(args.module, (0.0, 0.0))[1]
+    eager = sorted(
+        name
+        for name in times
+        if any(name == lazy or name.startswith(lazy + ".") for lazy in args.lazy)
+    )
+    print(f"\nTotal: {total:.1f} ms, budget: {args.budget_ms:.1f} ms")
+    if eager:
+        print(f"Lazy modules imported at start: {', '.join(eager)}")
+
+    if total > args.budget_ms or eager:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
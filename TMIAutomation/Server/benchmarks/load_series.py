@@ -0,0 +1,58 @@
+"""Benchmark of the CT series loading time against the number of decoding workers.
+
+Run from the server folder, e.g.:
+    python -m benchmarks.load_series path/to/dicom_folder --workers 1 2 4 8 16 --executor thread process
+"""
+
+import argparse
+import time
+import numpy as np
+from src.dicom.loader import decode_into, read_headers
+from src.dicom.series import LazySeries
+from src.dicom.volume_store import get_volume_dtype
+
+
+def main() -> None:
+    """Script entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dicom_path", help="Folder containing the CT series.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument(
+        "--executor", nargs="+", choices=["thread", "process"], default=["thread"]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    series = LazySeries.from_folder(args.dicom_path)
+    print(f"{len(series)} slices of {series.shape}, ", end="")
+    print(f"transfer syntax {series.headers[0].file_meta.TransferSyntaxUID.name}")
+    print(
+        f"{'executor':>8} {'workers':>7} {'headers [s]':>11} {'decode [s]':>10} {'speed-up':>8}"
+    )
+
+    baseline = None
+    for executor_type in args.executor:
+        for workers in args.workers:
+            headers_time, decode_time = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                read_headers(series.paths, workers)
+                headers_time.append(time.perf_counter() - start)
+
+                volume = np.empty(
+                    (len(series), *series.shape), dtype=get_volume_dtype(series)
+                )
+                start = time.perf_counter()
+                decode_into(series.paths, volume, workers, executor_type)
+                decode_time.append(time.perf_counter() - start)
+
+            total = min(headers_time) + min(decode_time)
+            baseline = baseline or total
+            print(
+                f"{executor_type:>8} {workers:>7} {min(headers_time):>11.3f} "
+                f"{min(decode_time):>10.3f} {baseline / total:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Benchmark of the image transforms of the pipeline: imgaug against the precomputed index maps.
+
+The forward transform resizes the coronal projections (512, num_slices, 3) to 512x512 and rotates them,
+as in Pipeline._transform. The inverse transform rotates the image back and resizes it to
+(512, num_slices), together with the 12 isocenters, as in Pipeline._inverse_transform.
+The outputs are checked to be identical.
+
+imgaug is not a dependency of the server: install requirements-dev.txt, then run from the server folder, e.g.:
+    python -m benchmarks.transform --slices 100 300 600 --repeat 50
+"""
+
+import argparse
+import time
+import numpy as np
+import imgaug.augmenters as iaa
+from imgaug.augmentables import Keypoint, KeypointsOnImage
+from src.transforms import get_index_map, transform_image, transform_keypoints
+
+WIDTH_RESIZE: int = 512
+
+
+def _time(function, repeat: int) -> float:
+    """Median time in ms of the calls to function."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return 1000 * float(np.median(times))
+
+
+def _imgaug_forward(image: np.ndarray) -> np.ndarray:
+    """Forward transform built at each call, as in the pipeline before the index maps."""
+    seq = iaa.Sequential(
+        [
+            iaa.Resize(
+                size={"height": WIDTH_RESIZE, "width": WIDTH_RESIZE},
+                interpolation="nearest",
+            ),
+            iaa.Rot90(k=-1, keep_size=False),
+        ]
+    )
+
+    return seq(image=image)
+
+
+def _imgaug_inverse(
+    image: np.ndarray, xy: np.ndarray, num_slices: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Inverse transform built at each call, as in the pipeline before the index maps."""
+    seq = iaa.Sequential(
+        [
+            iaa.Rot90(k=1, keep_size=False),
+            iaa.Resize(
+                size={"height": WIDTH_RESIZE, "width": num_slices},
+                interpolation="nearest",
+            ),
+        ]
+    )
+    keypoints = KeypointsOnImage([Keypoint(x=x, y=y) for x, y in xy], shape=image.shape)
+    image_original, keypoints_original = seq(image=image, keypoints=keypoints)
+
+    return image_original, keypoints_original.to_xy_array()
+
+
+def main() -> None:
+    """Script entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slices", type=int, nargs="+", default=[100, 300, 600])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(
+        f"{'transform':>9} {'slices':>6} {'imgaug [ms]':>11} {'index map [ms]':>14} "
+        f"{'preallocated [ms]':>17} {'first call [ms]':>15} {'speed-up':>8} {'identical':>9}"
+    )
+    for num_slices in args.slices:
+        image = rng.random((WIDTH_RESIZE, num_slices, 3))
+        forward_steps = (("resize", WIDTH_RESIZE, WIDTH_RESIZE), ("rot90", -1))
+        pixels = _imgaug_forward(image)
+        xy = rng.random((12, 2)) * WIDTH_RESIZE
+        inverse_steps = (("rot90", 1), ("resize", WIDTH_RESIZE, num_slices))
+
+        for name, input_image, steps, run_imgaug, run_index_map in (
+            (
+                "forward",
+                image,
+                forward_steps,
+                lambda image=image: (_imgaug_forward(image),),
+                lambda image=image, steps=forward_steps: (
+                    transform_image(image, steps),
+                ),
+            ),
+            (
+                "inverse",
+                pixels,
+                inverse_steps,
+                lambda pixels=pixels, xy=xy, num_slices=num_slices: _imgaug_inverse(
+                    pixels, xy, num_slices
+                ),
+                lambda pixels=pixels, xy=xy, steps=inverse_steps: (
+                    transform_image(pixels, steps),
+                    transform_keypoints(xy, pixels.shape[:2], steps),
+                ),
+            ),
+        ):
+            get_index_map.cache_clear()
+            start = time.perf_counter()
+            outputs = run_index_map()
+            first_call = 1000 * (time.perf_counter() - start)
+            identical = all(
+                np.array_equal(output, reference)
+                for output, reference in zip(outputs, run_imgaug())
+            )
+
+            imgaug_time = _time(run_imgaug, args.repeat)
+            index_time = _time(run_index_map, args.repeat)
+            out = np.empty_like(outputs[0])
+            preallocated_time = _time(
+                lambda image=input_image, steps=steps, out=out: transform_image(
+                    image, steps, out
+                ),
+                args.repeat,
+            )
+            print(
+                f"{name:>9} {num_slices:>6} {imgaug_time:>11.3f} {index_time:>14.3f} "
+                f"{preallocated_time:>17.3f} {first_call:>15.3f} "
+                f"{imgaug_time / index_time:>8.2f} {str(identical):>9}"
+            )
+
+
+if __name__ == "__main__":
+    main()
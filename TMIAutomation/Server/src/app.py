@@ -1,37 +1,52 @@
 """Module implementing the local server of the models."""
 
-import os
 import socket
 import logging
+from dataclasses import asdict, replace
+from multiprocessing import freeze_support
 from flask import Flask, Response, request, jsonify, abort
-import onnxruntime
 import yaml
 from src import config
-from src.pipeline import Pipeline, RequestInfo
+from src.batch import predict_batch as run_predict_batch, PipelineOutput
+from src.dicom.upload import UploadedPatient
+from src.pipeline import RequestInfo, get_ptv_roi_names
+from src.serving.jobs import Job, JobManager, JobQueueFullError, get_timings_json
+from src.serving.metrics import HTTP_IN_FLIGHT, HTTP_REQUESTS, count_error, render
+from src.serving.reload import HotReloader, ModelSet, get_models, set_models
+from src.serving.scheduler import SCHEDULERS, add_schedulers
+from src.serving.upload import UploadTooLargeError, receive_upload
+from src.serving.warmup import READINESS, load_models, start_warm_up
+from src.serving.workers import get_worker_pool
 
 app = Flask(__name__)
+job_manager = JobManager()
 
-try:
-    model_path = os.path.join(
-        "models", config.MODEL_DIR, f"{config.MODEL_NAME_BODY}.onnx"
-    )
-    config.ORT_SESSION_BODY = onnxruntime.InferenceSession(model_path)
-    logging.info("Loaded model %s from %s.", config.MODEL_NAME_BODY, model_path)
-except Exception:  # pylint: disable=broad-exception-caught
-    logging.exception(
-        "Could not load model %s from %s.", config.MODEL_NAME_BODY, model_path
-    )
+# The models are warmed up directly, not through the schedulers, to keep their statistics
+loaded_sessions = load_models()
+set_models(ModelSet(config.YML["coll_pelvis"], add_schedulers(loaded_sessions)))
 
-try:
-    model_path = os.path.join(
-        "models", config.MODEL_DIR, f"{config.MODEL_NAME_ARMS}.onnx"
-    )
-    config.ORT_SESSION_ARMS = onnxruntime.InferenceSession(model_path)
-    logging.info("Loaded model %s from %s.", config.MODEL_NAME_ARMS, model_path)
-except Exception:  # pylint: disable=broad-exception-caught
-    logging.exception(
-        "Could not load model %s from %s.", config.MODEL_NAME_ARMS, model_path
+
+def _get_endpoint_label() -> str:
+    """Route of the request, e.g. /jobs/<job_id>, to keep few label values in the metrics."""
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+@app.before_request
+def _start_request() -> None:
+    HTTP_IN_FLIGHT.inc((_get_endpoint_label(),))
+
+
+@app.after_request
+def _count_request(response: Response) -> Response:
+    HTTP_REQUESTS.inc(
+        (_get_endpoint_label(), request.method, str(response.status_code))
     )
+    return response
+
+
+@app.teardown_request
+def _finish_request(_: BaseException | None) -> None:
+    HTTP_IN_FLIGHT.dec((_get_endpoint_label(),))
 
 
 def _get_available_port() -> int | None:
@@ -58,43 +73,298 @@ def _get_available_port() -> int | None:
     return None
 
 
+def _to_json(pipeline_out: PipelineOutput) -> dict[str, list]:
+    """JSON content of the response to an inference request."""
+    return {
+        "Isocenters": pipeline_out[0].tolist(),
+        "Jaw_X": pipeline_out[1].tolist(),
+        "Jaw_Y": pipeline_out[2].tolist(),
+    }
+
+
+def _get_coll_pelvis(request_json: dict, models: ModelSet) -> bool:
+    """Collimator angle chosen by the JSON request, defaulting to that of the models.
+    Aborts with 400 if not a boolean."""
+    coll_pelvis = request_json.get("coll_pelvis", models.coll_pelvis)
+    if not isinstance(coll_pelvis, bool):
+        abort(400, description=f"Invalid coll_pelvis: {coll_pelvis}")
+
+    return coll_pelvis
+
+
+def _submit_job(request_json: dict, upload: UploadedPatient | None = None) -> Job:
+    """Queue the prediction job of the JSON request, or of the uploaded patient (upload/<PatientID>).
+    Aborts with 503 if the model is not available or the job queue is full."""
+    model_name = request_json["model_name"]
+    dicom_path = (
+        request_json["dicom_path"]
+        if upload is None
+        else f"upload/{upload.series.headers[0].get('PatientID', 'unknown')}"
+    )
+    ptv_name = request_json["ptv_name"]
+    oars_name = request_json["oars_name"]
+
+    models = get_models()
+    coll_pelvis = _get_coll_pelvis(request_json, models)
+    ort_session = models.get_session(model_name, coll_pelvis)
+    if ort_session is None:
+        count_error(model_name, coll_pelvis, 503)
+        abort(503)
+
+    try:
+        return job_manager.submit(
+            RequestInfo(model_name, dicom_path, ptv_name, oars_name, coll_pelvis),
+            ort_session,
+            models.worker_pool,
+            upload,
+        )
+    except JobQueueFullError as exc:
+        logging.warning("Rejected request: %s", exc)
+        count_error(model_name, coll_pelvis, 503)
+        abort(503, description=str(exc))
+
+
+def _job_to_json(job: Job) -> dict:
+    """JSON content of the response to a job status request."""
+    job_json = {
+        "Id": job.job_id,
+        "Status": job.status,
+        "Stages": job.stages,
+        "Coalesced": job.coalesced,
+    }
+    if job.result is not None:
+        job_json.update(_to_json(job.result))
+    if job.error is not None:
+        job_json["Error"] = job.error
+
+    return job_json
+
+
+def _wants_timings(request_json: dict) -> bool:
+    """Whether the request asks for the timings, with "timings": true or the X-Timings header."""
+    if request_json.get("timings") is True:
+        return True
+
+    return request.headers.get("X-Timings", "").lower() in ("1", "true")
+
+
+def _wait_for_result(job: Job, timings: bool) -> Response:
+    """Wait for the job and build the response to an inference request.
+    Aborts with the status code of the error if the job failed."""
+    job.wait()
+    if job.error is not None:
+        abort(job.error_status, description=job.error)
+
+    response_json = _to_json(job.result)
+    if timings:
+        response_json["Timings"] = get_timings_json(job)
+
+    return jsonify(response_json)
+
+
+def _get_upload_ptv_roi_names(request_json: dict) -> list[str]:
+    """Names of the PTV ROIs of the "request" field of an upload.
+
+    Raises:
+        ValueError: If the field has no valid ptv_name.
+    """
+    try:
+        return get_ptv_roi_names(request_json["ptv_name"])
+    except (KeyError, IndexError, TypeError) as exc:
+        raise ValueError(f'Invalid "request" field: {exc}') from exc
+
+
 @app.route("/predict", methods=["POST"])
 def predict() -> Response | None:
-    """Inference endpoint.
+    """Inference endpoint. The request is run as a job, waiting for its completion.
+    The optional boolean "coll_pelvis" chooses the model variant, defaulting to coll_pelvis in config.yml.
+    With "timings": true or the header X-Timings: 1, the response includes the "Timings".
 
     Returns:
         Response: Response object with application/json mime type containing the
-        isocenters, jaw X apertures, and jaw Y apertures in patient coordinate system.
+        isocenters, jaw X apertures, and jaw Y apertures in patient coordinate system,
+        and optionally the time in the queue and the wall and CPU time of each stage.
     """
     if request.method == "POST":
-        model_name = request.json["model_name"]
-        dicom_path = request.json["dicom_path"]
-        ptv_name = request.json["ptv_name"]
-        oars_name = request.json["oars_name"]
-
-        if model_name == config.MODEL_NAME_BODY and config.ORT_SESSION_BODY is not None:
-            ort_session = config.ORT_SESSION_BODY
-        elif (
-            model_name == config.MODEL_NAME_ARMS and config.ORT_SESSION_ARMS is not None
-        ):
-            ort_session = config.ORT_SESSION_ARMS
-        else:
-            abort(503)
+        job = _submit_job(request.json)
+        return _wait_for_result(job, _wants_timings(request.json))
+
+    return None
+
+
+@app.route("/predict_upload", methods=["POST"])
+def predict_upload() -> Response:
+    """Inference endpoint for a patient uploaded with the request, e.g. by a client whose DICOM folder
+    is not accessible by the server. The multipart/form-data body is parsed while it is streamed
+    (see src.serving.upload): a "request" field with the JSON fields of /predict except "dicom_path",
+    then the DICOM files of the CT series and RTSTRUCT, preferably the RTSTRUCT first.
+    The body is limited to max_upload_mb in config.yml.
+
+    Returns:
+        Response: Response object with application/json mime type containing the
+        isocenters, jaw X apertures, and jaw Y apertures in patient coordinate system,
+        and optionally the timings, the first being the "upload".
+    """
+    boundary = request.mimetype_params.get("boundary")
+    if request.mimetype != "multipart/form-data" or not boundary:
+        abort(400, description="Expected a multipart/form-data body.")
+    max_bytes = int(config.YML["max_upload_mb"] * 1024**2)
+    if (request.content_length or 0) > max_bytes:
+        abort(413, description=f"The upload exceeds {max_bytes} bytes.")
 
-        pipeline = Pipeline(
-            RequestInfo(model_name, dicom_path, ptv_name, oars_name),
+    try:
+        request_json, upload = receive_upload(
+            request.stream, boundary.encode(), max_bytes, _get_upload_ptv_roi_names
         )
-        pipeline_out = pipeline.predict(ort_session)
+    except UploadTooLargeError as exc:
+        abort(413, description=str(exc))
+    except ValueError as exc:
+        abort(400, description=f"Invalid upload: {exc}")
 
-        return jsonify(
-            {
-                "Isocenters": pipeline_out[0].tolist(),
-                "Jaw_X": pipeline_out[1].tolist(),
-                "Jaw_Y": pipeline_out[2].tolist(),
+    job = _submit_job(request_json, upload)
+    return _wait_for_result(job, _wants_timings(request_json))
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job() -> tuple[Response, int]:
+    """Asynchronous inference endpoint. The body has the same fields as /predict.
+
+    Returns:
+        tuple[Response, int]: Response object with application/json mime type containing the
+        job "Id" to poll at /jobs/<Id>, and the 202 status code.
+    """
+    job = _submit_job(request.json)
+    response = jsonify(_job_to_json(job))
+    response.headers["Location"] = f"/jobs/{job.job_id}"
+
+    return response, 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str) -> Response:
+    """Job status endpoint.
+
+    Args:
+        job_id (str): The job id returned by POST /jobs.
+
+    Returns:
+        Response: Response object with application/json mime type containing the job "Status"
+        (queued, running, done or failed), the state of each of the "Stages", the number of identical
+        requests "Coalesced" with the job, and either the
+        isocenters, jaw X apertures, and jaw Y apertures in patient coordinate system, or the "Error".
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        abort(404, description=f"Job {job_id} not found.")
+
+    return jsonify(_job_to_json(job))
+
+
+@app.route("/predict_batch", methods=["POST"])
+def predict_batch() -> Response:
+    """Batch inference endpoint. The body contains a list of requests with the same fields as /predict:
+    {"requests": [{"model_name": ..., "dicom_path": ..., "ptv_name": ..., "oars_name": ...}, ...]}
+    Requests of the same patient and ROIs share the preprocessing, also with different models or variants.
+
+    Returns:
+        Response: Response object with application/json mime type containing the list "results",
+        in the same order as the requests. Each result contains either the isocenters, jaw X apertures,
+        and jaw Y apertures in patient coordinate system, or the "Error" message and HTTP "Status" code.
+    """
+    models = get_models()
+    try:
+        request_infos = [
+            RequestInfo(
+                item["model_name"],
+                item["dicom_path"],
+                item["ptv_name"],
+                item["oars_name"],
+                _get_coll_pelvis(item, models),
+            )
+            for item in request.json["requests"]
+        ]
+    except (KeyError, TypeError) as exc:
+        abort(400, description=f"Invalid batch request: {exc}")
+
+    ort_sessions = {
+        model_key: ort_session
+        for model_key, ort_session in models.ort_sessions.items()
+        if ort_session is not None
+    }
+    results = run_predict_batch(request_infos, ort_sessions)
+
+    return jsonify(
+        {
+            "results": [
+                (
+                    _to_json(result.output)
+                    if result.output is not None
+                    else {"Error": result.error, "Status": result.status}
+                )
+                for result in results
+            ]
+        }
+    )
+
+
+@app.route("/inference_stats")
+def inference_stats() -> Response:
+    """Statistics of the micro-batching schedulers of the models (see src.serving.scheduler).
+
+    Returns:
+        Response: Response object with application/json mime type containing, for each model key
+        (e.g. body_cnn/5_355), the queue depth, the number of requests and batches, the distribution of the batch sizes,
+        and the total and maximum waiting time in seconds.
+    """
+    return jsonify(
+        {
+            model_key: asdict(scheduler.stats)
+            for model_key, scheduler in SCHEDULERS.items()
+        }
+    )
+
+
+@app.route("/metrics")
+def metrics() -> Response:
+    """Metrics endpoint in the Prometheus text format (see src.serving.metrics): the duration of
+    the stages of the pipeline, and the requests, errors and requests in flight,
+    by model name and variant, and by HTTP endpoint.
+
+    Returns:
+        Response: Response object with text/plain mime type containing the metrics.
+    """
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/ready")
+def ready() -> tuple[Response, int]:
+    """Readiness endpoint, to poll before sending requests after the server start.
+
+    Returns:
+        tuple[Response, int]: Response object with application/json mime type containing whether
+        the server is "Ready", the load and warm-up status and time in seconds of each of the "Models",
+        and the warm-up status of the pipeline "Modules". The status code is 200 if ready, 503 otherwise.
+    """
+    readiness_json = {
+        "Ready": READINESS.ready,
+        "Models": {
+            model_key: {
+                "Loaded": status.loaded,
+                "LoadSeconds": status.load_seconds,
+                "WarmedUp": status.warmed_up,
+                "WarmupSeconds": status.warmup_seconds,
+                "Error": status.error,
             }
-        )
+            for model_key, status in READINESS.models.items()
+        },
+        "Modules": {
+            "WarmedUp": READINESS.modules_warmed_up,
+            "WarmupSeconds": READINESS.modules_seconds,
+            "Error": READINESS.modules_error,
+        },
+    }
 
-    return None
+    return jsonify(readiness_json), 200 if READINESS.ready else 503
 
 
 @app.route("/")
@@ -124,6 +394,21 @@ def main() -> None:
 
         logging.info("Starting server on port: %i", port)
 
+        worker_pool = get_worker_pool()
+        if worker_pool is not None:
+            worker_pool.start()
+            set_models(replace(get_models(), worker_pool=worker_pool))
+
+        start_warm_up(loaded_sessions)
+        HotReloader().start()
+
+        if config.YML["watch_dir"]:
+            from src.dicom.watcher import (  # pylint: disable=import-outside-toplevel
+                StorageWatcher,
+            )
+
+            StorageWatcher(config.YML["watch_dir"]).start()
+
         if config.BUNDLED:
             # Running in PyInstaller bundle
             from waitress import serve  # pylint: disable=import-outside-toplevel
@@ -134,4 +419,5 @@ def main() -> None:
 
 
 if __name__ == "__main__":
+    freeze_support()  # worker processes in PyInstaller bundle
     main()
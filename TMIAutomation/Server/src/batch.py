@@ -0,0 +1,205 @@
+"""Module implementing the batched inference of several requests.
+
+Requests are processed in waves of at most max_batch_size requests:
+1) Each patient and set of ROIs is loaded and preprocessed once, whatever the number of models requested.
+2) The inputs of the same model are stacked and run in a single ONNX runtime call.
+3) Postprocessing and local optimization run in parallel for each request.
+"""
+
+import json
+import logging
+from contextlib import ExitStack
+from dataclasses import dataclass
+import numpy as np
+from onnxruntime import InferenceSession
+from src import config
+from src.dicom.loader import get_executor
+from src.pipeline import Pipeline, RequestInfo
+from src.serving.metrics import count_error, time_stage, track_request
+from src.serving.sessions import get_model_key
+
+# Isocenters, jaw X apertures, and jaw Y apertures in patient coordinate system
+PipelineOutput = tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+@dataclass
+class BatchResult:
+    """Result of a request of the batch: the pipeline output, or the error and its HTTP status code."""
+
+    output: PipelineOutput | None = None
+    error: str | None = None
+    status: int = 200
+
+
+def _get_preprocessing_key(request_info: RequestInfo) -> str:
+    """Requests with the same key share the same model input, whatever the model and its variant."""
+    return json.dumps(
+        [request_info.dicom_path, request_info.ptv_name, request_info.oars_name]
+    )
+
+
+def run_batched(ort_session: InferenceSession, model_inputs: np.ndarray) -> np.ndarray:
+    """Run the model on stacked inputs. If the model has a fixed batch size, or the batch is
+    larger than max_batch_size in config.yml, the inputs are run in chunks.
+
+    Args:
+        ort_session (InferenceSession): The ONNX runtime session.
+        model_inputs (np.ndarray): The inputs with shape (N, C, H, W).
+
+    Returns:
+        np.ndarray: The first output of the model, with shape (N, num_outputs).
+    """
+    model_input = ort_session.get_inputs()[0]
+    batch_size = model_input.shape[0]
+    if not isinstance(batch_size, int) or batch_size <= 0:
+        batch_size = config.YML["max_batch_size"]
+
+    outputs = []
+    for i in range(0, len(model_inputs), batch_size):
+        ort_inputs = {model_input.name: model_inputs[i : i + batch_size]}
+        outputs.append(ort_session.run(None, ort_inputs)[0])
+
+    return np.concatenate(outputs)
+
+
+def _preprocess(
+    request_infos: list[RequestInfo],
+    group: list[int],
+    pipelines: dict[int, Pipeline],
+    results: list[BatchResult],
+) -> None:
+    """Preprocess the first request of the group and copy the pipeline for the others."""
+    try:
+        pipeline = Pipeline(request_infos[group[0]])
+        pipeline.preprocess()
+    except (FileNotFoundError, ValueError) as exc:
+        logging.warning("Invalid request: %s", exc)
+        for i in group:
+            results[i] = BatchResult(error=str(exc), status=400)
+        return
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logging.exception(
+            "Could not preprocess %s.", request_infos[group[0]].dicom_path
+        )
+        for i in group:
+            results[i] = BatchResult(error=str(exc), status=500)
+        return
+
+    pipelines[group[0]] = pipeline
+    for i in group[1:]:
+        pipelines[i] = pipeline.copy_for(request_infos[i])
+
+
+def _predict_from_output(
+    pipeline: Pipeline, model_output: np.ndarray, local_opt: bool
+) -> BatchResult:
+    try:
+        return BatchResult(pipeline.predict_from_output(model_output, local_opt))
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logging.exception("Could not postprocess %s.", pipeline.patient_id)
+        return BatchResult(error=str(exc), status=500)
+
+
+def _predict_wave(
+    request_infos: list[RequestInfo],
+    wave: list[int],
+    ort_sessions: dict[str, InferenceSession],
+    results: list[BatchResult],
+    local_opt: bool,
+) -> None:
+    # Postprocessing reads the series with the pool of the DICOM loader, hence a separate pool
+    executor = get_executor("thread", config.YML["batch_workers"], "batch")
+
+    model_keys = {
+        i: get_model_key(request_infos[i].model_name, request_infos[i].coll_pelvis)
+        for i in wave
+    }
+    groups: dict[str, list[int]] = {}
+    for i in wave:
+        if model_keys[i] not in ort_sessions:
+            results[i] = BatchResult(
+                error=f"Model {model_keys[i]} is not available.", status=503
+            )
+        else:
+            groups.setdefault(_get_preprocessing_key(request_infos[i]), []).append(i)
+
+    pipelines: dict[int, Pipeline] = {}
+    for _ in executor.map(
+        lambda group: _preprocess(request_infos, group, pipelines, results),
+        groups.values(),
+    ):
+        pass
+
+    model_outputs: dict[int, np.ndarray] = {}
+    for model_key, ort_session in ort_sessions.items():
+        indexes = [i for i in sorted(pipelines) if model_keys[i] == model_key]
+        if not indexes:
+            continue
+
+        model_inputs = np.concatenate([pipelines[i].get_model_input() for i in indexes])
+        request_info = request_infos[indexes[0]]
+        try:
+            with time_stage(
+                "inference", request_info.model_name, pipelines[indexes[0]].coll_pelvis
+            ):
+                outputs = run_batched(ort_session, model_inputs)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            logging.exception("Could not run model %s.", model_key)
+            for i in indexes:
+                results[i] = BatchResult(error=str(exc), status=500)
+            continue
+
+        for k, i in enumerate(indexes):
+            model_outputs[i] = outputs[k : k + 1]
+
+    for i, result in zip(
+        model_outputs,
+        executor.map(
+            lambda i: _predict_from_output(pipelines[i], model_outputs[i], local_opt),
+            model_outputs,
+        ),
+    ):
+        results[i] = result
+
+
+def predict_batch(
+    request_infos: list[RequestInfo],
+    ort_sessions: dict[str, InferenceSession],
+    local_opt: bool = True,
+) -> list[BatchResult]:
+    """Execute the pipeline for several requests, sharing the preprocessing and batching the inference.
+    An invalid request does not prevent the others from completing.
+
+    Args:
+        request_infos (list[RequestInfo]): The requests.
+        ort_sessions (dict[str, InferenceSession]): The ONNX runtime session of each available model key,
+        e.g. body_cnn/5_355 (see src.serving.sessions).
+        local_opt (bool): Whether to perform the local optimization of the model's output
+        for the abdominal field geometry. Defaults to True.
+
+    Returns:
+        list[BatchResult]: The result of each request, in the same order as the requests.
+    """
+    results = [BatchResult() for _ in request_infos]
+
+    # Requests of the same patient are adjacent, so that they share the preprocessing
+    order = sorted(range(len(request_infos)), key=lambda i: request_infos[i].dicom_path)
+    wave_size = config.YML["max_batch_size"]
+    for start in range(0, len(order), wave_size):
+        wave = order[start : start + wave_size]
+        with ExitStack() as stack:
+            for i in wave:
+                stack.enter_context(
+                    track_request(
+                        request_infos[i].model_name, request_infos[i].coll_pelvis
+                    )
+                )
+            _predict_wave(request_infos, wave, ort_sessions, results, local_opt)
+
+    for request_info, result in zip(request_infos, results):
+        if result.error is not None:
+            count_error(
+                request_info.model_name, request_info.coll_pelvis, result.status
+            )
+
+    return results
@@ -0,0 +1,141 @@
+"""Module implementing a thread-safe LRU cache bounded by memory size."""
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+
+
+@dataclass
+class CacheStats:
+    """Counters of the cache usage."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+
+
+class LRUCache:
+    """Least-recently-used cache whose capacity is expressed in bytes.
+
+    The size of each entry is computed by the sizeof function. Since cached objects
+    can grow after insertion (e.g. lazily decoded pixel data), the sizes are refreshed
+    every time the cache is checked for eviction.
+    """
+
+    def __init__(self, name: str, max_bytes: int, sizeof: Callable[[Any], int]) -> None:
+        self.name = name
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+        self._loading: dict[Hashable, Future] = {}
+
+    @property
+    def stats(self) -> CacheStats:
+        """Snapshot of the cache counters."""
+        with self._lock:
+            return CacheStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                evictions=self._stats.evictions,
+                entries=len(self._entries),
+                size_bytes=self._size_bytes(),
+            )
+
+    def _size_bytes(self) -> int:
+        return sum(self._sizeof(value) for value in self._entries.values())
+
+    def _evict(self) -> None:
+        """Evict the least recently used entries until the cache fits in max_bytes.
+        The most recently used entry is always kept."""
+        size_bytes = self._size_bytes()
+        while size_bytes > self.max_bytes and len(self._entries) > 1:
+            _, value = self._entries.popitem(last=False)
+            size_bytes -= self._sizeof(value)
+            self._stats.evictions += 1
+
+    def get(self, key: Hashable) -> Any | None:
+        """Return the cached value and mark it as most recently used.
+
+        Args:
+            key (Hashable): The key of the entry.
+
+        Returns:
+            Any | None: The cached value. None if the key is not cached.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return self._entries[key]
+
+            self._stats.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Insert a value in the cache, evicting the least recently used entries if needed.
+
+        Args:
+            key (Hashable): The key of the entry.
+            value (Any): The value to cache.
+        """
+        if self.max_bytes <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Return the cached value or load it on a miss.
+        Concurrent misses on the same key wait for the first loader instead of loading twice.
+
+        Args:
+            key (Hashable): The key of the entry.
+            loader (Callable[[], Any]): Function returning the value to cache on a miss.
+
+        Returns:
+            Any: The cached or loaded value.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                logging.debug("%s cache hit.", self.name)
+                return self._entries[key]
+
+            self._stats.misses += 1
+            future = self._loading.get(key)
+            is_loader = future is None
+            if is_loader:
+                future = self._loading[key] = Future()
+
+        if not is_loader:
+            logging.debug("%s cache miss. Waiting for the ongoing load.", self.name)
+            return future.result()
+
+        logging.debug("%s cache miss.", self.name)
+        try:
+            value = loader()
+            self.put(key, value)
+            future.set_result(value)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+        return value
+
+    def clear(self) -> None:
+        """Remove all the entries from the cache."""
+        with self._lock:
+            self._entries.clear()
@@ -29,14 +29,36 @@ logging.basicConfig(
     format="%(asctime)s:%(name)s:%(levelname)s:%(message)s",
 )
 
-with open("config.yml", "r", encoding="utf-8") as stream:
-    try:
-        YML = yaml.safe_load(stream)
-        logging.getLogger().setLevel(YML["log_level"])
-    except yaml.YAMLError as exc:
-        logging.error(exc)
-
-if YML["coll_pelvis"]:
-    MODEL_DIR: str = "5_355"
-else:
-    MODEL_DIR: str = "90"
+
+def read_yml() -> dict:
+    """Read config.yml.
+
+    Raises:
+        yaml.YAMLError: If the file is not valid YAML.
+
+    Returns:
+        dict: The configuration.
+    """
+    with open("config.yml", "r", encoding="utf-8") as stream:
+        return yaml.safe_load(stream)
+
+
+def get_model_dir(coll_pelvis: bool) -> str:
+    """Folder of the models for the collimator angle of the pelvis fields.
+
+    Args:
+        coll_pelvis (bool): Whether the pelvis fields have collimator angles 5 and 355 degrees.
+
+    Returns:
+        str: The folder name inside models, 5_355 or 90.
+    """
+    return "5_355" if coll_pelvis else "90"
+
+
+try:
+    YML = read_yml()
+    logging.getLogger().setLevel(YML["log_level"])
+except yaml.YAMLError as exc:
+    logging.error(exc)
+
+MODEL_DIR: str = get_model_dir(YML["coll_pelvis"])
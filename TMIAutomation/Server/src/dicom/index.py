@@ -0,0 +1,333 @@
+"""Module implementing the persistent index of the DICOM storage folder.
+
+The index is a SQLite table with one row per DICOM file: patient, study, series and SOP instance UIDs,
+modality, slice position of the images, and series referenced by the RTSTRUCTs.
+It is updated incrementally: only the files whose modification time or size changed are read again,
+so that a request resolves the RTSTRUCT and its CT slices without opening the other files of the folder.
+The modification times of the folder and of its subfolders are also indexed: while they and the
+RTSTRUCTs are unchanged, no file was added, removed or renamed, and the folder is not listed again.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator
+from pydicom import dcmread
+from pydicom.errors import InvalidDicomError
+from rt_utils.image_helper import get_slice_position
+from src import config
+from src.dicom.loader import get_executor
+
+INDEX_TAGS: list[str] = [
+    "PatientID",
+    "StudyInstanceUID",
+    "SeriesInstanceUID",
+    "SOPInstanceUID",
+    "Modality",
+    "ImagePositionPatient",
+    "ImageOrientationPatient",
+    "ReferencedFrameOfReferenceSequence",
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    patient_id TEXT,
+    study_uid TEXT,
+    series_uid TEXT,
+    sop_uid TEXT,
+    modality TEXT,
+    slice_position REAL,
+    referenced_series_uid TEXT
+);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+CREATE INDEX IF NOT EXISTS files_series ON files (series_uid);
+CREATE TABLE IF NOT EXISTS directories (
+    folder TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (folder, path)
+);
+"""
+
+# Directories modified more recently are listed again at the next update, since the modification
+# time has a coarse resolution on some file systems (e.g. 2 s on FAT)
+SETTLED_NS: int = 2 * 10**9
+
+# Row of the files table without the path and folder columns
+IndexEntry = tuple[
+    int,
+    int,
+    str | None,
+    str | None,
+    str | None,
+    str | None,
+    str | None,
+    float | None,
+    str | None,
+]
+
+
+@dataclass
+class IndexedSeries:
+    """RTSTRUCT of a patient folder and the CT slices of the series it references."""
+
+    rt_struct_path: str
+    series_uid: str
+    paths: list[str]  # CT slices sorted by slice position
+    # (relative path, mtime in ns, size) of the RTSTRUCT and CT slices
+    fingerprint: tuple[tuple[str, int, int], ...]
+
+
+def _get_referenced_series_uid(ds) -> str | None:
+    """SeriesInstanceUID of the image series referenced by an RTSTRUCT."""
+    try:
+        return (
+            ds.ReferencedFrameOfReferenceSequence[0]
+            .RTReferencedStudySequence[0]
+            .RTReferencedSeriesSequence[0]
+            .SeriesInstanceUID
+        )
+    except (AttributeError, IndexError):
+        return None
+
+
+def _scan_folder(folder: str) -> tuple[dict[str, tuple[int, int]], dict[str, int]]:
+    """List the files of a folder and its subfolders, except the hidden subfolders.
+
+    Returns:
+        tuple[dict[str, tuple[int, int]], dict[str, int]]: The (mtime in ns, size) of each file,
+        and the modification time of each directory, -1 if it may still change unnoticed.
+    """
+    files: dict[str, tuple[int, int]] = {}
+    directories: dict[str, int] = {}
+    settled_ns = time.time_ns() - SETTLED_NS
+    pending = [folder]
+    while pending:
+        directory = pending.pop()
+        try:
+            # Read before listing: files added meanwhile change it again
+            mtime_ns = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if not entry.name.startswith("."):
+                            pending.append(entry.path)
+                    else:
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            continue  # removed while listing
+        directories[directory] = mtime_ns if mtime_ns < settled_ns else -1
+
+    return files, directories
+
+
+def _read_entry(path: str, mtime_ns: int, size: int) -> IndexEntry:
+    """Read the indexed tags of a file. Files that are not valid DICOM are indexed with null tags."""
+    try:
+        ds = dcmread(path, stop_before_pixels=True, specific_tags=INDEX_TAGS)
+    except (InvalidDicomError, OSError):
+        return mtime_ns, size, None, None, None, None, None, None, None
+
+    modality = ds.get("Modality")
+    slice_position = None
+    if "ImagePositionPatient" in ds and "ImageOrientationPatient" in ds:
+        try:
+            slice_position = float(get_slice_position(ds))
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.warning("Invalid image orientation in %s.", path)
+
+    return (
+        mtime_ns,
+        size,
+        ds.get("PatientID"),
+        ds.get("StudyInstanceUID"),
+        ds.get("SeriesInstanceUID"),
+        ds.get("SOPInstanceUID"),
+        modality,
+        slice_position,
+        _get_referenced_series_uid(ds) if modality == "RTSTRUCT" else None,
+    )
+
+
+class DicomIndex:
+    """SQLite index of the DICOM files, grouped by patient folder.
+    A new connection is opened for each call, so that the index can be used from several threads.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._folder_locks: dict[str, threading.Lock] = {}
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection, committing the transaction on exit."""
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _get_folder_lock(self, folder: str) -> threading.Lock:
+        with self._lock:
+            return self._folder_locks.setdefault(folder, threading.Lock())
+
+    def _is_unchanged(self, connection: sqlite3.Connection, folder: str) -> bool:
+        """Whether the indexed folder had no file added, removed or renamed, and no RTSTRUCT modified.
+        Only the directories and the RTSTRUCTs are checked, not the other files."""
+        directories = connection.execute(
+            "SELECT path, mtime_ns FROM directories WHERE folder = ?", (folder,)
+        ).fetchall()
+        rt_structs = connection.execute(
+            "SELECT path, mtime_ns, size FROM files "
+            "WHERE folder = ? AND modality = 'RTSTRUCT'",
+            (folder,),
+        ).fetchall()
+        if not directories:
+            return False
+
+        try:
+            if any(
+                os.stat(path).st_mtime_ns != mtime_ns for path, mtime_ns in directories
+            ):
+                return False
+            for path, mtime_ns, size in rt_structs:
+                stat = os.stat(path)
+                if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+                    return False
+        except OSError:
+            return False
+
+        return True
+
+    def update(self, dicom_path: str) -> None:
+        """Bring the index of a patient folder up to date.
+        The folder is listed only if a directory or RTSTRUCT changed since the last update.
+        Then only new or modified files are read, and deleted files are removed from the index.
+
+        Args:
+            dicom_path (str): Path to the folder containing the DICOM files.
+        """
+        folder = os.path.abspath(dicom_path)
+        # Updates of a folder are serialized, so that concurrent requests read the new files
+        # only once. Other folders are updated in parallel
+        with self._get_folder_lock(folder):
+            with self._connect() as connection:
+                if self._is_unchanged(connection, folder):
+                    return
+
+                indexed = {
+                    path: (mtime_ns, size)
+                    for path, mtime_ns, size in connection.execute(
+                        "SELECT path, mtime_ns, size FROM files WHERE folder = ?",
+                        (folder,),
+                    )
+                }
+
+            files, directories = _scan_folder(folder)
+            changed = [
+                path for path, stat in files.items() if indexed.get(path) != stat
+            ]
+            deleted = [(path,) for path in indexed.keys() - files.keys()]
+            entries = list(
+                get_executor("thread", config.YML["decode_workers"]).map(
+                    lambda path: _read_entry(path, *files[path]), changed
+                )
+            )
+
+            with self._connect() as connection:
+                connection.executemany("DELETE FROM files WHERE path = ?", deleted)
+                connection.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(path, folder, *entry) for path, entry in zip(changed, entries)],
+                )
+                connection.execute(
+                    "DELETE FROM directories WHERE folder = ?", (folder,)
+                )
+                connection.executemany(
+                    "INSERT INTO directories VALUES (?, ?, ?)",
+                    [
+                        (folder, path, mtime_ns)
+                        for path, mtime_ns in directories.items()
+                    ],
+                )
+
+        if changed or deleted:
+            logging.info(
+                "DICOM index of %s: %d files read, %d removed.",
+                dicom_path,
+                len(changed),
+                len(deleted),
+            )
+
+    def find_series(self, dicom_path: str) -> IndexedSeries | None:
+        """Find the RTSTRUCT of a patient folder and the CT slices of the series it references.
+        If the folder has several RTSTRUCTs, the most recently modified one with CT slices is used.
+
+        Args:
+            dicom_path (str): Path to the folder containing the DICOM files.
+
+        Returns:
+            IndexedSeries | None: The RTSTRUCT and its CT slices. None if the folder has no RTSTRUCT
+            referencing a CT series in the folder.
+        """
+        folder = os.path.abspath(dicom_path)
+        with self._connect() as connection:
+            rt_structs = connection.execute(
+                "SELECT path, mtime_ns, size, referenced_series_uid FROM files "
+                "WHERE folder = ? AND modality = 'RTSTRUCT' ORDER BY mtime_ns DESC",
+                (folder,),
+            ).fetchall()
+            for rt_struct_path, mtime_ns, size, series_uid in rt_structs:
+                slices = connection.execute(
+                    "SELECT path, mtime_ns, size FROM files "
+                    "WHERE folder = ? AND series_uid = ? AND modality = 'CT' "
+                    "AND slice_position IS NOT NULL ORDER BY slice_position",
+                    (folder, series_uid),
+                ).fetchall()
+                if slices:
+                    fingerprint = sorted(
+                        (os.path.relpath(path, folder), mtime_ns, size)
+                        for path, mtime_ns, size in [
+                            (rt_struct_path, mtime_ns, size),
+                            *slices,
+                        ]
+                    )
+                    return IndexedSeries(
+                        rt_struct_path,
+                        series_uid,
+                        [path for path, _, _ in slices],
+                        tuple(fingerprint),
+                    )
+
+        return None
+
+
+_INDEX: DicomIndex | None = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index() -> DicomIndex | None:
+    """Get the index at dicom_index_path in config.yml, opening it at the first call.
+
+    Returns:
+        DicomIndex | None: The index. None if dicom_index_path is empty.
+    """
+    global _INDEX  # pylint: disable=global-statement
+    with _INDEX_LOCK:
+        if _INDEX is None and config.YML["dicom_index_path"]:
+            _INDEX = DicomIndex(config.YML["dicom_index_path"])
+
+    return _INDEX
@@ -0,0 +1,110 @@
+"""Module implementing the parallel reading and decoding of the slices of a DICOM series."""
+
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Literal
+import numpy as np
+from pydicom import Dataset, dcmread
+from pydicom.errors import InvalidDicomError
+from src import config
+
+ExecutorType = Literal["thread", "process"]
+
+_EXECUTORS: dict[tuple[str, ExecutorType, int], Executor] = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def get_executor(
+    executor_type: ExecutorType, workers: int, name: str = "dicom-loader"
+) -> Executor:
+    """Get a shared pool, creating it at the first call. By default, the pool used to read and
+    decode the slices. The tasks of a pool must not wait for other tasks of the same pool.
+
+    Args:
+        executor_type (ExecutorType): "thread" or "process" pool.
+        workers (int): Number of workers of the pool.
+        name (str): Name of the pool, the prefix of the names of its threads.
+        Defaults to "dicom-loader".
+
+    Returns:
+        Executor: The pool.
+    """
+    with _EXECUTORS_LOCK:
+        key = (name, executor_type, workers)
+        if key not in _EXECUTORS:
+            if executor_type == "thread":
+                _EXECUTORS[key] = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=name
+                )
+            elif executor_type == "process":
+                _EXECUTORS[key] = ProcessPoolExecutor(max_workers=workers)
+            else:
+                raise ValueError(
+                    f'executor_type must be "thread" or "process" but was {executor_type}'
+                )
+
+        return _EXECUTORS[key]
+
+
+def _read_header(path: str) -> Dataset | None:
+    try:
+        return dcmread(path, stop_before_pixels=True)
+    except (InvalidDicomError, OSError):
+        return None
+
+
+def _decode(path: str) -> np.ndarray:
+    return dcmread(path).pixel_array
+
+
+def read_headers(paths: list[str], workers: int | None = None) -> list[Dataset | None]:
+    """Parse the headers of the DICOM files in parallel, stopping before the pixel data.
+    Headers are always read by threads, since the work is I/O bound.
+
+    Args:
+        paths (list[str]): Paths to the files.
+        workers (int | None): Number of threads. Defaults to decode_workers in config.yml.
+
+    Returns:
+        list[Dataset | None]: The header of each file, None if the file is not a valid DICOM.
+    """
+    workers = workers or config.YML["decode_workers"]
+    if workers <= 1:
+        return [_read_header(path) for path in paths]
+
+    return list(get_executor("thread", workers).map(_read_header, paths))
+
+
+def decode_into(
+    paths: list[str],
+    out: np.ndarray,
+    workers: int | None = None,
+    executor_type: ExecutorType | None = None,
+) -> None:
+    """Decode the pixel data of the slices in parallel, writing each slice into the preallocated volume.
+
+    Args:
+        paths (list[str]): Paths to the slice files, in the order of the volume.
+        out (np.ndarray): Volume with shape (num_slices, rows, columns), e.g. a memory-mapped array.
+        workers (int | None): Number of workers. Defaults to decode_workers in config.yml.
+        executor_type (ExecutorType | None): "thread" or "process" pool. Defaults to decode_executor in config.yml.
+    """
+    workers = workers or config.YML["decode_workers"]
+    executor_type = executor_type or config.YML["decode_executor"]
+    if workers <= 1:
+        for i, path in enumerate(paths):
+            out[i] = _decode(path)
+        return
+
+    executor = get_executor(executor_type, workers)
+    if executor_type == "thread":
+        # Each thread writes its slice directly into the volume
+        def _decode_slice(i: int) -> None:
+            out[i] = _decode(paths[i])
+
+        for _ in executor.map(_decode_slice, range(len(paths))):
+            pass
+    else:
+        # Decoded slices are sent back by the worker processes, in order
+        for i, pixel_array in enumerate(executor.map(_decode, paths, chunksize=8)):
+            out[i] = pixel_array
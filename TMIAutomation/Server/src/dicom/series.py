@@ -0,0 +1,178 @@
+"""Module implementing the lazy reader of a CT series:
+headers are parsed upfront, pixel data are decoded only when needed."""
+
+import os
+import glob
+import threading
+import numpy as np
+from pydicom import Dataset, dcmread
+from rt_utils import RTStruct, RTStructBuilder
+from rt_utils.image_helper import get_slice_position
+from src.dicom.loader import read_headers
+from src.dicom.volume_store import get_volume_dtype, open_volume
+
+
+def _is_image_slice(ds: Dataset) -> bool:
+    """Whether the header belongs to an image slice that can be placed in the 3D volume."""
+    return "ImagePositionPatient" in ds and "Rows" in ds and "Columns" in ds
+
+
+class LazySeries:
+    """CT series sorted by slice position (same order as rt_utils).
+
+    Only the headers are kept in memory after construction: they are enough to compute
+    the image geometry, the pixel<->patient transformation and the ROI masks.
+    The pixel data are decoded at the first access to the volume and kept in the volume store.
+    """
+
+    def __init__(
+        self, paths: list[str], headers: list[Dataset], dicom_path: str | None = None
+    ) -> None:
+        if len(headers) == 0:
+            raise ValueError("No DICOM images found in the series.")
+
+        order = sorted(
+            range(len(headers)), key=lambda i: get_slice_position(headers[i])
+        )
+        self.paths = [paths[i] for i in order]
+        self.headers = [headers[i] for i in order]
+        self.dicom_path = dicom_path
+        self._volume: np.ndarray | None = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_folder(cls, dicom_path: str) -> "LazySeries":
+        """Parse the headers of all the image slices in the folder, stopping before the pixel data.
+
+        Args:
+            dicom_path (str): Path to the folder containing the CT series.
+
+        Returns:
+            LazySeries: The series with parsed headers and no decoded pixel data.
+        """
+        file_paths = [
+            os.path.join(root, file)
+            for root, _, files in os.walk(dicom_path)
+            for file in files
+        ]
+        paths, headers = [], []
+        for path, ds in zip(file_paths, read_headers(file_paths)):
+            if ds is not None and _is_image_slice(ds):
+                paths.append(path)
+                headers.append(ds)
+
+        return cls(paths, headers, dicom_path)
+
+    @classmethod
+    def from_decoded(
+        cls, paths: list[str], headers: list[Dataset], pixel_arrays: list[np.ndarray]
+    ) -> "LazySeries":
+        """Series whose pixel data are already decoded, e.g. uploaded to the server.
+        The volume is kept in memory instead of the volume store.
+
+        Args:
+            paths (list[str]): Names of the slice files.
+            headers (list[Dataset]): The headers of the slices.
+            pixel_arrays (list[np.ndarray]): The decoded pixel data of each slice.
+
+        Returns:
+            LazySeries: The series with its volume.
+        """
+        series = cls(paths, headers)
+        pixel_arrays_by_header = {
+            id(header): pixel_array
+            for header, pixel_array in zip(headers, pixel_arrays)
+        }
+        volume = np.empty((len(series), *series.shape), dtype=get_volume_dtype(series))
+        for i, header in enumerate(series.headers):
+            volume[i] = pixel_arrays_by_header[id(header)]
+        volume.flags.writeable = False
+        series._volume = volume
+
+        return series
+
+    def __len__(self) -> int:
+        return len(self.headers)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """Shape (rows, columns) of each slice."""
+        return int(self.headers[0].Rows), int(self.headers[0].Columns)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the decoded pixel data. Memory-mapped volumes are not counted."""
+        if self._volume is None or isinstance(self._volume, np.memmap):
+            return 0
+
+        return self._volume.nbytes
+
+    def volume(self) -> np.ndarray:
+        """Read-only volume of the stored pixel values, with shape (num_slices, rows, columns).
+        The volume is memory-mapped from the volume store (see src.dicom.volume_store).
+
+        Returns:
+            np.ndarray: The CT volume, axis0=z, axis1=y, axis2=x.
+        """
+        with self._lock:
+            if self._volume is None:
+                self._volume = open_volume(self)
+
+        return self._volume
+
+    def pixel_array(self, index: int) -> np.ndarray:
+        """Pixel values of a slice, read from the volume.
+
+        Args:
+            index (int): Index of the slice in the sorted series.
+
+        Returns:
+            np.ndarray: The stored pixel values of the slice with shape (rows, columns).
+        """
+        return self.volume()[index]
+
+
+def find_rt_struct_path(dicom_path: str) -> str | None:
+    """Find the RTSTRUCT file in a patient folder, named RTSTRUCT* or RS*.
+
+    Args:
+        dicom_path (str): Path to the folder containing the CT series and RTSTRUCT.
+
+    Returns:
+        str | None: Path to the first RTSTRUCT found. None if the folder has no RTSTRUCT.
+    """
+    for pattern in ("RTSTRUCT*", "RS*"):
+        rt_struct_paths = glob.glob(os.path.join(dicom_path, pattern))
+        if rt_struct_paths:
+            return rt_struct_paths[0]
+
+    return None
+
+
+def load_rtstruct_header_only(series: LazySeries, rt_struct_path: str) -> RTStruct:
+    """Read the RTSTRUCT and validate it against the headers of the CT series.
+
+    Args:
+        series (LazySeries): The CT series referenced by the RTSTRUCT.
+        rt_struct_path (str): Path to the RTSTRUCT file.
+
+    Returns:
+        RTStruct: The rt_utils wrapper, whose series_data are the headers of the series.
+    """
+    return load_rtstruct_dataset(series, dcmread(rt_struct_path))
+
+
+def load_rtstruct_dataset(series: LazySeries, ds: Dataset) -> RTStruct:
+    """Validate the RTSTRUCT dataset against the headers of the CT series.
+
+    Args:
+        series (LazySeries): The CT series referenced by the RTSTRUCT.
+        ds (Dataset): The RTSTRUCT dataset.
+
+    Returns:
+        RTStruct: The rt_utils wrapper, whose series_data are the headers of the series.
+    """
+    RTStructBuilder.validate_rtstruct(ds)
+    RTStructBuilder.validate_rtstruct_series_references(ds, series.headers)
+
+    return RTStruct(series.headers, ds)
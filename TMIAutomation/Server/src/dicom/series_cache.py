@@ -0,0 +1,180 @@
+"""Module implementing the process-wide cache of the loaded CT series and RTSTRUCT."""
+
+import os
+import sqlite3
+import logging
+from pydicom import dcmread
+from pydicom.errors import InvalidDicomError
+from rt_utils import RTStruct
+from src import config
+from src.cache import LRUCache
+from src.dicom.index import IndexedSeries, get_index
+from src.dicom.loader import read_headers
+from src.dicom.series import (
+    LazySeries,
+    find_rt_struct_path,
+    load_rtstruct_header_only,
+)
+
+FolderFingerprint = tuple[tuple[str, int, int], ...]
+
+# Rough size of a parsed CT header kept in memory
+HEADER_BYTES: int = 16 * 1024
+
+
+def get_folder_fingerprint(dicom_path: str) -> FolderFingerprint:
+    """Compute the fingerprint of a DICOM folder from its file list, modification times and sizes.
+
+    Args:
+        dicom_path (str): Path to the folder containing the DICOM files.
+
+    Returns:
+        FolderFingerprint: Sorted tuple of (relative path, mtime in ns, size in bytes) for each file.
+    """
+    fingerprint = []
+    for root, _, files in os.walk(dicom_path):
+        for file in files:
+            stat = os.stat(os.path.join(root, file))
+            fingerprint.append(
+                (
+                    os.path.relpath(os.path.join(root, file), dicom_path),
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                )
+            )
+
+    return tuple(sorted(fingerprint))
+
+
+def get_series_instance_uid(dicom_path: str, fingerprint: FolderFingerprint) -> str:
+    """Read the SeriesInstanceUID of the CT series from the header of the first CT slice in the folder.
+
+    Args:
+        dicom_path (str): Path to the folder containing the DICOM files.
+        fingerprint (FolderFingerprint): The fingerprint of the folder.
+
+    Returns:
+        str: The SeriesInstanceUID of the CT series. Empty string if no CT slice is found.
+    """
+    for file, _, _ in fingerprint:
+        try:
+            ds = dcmread(
+                os.path.join(dicom_path, file),
+                stop_before_pixels=True,
+                specific_tags=["Modality", "SeriesInstanceUID"],
+            )
+        except (InvalidDicomError, OSError):
+            continue
+
+        if ds.get("Modality") == "CT":
+            return ds.get("SeriesInstanceUID", "")
+
+    return ""
+
+
+def _sizeof_series(entry: tuple[LazySeries, RTStruct]) -> int:
+    """Approximate memory footprint of the cached series: parsed headers and in-memory pixel data."""
+    return len(entry[0]) * HEADER_BYTES + entry[0].nbytes
+
+
+SERIES_CACHE = LRUCache(
+    "DICOM series",
+    max_bytes=config.YML["dicom_cache_mb"] * 1024**2,
+    sizeof=_sizeof_series,
+)
+
+
+def _load_series(dicom_path: str, rt_struct_path: str) -> tuple[LazySeries, RTStruct]:
+    series = LazySeries.from_folder(dicom_path)
+    return series, load_rtstruct_header_only(series, rt_struct_path)
+
+
+def _log_stats() -> None:
+    stats = SERIES_CACHE.stats
+    logging.info(
+        "DICOM series cache: %d hits, %d misses, %d entries, %.1f MB.",
+        stats.hits,
+        stats.misses,
+        stats.entries,
+        stats.size_bytes / 1024**2,
+    )
+
+
+def load_series(dicom_path: str, rt_struct_path: str) -> tuple[LazySeries, RTStruct]:
+    """Load the CT series headers and RTSTRUCT, reusing the cached copy if the folder did not change.
+    The cached series keeps the volume opened by previous requests.
+
+    Args:
+        dicom_path (str): Path to the folder containing the CT series.
+        rt_struct_path (str): Path to the RTSTRUCT file.
+
+    Returns:
+        tuple[LazySeries, RTStruct]: The lazy CT series and the RTSTRUCT wrapper built on its headers.
+    """
+    fingerprint = get_folder_fingerprint(dicom_path)
+    key = (
+        get_series_instance_uid(dicom_path, fingerprint),
+        os.path.basename(rt_struct_path),
+        fingerprint,
+    )
+    entry = SERIES_CACHE.get_or_load(
+        key, lambda: _load_series(dicom_path, rt_struct_path)
+    )
+    _log_stats()
+
+    return entry
+
+
+def _load_indexed_series(
+    dicom_path: str, indexed_series: IndexedSeries
+) -> tuple[LazySeries, RTStruct]:
+    series = LazySeries(
+        indexed_series.paths, read_headers(indexed_series.paths), dicom_path
+    )
+    return series, load_rtstruct_header_only(series, indexed_series.rt_struct_path)
+
+
+def load_patient_series(dicom_path: str) -> tuple[LazySeries, RTStruct]:
+    """Load the RTSTRUCT of a patient folder and the CT series it references.
+
+    With dicom_index_path set in config.yml, the files are resolved through the DICOM index
+    (see src.dicom.index): only the RTSTRUCT and the slices of its series are opened.
+    Otherwise, or if the index cannot be used, the first RTSTRUCT* or RS* file and all
+    the images in the folder are loaded.
+
+    Args:
+        dicom_path (str): Path to the folder containing the CT series and RTSTRUCT.
+
+    Raises:
+        FileNotFoundError: If the folder has no RTSTRUCT.
+
+    Returns:
+        tuple[LazySeries, RTStruct]: The lazy CT series and the RTSTRUCT wrapper built on its headers.
+    """
+    indexed_series = None
+    try:
+        index = get_index()
+        if index is not None:
+            index.update(dicom_path)
+            indexed_series = index.find_series(dicom_path)
+    except sqlite3.Error:
+        logging.exception("Could not use the DICOM index. Scanning %s.", dicom_path)
+
+    if indexed_series is not None:
+        key = (
+            indexed_series.series_uid,
+            os.path.basename(indexed_series.rt_struct_path),
+            indexed_series.fingerprint,
+        )
+        entry = SERIES_CACHE.get_or_load(
+            key, lambda: _load_indexed_series(dicom_path, indexed_series)
+        )
+        _log_stats()
+
+        return entry
+
+    rt_struct_path = find_rt_struct_path(dicom_path)
+    if rt_struct_path is None:
+        raise FileNotFoundError(f"No RTSTRUCT found in {dicom_path}.")
+
+    return load_series(dicom_path, rt_struct_path)
@@ -0,0 +1,251 @@
+"""Module implementing the reception of the DICOM files of a patient uploaded to the server.
+
+The files are parsed in memory as they are received, and never written to disk. The pixel data
+of each CT slice are decoded by the loader threads while the next files arrive. Once the RTSTRUCT,
+the names of the PTV ROIs and a first slice are received, the PTV contours are grouped by slice
+and each decoded slice is also projected along the coronal direction (see src.projection),
+so that the projections of the PTV are ready at the end of the upload.
+
+The contours are converted to pixels with the geometry of the first slice received. The in-plane
+transformation does not depend on the position of the slice along z: the projections are
+used only if it equals that of the sorted series, which is checked at the end of the upload.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from io import BytesIO
+import numpy as np
+from pydicom import Dataset, dcmread
+from pydicom.errors import InvalidDicomError
+from rt_utils import RTStruct
+from rt_utils.image_helper import get_patient_to_pixel_transformation_matrix
+from src import config
+from src.dicom.loader import get_executor
+from src.dicom.series import LazySeries, _is_image_slice, load_rtstruct_dataset
+from src.projection import CoronalAccumulator, SliceProjection, project_slice
+from src.roi.rasterize import fill_slice_mask, group_contours_by_uid
+from src.serving.metrics import StageTiming
+
+
+@dataclass
+class _UploadedSlice:
+    """CT slice received, with its pixel data once decoded."""
+
+    name: str
+    header: Dataset
+    pixel_array: np.ndarray | None = None
+    projection: SliceProjection | None = None
+
+
+@dataclass
+class UploadedPatient:
+    """CT series and RTSTRUCT of an uploaded patient."""
+
+    series: LazySeries  # with the decoded volume
+    rtstruct: RTStruct
+    # Mean HU density inside the PTV and PTV mask projected along the coronal direction
+    # (see Pipeline._get_ptv_projections). None if they could not be computed during the upload
+    ptv_projections: tuple[np.ndarray, np.ndarray] | None = None
+    ptv_roi_names: list[str] = field(default_factory=list)
+    # Timing of the upload, first of the timings of the job
+    timings: list[StageTiming] = field(default_factory=list)
+
+
+class SeriesReceiver:
+    """Receive the DICOM files of a patient one at a time, e.g. from a streamed upload.
+    Files that are not DICOM, and images that cannot be placed in the volume, are skipped.
+    Only the first RTSTRUCT is used.
+    """
+
+    def __init__(self, workers: int | None = None) -> None:
+        self._workers = workers or config.YML["decode_workers"]
+        self._slices: list[_UploadedSlice] = []
+        self._futures: list[Future] = []
+        self._rtstruct_ds: Dataset | None = None
+        self._ptv_roi_names: list[str] | None = None
+        # Slice whose geometry is used to convert the contours to pixels
+        self._reference_header: Dataset | None = None
+        self._transformation_matrix: np.ndarray | None = None
+        # Polygons in pixel coordinates of the PTV ROIs on each slice, by SOPInstanceUID
+        self._ptv_contours: dict[str, list[list[np.ndarray]]] | None = None
+        self._lock = threading.Lock()
+
+    def add_file(self, name: str, data: bytes) -> None:
+        """Parse a DICOM file and start the decoding of its pixel data, if it is a CT slice.
+
+        Args:
+            name (str): Name of the file, used in the log messages.
+            data (bytes): Content of the file.
+        """
+        try:
+            ds = dcmread(BytesIO(data))
+        except (InvalidDicomError, EOFError, OSError):
+            logging.warning("Skipped uploaded file %s: not a valid DICOM.", name)
+            return
+
+        if ds.get("Modality") == "RTSTRUCT":
+            if self._rtstruct_ds is None:
+                self._rtstruct_ds = ds
+                self._group_ptv_contours()
+            return
+
+        if not _is_image_slice(ds) or "PixelData" not in ds:
+            return
+
+        uploaded_slice = _UploadedSlice(name, ds)
+        with self._lock:
+            self._slices.append(uploaded_slice)
+        if self._reference_header is None:
+            self._reference_header = ds
+            self._group_ptv_contours()
+
+        self._submit(self._decode, uploaded_slice)
+
+    def set_ptv_roi_names(self, roi_names: list[str]) -> None:
+        """Set the names of the ROIs whose union defines the PTV, to project the slices during the upload.
+
+        Args:
+            roi_names (list[str]): The names of the PTV ROIs (see src.pipeline.get_ptv_roi_names).
+        """
+        if self._ptv_roi_names is None:
+            self._ptv_roi_names = list(roi_names)
+            self._group_ptv_contours()
+
+    def finish(self) -> UploadedPatient:
+        """Wait for the decoding of all the slices and build the series.
+
+        Raises:
+            ValueError: If no CT slice or no RTSTRUCT was received.
+
+        Returns:
+            UploadedPatient: The series and RTSTRUCT, validated as in src.dicom.series.load_rtstruct_header_only.
+        """
+        for future in self._futures:
+            future.result()
+
+        if self._rtstruct_ds is None:
+            raise ValueError("No RTSTRUCT in the uploaded files.")
+
+        series = LazySeries.from_decoded(
+            [uploaded_slice.name for uploaded_slice in self._slices],
+            [uploaded_slice.header for uploaded_slice in self._slices],
+            [uploaded_slice.pixel_array for uploaded_slice in self._slices],
+        )
+
+        return UploadedPatient(
+            series,
+            load_rtstruct_dataset(series, self._rtstruct_ds),
+            self._get_ptv_projections(series),
+            self._ptv_roi_names or [],
+        )
+
+    def _submit(self, fn, *args) -> None:
+        if self._workers <= 1:
+            fn(*args)
+        else:
+            self._futures.append(
+                get_executor("thread", self._workers).submit(fn, *args)
+            )
+
+    def _decode(self, uploaded_slice: _UploadedSlice) -> None:
+        pixel_array = uploaded_slice.header.pixel_array
+        # Only the header is kept, as for the series read from a folder
+        del uploaded_slice.header.PixelData
+        with self._lock:
+            uploaded_slice.pixel_array = pixel_array
+            ptv_contours = self._ptv_contours
+        if ptv_contours is not None:
+            self._project(uploaded_slice, ptv_contours)
+
+    def _group_ptv_contours(self) -> None:
+        """Group the PTV contours by slice, once the RTSTRUCT, the PTV names and a slice are received,
+        and project the slices already decoded."""
+        if (
+            self._ptv_contours is not None
+            or self._rtstruct_ds is None
+            or self._ptv_roi_names is None
+            or self._reference_header is None
+        ):
+            return
+
+        self._transformation_matrix = get_patient_to_pixel_transformation_matrix(
+            [self._reference_header]
+        )
+        try:
+            contours_by_roi = group_contours_by_uid(
+                self._rtstruct_ds, self._ptv_roi_names, self._transformation_matrix
+            )
+        except RTStruct.ROIException:
+            return  # reported by the validation of the pipeline
+
+        ptv_contours: dict[str, list[list[np.ndarray]]] = {}
+        for contours_by_uid in contours_by_roi.values():
+            for uid, polygons in contours_by_uid.items():
+                ptv_contours.setdefault(uid, []).append(polygons)
+
+        # Slices decoded before are projected here, the others once decoded
+        with self._lock:
+            self._ptv_contours = ptv_contours
+            decoded = [s for s in self._slices if s.pixel_array is not None]
+        for uploaded_slice in decoded:
+            self._submit(self._project, uploaded_slice, ptv_contours)
+
+    def _project(
+        self,
+        uploaded_slice: _UploadedSlice,
+        ptv_contours: dict[str, list[list[np.ndarray]]],
+    ) -> None:
+        header = self._reference_header
+        if (uploaded_slice.header.Rows, uploaded_slice.header.Columns) != (
+            header.Rows,
+            header.Columns,
+        ):
+            return  # not projected, see _get_ptv_projections
+
+        mask_shape = int(header.Columns), int(header.Rows)  # as in rt_utils
+        polygons_by_roi = ptv_contours.get(uploaded_slice.header.SOPInstanceUID)
+        if polygons_by_roi is None:
+            num_columns = uploaded_slice.pixel_array.shape[1]
+            uploaded_slice.projection = (
+                np.zeros(num_columns),
+                np.zeros(num_columns, dtype=np.int64),
+                np.zeros(num_columns, dtype=bool),
+            )
+        else:
+            uploaded_slice.projection = project_slice(
+                uploaded_slice.pixel_array, fill_slice_mask(polygons_by_roi, mask_shape)
+            )
+
+    def _get_ptv_projections(
+        self, series: LazySeries
+    ) -> tuple[np.ndarray, np.ndarray] | None:
+        """Assemble the projections of the slices in series order, if they match the sorted series."""
+        if self._ptv_contours is None:
+            return None
+
+        transformation_matrix = get_patient_to_pixel_transformation_matrix(
+            series.headers
+        )
+        if not np.array_equal(
+            transformation_matrix[:2], self._transformation_matrix[:2]
+        ) or any(
+            (header.Rows, header.Columns)
+            != (self._reference_header.Rows, self._reference_header.Columns)
+            for header in series.headers
+        ):
+            logging.info(
+                "Slice geometry differs across the upload: PTV projected after the upload."
+            )
+            return None
+
+        projections = {
+            id(uploaded_slice.header): uploaded_slice.projection
+            for uploaded_slice in self._slices
+        }
+        accumulator = CoronalAccumulator(series.shape[1], len(series))
+        for i, header in enumerate(series.headers):
+            accumulator.set_slice(i, projections[id(header)])
+
+        return accumulator.mean(), accumulator.mask_any
@@ -0,0 +1,166 @@
+"""Module implementing the on-disk store of the decoded CT volumes.
+Each series is decoded once into a contiguous .npy file, which is memory-mapped by later requests.
+Writing a volume removes the volumes of older exports of the same series in the same folder,
+then the least recently used volumes until the store fits in volume_store_max_gb.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from typing import TYPE_CHECKING
+import numpy as np
+from src import config
+from src.dicom.loader import decode_into
+
+if TYPE_CHECKING:
+    from src.dicom.series import LazySeries
+
+VOLUME_STORE_DIR: str = ".volumes"
+
+
+def get_volume_dtype(series: "LazySeries") -> np.dtype:
+    """Integer type able to hold the stored pixel values without loss.
+
+    Args:
+        series (LazySeries): The CT series.
+
+    Returns:
+        np.dtype: int16 for signed or up to 15-bit unsigned pixels, uint16 otherwise.
+    """
+    header = series.headers[0]
+    if header.PixelRepresentation == 1 or header.BitsStored <= 15:
+        return np.dtype(np.int16)
+
+    return np.dtype(np.uint16)
+
+
+def get_volume_path(series: "LazySeries") -> str:
+    """Path of the stored volume. The file name contains the SeriesInstanceUID, a hash of the folder
+    path, and a hash of the slice files (name, modification time and size),
+    so that a new export is stored again.
+
+    Args:
+        series (LazySeries): The CT series read from a DICOM folder.
+
+    Returns:
+        str: Path to the .npy file of the volume.
+    """
+    root = config.YML["volume_store_dir"] or os.path.join(
+        os.path.dirname(os.path.abspath(series.dicom_path)), VOLUME_STORE_DIR
+    )
+    digest = hashlib.sha1()
+    for path in series.paths:
+        stat = os.stat(path)
+        digest.update(
+            f"{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size};".encode()
+        )
+    series_uid = series.headers[0].get("SeriesInstanceUID", "unknown")
+    folder_digest = hashlib.sha1(os.path.abspath(series.dicom_path).encode())
+
+    return os.path.join(
+        root,
+        f"{series_uid}-{folder_digest.hexdigest()[:16]}-{digest.hexdigest()[:16]}.npy",
+    )
+
+
+def _write_volume(series: "LazySeries", path: str) -> None:
+    """Decode the slices one at a time into a new .npy file, then atomically move it to path."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    volume = np.lib.format.open_memmap(
+        tmp_path,
+        mode="w+",
+        dtype=get_volume_dtype(series),
+        shape=(len(series), *series.shape),
+    )
+    try:
+        decode_into(series.paths, volume)
+        volume.flush()
+        del volume
+        os.replace(tmp_path, path)
+    except BaseException:
+        del volume
+        os.remove(tmp_path)
+        raise
+
+
+def _remove_volume(path: str) -> bool:
+    """Remove a stored volume. A volume still memory-mapped may not be removable on Windows."""
+    try:
+        os.remove(path)
+    except OSError:
+        logging.warning("Could not remove stored volume %s.", path)
+        return False
+
+    logging.info("Removed stored volume %s.", path)
+    return True
+
+
+def _clean_store(path: str) -> None:
+    """Remove the superseded volumes of the series stored at path, i.e. older exports of the series
+    in the same folder, then evict the least recently used volumes while the store exceeds
+    volume_store_max_gb (0 for no limit). The copies of the series in other folders are only evicted.
+    """
+    root, name = os.path.split(path)
+    series_prefix = name[: name.rindex("-") + 1]
+    volumes: list[tuple[float, int, str]] = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".npy") or entry.path == path:
+                continue
+            if entry.name.startswith(series_prefix):
+                _remove_volume(entry.path)
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # removed concurrently
+            volumes.append((stat.st_mtime, stat.st_size, entry.path))
+
+    max_bytes = config.YML["volume_store_max_gb"] * 1024**3
+    if max_bytes <= 0:
+        return
+
+    total_bytes = os.path.getsize(path) + sum(size for _, size, _ in volumes)
+    for _, size, volume_path in sorted(volumes):
+        if total_bytes <= max_bytes:
+            break
+        if _remove_volume(volume_path):
+            total_bytes -= size
+
+
+def open_volume(series: "LazySeries") -> np.ndarray:
+    """Memory-map the stored volume of the series, writing it first if it is not stored yet.
+    If the store cannot be written, the volume is decoded in memory.
+
+    Args:
+        series (LazySeries): The CT series.
+
+    Returns:
+        np.ndarray: The volume with shape (num_slices, rows, columns), read-only.
+    """
+    if series.dicom_path is not None:
+        path = get_volume_path(series)
+        try:
+            if os.path.exists(path):
+                os.utime(path)  # the modification time orders the volumes by last use
+            else:
+                logging.info("Writing volume of %s to %s.", series.dicom_path, path)
+                _write_volume(series, path)
+                _clean_store(path)
+
+            return np.load(path, mmap_mode="r")
+        except OSError:
+            logging.exception(
+                "Could not use the volume store. Decoding the volume in memory."
+            )
+
+    volume = np.empty(
+        (len(series), *series.shape),
+        dtype=get_volume_dtype(series),
+    )
+    decode_into(series.paths, volume)
+    volume.flags.writeable = False
+
+    return volume
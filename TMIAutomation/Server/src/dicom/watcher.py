@@ -0,0 +1,215 @@
+"""Module implementing the watcher of the DICOM storage folder.
+
+With automatic export, the client moves the CT and RTSTRUCT of a patient into the storage folder
+before calling /predict. The watcher loads each patient folder as soon as it is complete, so that
+the request finds the series, the volume and the ROI masks already in the caches.
+
+Run from the server folder to test it on a local folder, e.g.:
+    python -m src.dicom.watcher path/to/storage --quiet 2
+"""
+
+import os
+import time
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from typing import Callable
+from src import config
+from src.dicom.series import find_rt_struct_path
+from src.dicom.series_cache import (
+    FolderFingerprint,
+    get_folder_fingerprint,
+    load_patient_series,
+)
+from src.roi.mask_cache import get_roi_coronal_masks, get_roi_masks
+
+
+def warm_folder(dicom_path: str) -> None:
+    """Load a patient folder into the caches as a request would: series headers and RTSTRUCT,
+    CT volume, 3D masks of the PTV ROIs in watch_ptv_names (unless streaming_preprocess is set),
+    and coronal masks of the ROIs in watch_oar_names (all the other ROIs if empty).
+    ROIs not in the RTSTRUCT are skipped.
+
+    Args:
+        dicom_path (str): Path to the folder containing the CT series and RTSTRUCT.
+
+    Raises:
+        FileNotFoundError: If the folder has no RTSTRUCT.
+    """
+    series, rtstruct = load_patient_series(dicom_path)
+    series.volume()
+
+    roi_names = list(dict.fromkeys(rtstruct.get_roi_names()))
+    ptv_roi_names = [
+        name for name in config.YML["watch_ptv_names"] if name in roi_names
+    ]
+    if ptv_roi_names and not config.YML["streaming_preprocess"]:
+        get_roi_masks(rtstruct, ptv_roi_names)
+
+    oar_names = [
+        name
+        for name in config.YML["watch_oar_names"] or roi_names
+        if name in roi_names and name not in ptv_roi_names
+    ]
+    get_roi_coronal_masks(
+        rtstruct, oar_names, direct=config.YML["direct_coronal_rasterization"]
+    )
+
+
+@dataclass
+class _FolderState:
+    """Last observed state of a patient folder."""
+
+    fingerprint: FolderFingerprint
+    changed_at: float  # time of the last observed change of the files
+    dir_mtime_ns: int
+    handled: bool = False  # warmed, or present when the watcher started
+
+
+class StorageWatcher:
+    """Poll the DICOM storage folder and warm the patient folders (its subfolders) once complete.
+
+    A folder is complete when it contains an RTSTRUCT and none of its files changed for quiet_seconds.
+    Folders already present when the watcher starts are not warmed. A handled folder is checked again
+    only when its modification time changes, i.e. when files are added, removed or renamed.
+    Hidden folders, such as the volume store, are ignored.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        quiet_seconds: float | None = None,
+        poll_seconds: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.root = root
+        self.quiet_seconds = (
+            config.YML["watch_quiet_seconds"]
+            if quiet_seconds is None
+            else quiet_seconds
+        )
+        self.poll_seconds = (
+            config.YML["watch_poll_seconds"] if poll_seconds is None else poll_seconds
+        )
+        self._clock = clock
+        self._folders: dict[str, _FolderState] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _list_folders(self) -> list[str]:
+        with os.scandir(self.root) as entries:
+            return [
+                entry.path
+                for entry in entries
+                if entry.is_dir() and not entry.name.startswith(".")
+            ]
+
+    def scan_once(self, warm: bool = True) -> list[str]:
+        """Check the patient folders once, warming those that became complete.
+
+        Args:
+            warm (bool): Whether to warm the complete folders. If False, the folders are only
+            recorded as handled. Defaults to True.
+
+        Returns:
+            list[str]: The folders warmed by this scan.
+        """
+        now = self._clock()
+        folders = self._list_folders()
+        warmed = []
+
+        for dicom_path in folders:
+            try:
+                dir_mtime_ns = os.stat(dicom_path).st_mtime_ns
+                state = self._folders.get(dicom_path)
+                if state and state.handled and state.dir_mtime_ns == dir_mtime_ns:
+                    continue
+
+                fingerprint = get_folder_fingerprint(dicom_path)
+            except OSError:
+                # Files removed while scanning: the folder is checked again at the next scan
+                continue
+
+            if state is None or state.fingerprint != fingerprint:
+                state = self._folders[dicom_path] = _FolderState(
+                    fingerprint, now, dir_mtime_ns
+                )
+            state.dir_mtime_ns = dir_mtime_ns
+            state.handled |= not warm
+
+            if state.handled or now - state.changed_at < self.quiet_seconds:
+                continue
+            if find_rt_struct_path(dicom_path) is None:
+                continue
+
+            # A folder that fails to load is not retried until its files change
+            state.handled = True
+            start = time.perf_counter()
+            try:
+                warm_folder(dicom_path)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logging.exception("Could not warm %s.", dicom_path)
+                continue
+
+            logging.info(
+                "Warmed %s in %.2f s.", dicom_path, time.perf_counter() - start
+            )
+            warmed.append(dicom_path)
+
+        for dicom_path in self._folders.keys() - set(folders):
+            del self._folders[dicom_path]
+
+        return warmed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.scan_once()
+            except OSError:
+                logging.exception("Could not scan the storage folder %s.", self.root)
+
+    def start(self) -> None:
+        """Record the folders already in the storage folder, then poll it in a daemon thread."""
+        self.scan_once(warm=False)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="storage-watcher", daemon=True
+        )
+        self._thread.start()
+        logging.info("Watching the DICOM storage folder %s.", self.root)
+
+    def stop(self) -> None:
+        """Stop polling and wait for the ongoing scan to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main() -> None:
+    """Script entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "root", help="DICOM storage folder containing the patient folders."
+    )
+    parser.add_argument("--quiet", type=float, default=None, help="Quiet period [s].")
+    parser.add_argument(
+        "--poll", type=float, default=None, help="Polling interval [s]."
+    )
+    args = parser.parse_args()
+
+    watcher = StorageWatcher(args.root, args.quiet, args.poll)
+    watcher.scan_once(warm=False)
+    print(f"Watching {args.root}. Copy a patient folder into it, Ctrl+C to stop.")
+    try:
+        while True:
+            for dicom_path in watcher.scan_once():
+                print(f"Warmed {dicom_path}")
+            time.sleep(watcher.poll_seconds)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,28 @@
 """Module implementing the inference pipeline."""
 
 import os
-import glob
 import warnings
 import logging
-from dataclasses import dataclass, field
+import copy
+from contextlib import AbstractContextManager
+from dataclasses import dataclass, field, replace
 import numpy as np
 from thefuzz import fuzz
-from rt_utils import RTStructBuilder
 from rt_utils.image_helper import get_spacing_between_slices
-import imgaug.augmenters as iaa
-from imgaug.augmentables import Keypoint, KeypointsOnImage
 from onnxruntime import InferenceSession
-from scipy import ndimage
 from src import config
+from src.dicom.series_cache import load_patient_series
+from src.dicom.upload import UploadedPatient
 from src.field_geometry_transf import (
     transform_field_geometry,
     get_zero_row_idx,
     adjust_to_max_aperture,
 )
+from src.projection import CoronalAccumulator
+from src.roi.mask_cache import get_roi_masks, get_roi_coronal_masks
+from src.roi.rasterize import iter_slice_masks
+from src.serving.metrics import StageTiming, time_stage
+from src.transforms import transform_image, transform_keypoints
 
 
 @dataclass
@@ -29,6 +33,9 @@ class RequestInfo:
     dicom_path: str
     ptv_name: str
     oars_name: list[str]
+    # Collimator angle the model was trained for: requests keep that of the model they started with
+    # when the models are reloaded. Defaults to None: coll_pelvis in config.yml
+    coll_pelvis: bool | None = None
 
 
 @dataclass
@@ -52,6 +59,22 @@ class FieldGeometry:
     jaws_Y_pix: np.ndarray = field(default_factory=lambda: np.zeros(shape=(12, 2)))
 
 
+def get_ptv_roi_names(ptv_name: str | list) -> list[str]:
+    """Names of the ROIs whose union defines the PTV: the PTV and, if not bundled, the junctions.
+
+    Args:
+        ptv_name (str | list): The ptv_name of the request: the PTV name if bundled,
+        otherwise the PTV name and the list of junction names.
+
+    Returns:
+        list[str]: The names of the ROIs.
+    """
+    if config.BUNDLED:
+        return [ptv_name]
+
+    return [ptv_name[0], *ptv_name[1]]
+
+
 class Pipeline:
     """Pipeline class implementing:
     1) Preprocessing steps (raw-interim)
@@ -61,50 +84,161 @@ class Pipeline:
     def __init__(
         self,
         request_info: RequestInfo,
+        timings: list[StageTiming] | None = None,
+        upload: UploadedPatient | None = None,
     ) -> None:
         self.request_info = request_info
+        # Timing of the stages of the request, appended as they finish
+        self.timings = [] if timings is None else timings
         self.patient_id = os.path.basename(self.request_info.dicom_path)
-
-        rt_struct_path = []
-        for root in ("RTSTRUCT*", "RS*"):
-            rt_struct_path.extend(
-                glob.glob(os.path.join(self.request_info.dicom_path, root))
-            )
-        self.rtstruct = RTStructBuilder.create_from(
-            dicom_series_path=self.request_info.dicom_path,
-            rt_struct_path=rt_struct_path[0],
+        self.coll_pelvis = (
+            config.YML["coll_pelvis"]
+            if request_info.coll_pelvis is None
+            else request_info.coll_pelvis
         )
 
-        pixel_spacing = self.rtstruct.series_data[0].PixelSpacing[0]
-        slice_thickness = get_spacing_between_slices(self.rtstruct.series_data)
+        # Projections of the PTV computed during the upload, if any
+        self._ptv_projections = None
+        if upload is not None:
+            self.series, self.rtstruct = upload.series, upload.rtstruct
+            self._validate_roi_names()
+            if upload.ptv_roi_names == self._get_ptv_roi_names():
+                self._ptv_projections = upload.ptv_projections
+        else:
+            if not os.path.isdir(self.request_info.dicom_path):
+                raise FileNotFoundError(
+                    f"DICOM folder {self.request_info.dicom_path} does not exist."
+                )
+
+            # Only the headers are read: pixel data are decoded in _get_volume
+            with self.time_stage("dicom_load"):
+                self.series, self.rtstruct = load_patient_series(
+                    self.request_info.dicom_path
+                )
+                self._validate_roi_names()
+
+        pixel_spacing = self.series.headers[0].PixelSpacing[0]
+        slice_thickness = get_spacing_between_slices(self.series.headers)
         aspect_ratio = slice_thickness / pixel_spacing
-        num_slices = len(self.rtstruct.series_data)
+        num_slices = len(self.series)
         self.image = Image(
             pixel_spacing, slice_thickness, aspect_ratio, num_slices, width_resize=512
         )
         self.field_geometry = FieldGeometry()
 
+    @classmethod
+    def from_projections(
+        cls, request_info: RequestInfo, image: Image, projections: np.ndarray
+    ) -> "Pipeline":
+        """Pipeline of coronal projections computed without a DICOM series, e.g. synthetic ones for
+        the warm-up. The pipeline can postprocess and locally optimize a model's output,
+        but not transform it to the patient coordinate system.
+
+        Args:
+            request_info (RequestInfo): The request.
+            image (Image): The geometry of the image.
+            projections (np.ndarray): The channels of the model's input before the transform,
+            with shape (width_resize, num_slices, 3).
+
+        Returns:
+            Pipeline: The preprocessed pipeline.
+        """
+        pipeline = cls.__new__(cls)
+        pipeline.request_info = request_info
+        pipeline.timings = []
+        pipeline.patient_id = os.path.basename(request_info.dicom_path)
+        pipeline.coll_pelvis = (
+            config.YML["coll_pelvis"]
+            if request_info.coll_pelvis is None
+            else request_info.coll_pelvis
+        )
+        pipeline.image = image
+        pipeline.field_geometry = FieldGeometry()
+        pipeline.image.pixels = pipeline._transform(projections)
+
+        return pipeline
+
+    def time_stage(self, stage: str) -> AbstractContextManager[None]:
+        """Time a stage of the pipeline in timings and in the metrics (see src.serving.metrics).
+
+        Args:
+            stage (str): One of the stages in src.serving.metrics.STAGES.
+
+        Returns:
+            AbstractContextManager[None]: Context manager timing its block.
+        """
+        return time_stage(
+            stage, self.request_info.model_name, self.coll_pelvis, self.timings
+        )
+
+    def copy_for(self, request_info: RequestInfo) -> "Pipeline":
+        """Copy the preprocessed pipeline for a request with the same patient and ROIs,
+        e.g. to run another model. The series is shared, the image and field geometry are not.
+
+        Args:
+            request_info (RequestInfo): The request of the copy.
+
+        Returns:
+            Pipeline: The copy, ready for predict_from_output.
+        """
+        pipeline = copy.copy(self)
+        pipeline.request_info = request_info
+        if request_info.coll_pelvis is not None:
+            pipeline.coll_pelvis = request_info.coll_pelvis
+        pipeline.image = replace(
+            self.image,
+            pixels=None if self.image.pixels is None else self.image.pixels.copy(),
+        )
+        pipeline.field_geometry = FieldGeometry()
+        pipeline.timings = []
+
+        return pipeline
+
+    def _get_ptv_roi_names(self) -> list[str]:
+        """Names of the ROIs whose union defines the PTV: the PTV and, if not bundled, the junctions."""
+        return get_ptv_roi_names(self.request_info.ptv_name)
+
+    def _validate_roi_names(self) -> None:
+        """Check that the requested ROIs exist in the RTSTRUCT.
+
+        Raises:
+            ValueError: If the PTV, a junction, or an OAR is not in the RTSTRUCT.
+        """
+        roi_names = self._get_ptv_roi_names() + self.request_info.oars_name
+
+        available_roi_names = set(self.rtstruct.get_roi_names())
+        missing_roi_names = [
+            name for name in roi_names if name not in available_roi_names
+        ]
+        if missing_roi_names:
+            raise ValueError(
+                f"ROIs {missing_roi_names} do not exist in the RTSTRUCT of {self.patient_id}."
+            )
+
+    def _get_volume(self) -> np.ndarray:
+        """Get the CT volume, timing the decoding of the pixel data if the volume is not stored yet.
+
+        Returns:
+            np.ndarray: The CT volume, axis0=z, axis1=y, axis2=x.
+        """
+        with self.time_stage("dicom_decode"):
+            return self.series.volume()
+
     def _get_masked_image_3d(self, mask_3d: np.ndarray) -> np.ndarray:
         """Create a 3D-masked CT image given a 3D mask.
+        The CT volume is read zero-copy from the memory-mapped volume store.
 
         Args:
             mask_3d (np.ndarray): The 3D mask applied to the 3D CT image.
 
         Returns:
-            np.ndarray: The masked CT image (HU density).
+            np.ndarray: The masked CT image (HU density), with the integer type of the stored pixels.
         """
-        series_data = self.rtstruct.series_data
-        img_shape = list(series_data[0].pixel_array.shape)
-        img_shape.append(len(series_data))
-        img_3d = np.zeros(img_shape)
-
-        for i, s in enumerate(series_data):
-            img_2d = s.pixel_array
-            img_3d[..., i] = img_2d
+        img_3d = np.moveaxis(self._get_volume(), 0, -1)  # axis0=y, axis1=x, axis2=z
 
         assert img_3d.shape == mask_3d.shape
 
-        return img_3d * mask_3d
+        return np.where(mask_3d, img_3d, 0)
 
     def _scale_hu_img(
         self, img_2d: np.ndarray, mask_2d: np.ndarray, background: int | None = None
@@ -143,44 +277,28 @@ class Pipeline:
         Returns:
             np.ndarray: The transformed image.
         """
-        seq = iaa.Sequential(
-            [
-                iaa.Resize(
-                    size={
-                        "height": self.image.width_resize,
-                        "width": self.image.width_resize,
-                    },
-                    interpolation="nearest",
-                ),
-                iaa.Rot90(k=-1, keep_size=False),
-            ]
-        )
+        width_resize = self.image.width_resize
+        pixels = np.empty((width_resize, width_resize, *image.shape[2:]), image.dtype)
 
-        return seq(image=image)
+        return transform_image(
+            image,
+            (("resize", width_resize, width_resize), ("rot90", -1)),
+            out=pixels,
+        )
 
-    def preprocess(self) -> np.ndarray:
-        """Construct the model's input using the masks of PTV and OARs.
+    def _get_ptv_projections(self) -> tuple[np.ndarray, np.ndarray]:
+        """Compute the coronal projections of the PTV from the 3D CT image and masks.
 
         Returns:
-            np.ndarray: The preprocessed image with shape (H, W, C), representing the input of the model. The image
-            has three channels (C=3) for, respectively, the 2D HUdensity of the PTV, 2D PTV mask, and 2D OARs mask (overlap).
+            tuple[np.ndarray, np.ndarray]: The mean HU density inside the PTV (NaN outside)
+            and the PTV mask, both projected along the coronal direction.
         """
-        if config.BUNDLED:
-            ptv_mask_3d = self.rtstruct.get_roi_mask_by_name(
-                self.request_info.ptv_name
-            )  # axis0=y, axis1=x, axis2=z
-        else:
-            ptv_mask_3d_ = self.rtstruct.get_roi_mask_by_name(
-                self.request_info.ptv_name[0]
-            )  # axis0=y, axis1=x, axis2=z
-
-            junction_mask_3d = np.zeros_like(ptv_mask_3d_)
-            for junc in self.request_info.ptv_name[1]:
-                junction_mask_3d |= self.rtstruct.get_roi_mask_by_name(
-                    junc
-                )  # axis0=y, axis1=x, axis2=z
-
-            ptv_mask_3d = ptv_mask_3d_ | junction_mask_3d
+        with self.time_stage("rasterize"):
+            ptv_roi_masks = get_roi_masks(self.rtstruct, self._get_ptv_roi_names())
+        # Union of PTV and junctions, axis0=y, axis1=x, axis2=z
+        ptv_mask_3d = np.zeros((*self.series.shape, len(self.series)), dtype=bool)
+        for roi_mask in ptv_roi_masks.values():
+            roi_mask.add_to(ptv_mask_3d)
 
         ptv_img_3d = self._get_masked_image_3d(ptv_mask_3d)
         with warnings.catch_warnings():
@@ -190,47 +308,87 @@ class Pipeline:
             )
 
         ptv_mask_2d = ptv_mask_3d.any(axis=0)  # coronal projection
-        ptv_img_2d = self._scale_hu_img(
-            np.nan_to_num(ptv_img_2d), ptv_mask_2d, background=0
-        )
 
-        # Words and similarity threshold for intestine mask scaling
-        target_words, threshold = [
-            "intestino",
-            "bowel",
-        ], 80
-        oars_shape = list(ptv_img_2d.shape)
-        oars_shape.append(len(self.request_info.oars_name))
-        oars_channel = np.zeros(oars_shape)
-        for i, oar_name in enumerate(self.request_info.oars_name):
-            try:
-                oar_mask_2d = self.rtstruct.get_roi_mask_by_name(oar_name).any(axis=0)
-            except AttributeError:
-                logging.warning(
-                    "No contours for %s ROI. Assign mask of zeros.", oar_name
-                )
-                oar_mask_2d = np.zeros_like(ptv_img_2d)
+        return ptv_img_2d, ptv_mask_2d
 
-            similarities = [
-                fuzz.ratio(oar_name.lower(), target) for target in target_words
-            ]
-            if not any(similarity >= threshold for similarity in similarities):
-                logging.info("Scaling mask %s.", oar_name)
-                oar_mask_2d = 0.5 * oar_mask_2d
+    def _get_ptv_projections_streaming(self) -> tuple[np.ndarray, np.ndarray]:
+        """Compute the coronal projections of the PTV one axial slice at a time,
+        without building the 3D CT image and masks. The result is identical to _get_ptv_projections.
 
-            oars_channel[..., i] = oar_mask_2d
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The mean HU density inside the PTV (NaN outside)
+            and the PTV mask, both projected along the coronal direction.
+        """
+        volume = self._get_volume()
+        accumulator = CoronalAccumulator(self.series.shape[1], len(self.series))
+        for i, ptv_mask_2d in enumerate(
+            iter_slice_masks(self.rtstruct, self._get_ptv_roi_names())
+        ):
+            accumulator.add_slice(i, volume[i], ptv_mask_2d)
 
-        oars_channel = oars_channel.max(axis=-1)
+        return accumulator.mean(), accumulator.mask_any
 
-        image = np.stack((ptv_img_2d, 0.3 * ptv_mask_2d, oars_channel), axis=-1)
-        self.image.pixels = self._transform(image)
+    def preprocess(self) -> np.ndarray:
+        """Construct the model's input using the masks of PTV and OARs.
 
-        if not config.BUNDLED:
-            from src.visualize import (  # pylint: disable=import-outside-toplevel
-                save_input_img,
+        Returns:
+            np.ndarray: The preprocessed image with shape (H, W, C), representing the input of the model. The image
+            has three channels (C=3) for, respectively, the 2D HUdensity of the PTV, 2D PTV mask, and 2D OARs mask (overlap).
+        """
+        with self.time_stage("preprocess"):
+            if self._ptv_projections is not None:
+                ptv_img_2d, ptv_mask_2d = self._ptv_projections
+            elif config.YML["streaming_preprocess"]:
+                ptv_img_2d, ptv_mask_2d = self._get_ptv_projections_streaming()
+            else:
+                ptv_img_2d, ptv_mask_2d = self._get_ptv_projections()
+
+            ptv_img_2d = self._scale_hu_img(
+                np.nan_to_num(ptv_img_2d), ptv_mask_2d, background=0
             )
 
-            save_input_img(self.patient_id, self.image)
+            # Words and similarity threshold for intestine mask scaling
+            target_words, threshold = [
+                "intestino",
+                "bowel",
+            ], 80
+            oars_shape = list(ptv_img_2d.shape)
+            oars_shape.append(len(self.request_info.oars_name))
+            oars_channel = np.zeros(oars_shape)
+            with self.time_stage("rasterize"):
+                oar_masks_2d = get_roi_coronal_masks(
+                    self.rtstruct,
+                    self.request_info.oars_name,
+                    direct=config.YML["direct_coronal_rasterization"],
+                )
+            for i, oar_name in enumerate(self.request_info.oars_name):
+                oar_mask_2d = oar_masks_2d[oar_name]
+                if not oar_mask_2d.any():
+                    logging.warning(
+                        "No contours for %s ROI. Assign mask of zeros.", oar_name
+                    )
+
+                similarities = [
+                    fuzz.ratio(oar_name.lower(), target) for target in target_words
+                ]
+                if not any(similarity >= threshold for similarity in similarities):
+                    logging.info("Scaling mask %s.", oar_name)
+                    oar_mask_2d = 0.5 * oar_mask_2d
+
+                oars_channel[..., i] = oar_mask_2d
+
+            oars_channel = oars_channel.max(axis=-1)
+
+            image = np.stack((ptv_img_2d, 0.3 * ptv_mask_2d, oars_channel), axis=-1)
+            self.image.pixels = self._transform(image)
+
+            if not config.BUNDLED:
+                from src.visualize import (  # pylint: disable=import-outside-toplevel
+                    save_input_img,
+                )
+
+                with self.time_stage("visualize"):
+                    save_input_img(self.patient_id, self.image)
 
     def _build_output(self, model_output: np.ndarray) -> np.ndarray:
         """Build the flat output of the regression.
@@ -241,6 +399,8 @@ class Pipeline:
         Returns:
             np.ndarray: Flat array containing the regression results.
         """
+        from scipy import ndimage  # pylint: disable=import-outside-toplevel
+
         output = np.zeros(shape=84)
         y_hat = model_output[0]
 
@@ -268,7 +428,7 @@ class Pipeline:
             0.5  # y coord repeated 8 times + 2 times for iso thorax, set to 0
         )
 
-        if config.YML["coll_pelvis"]:
+        if self.coll_pelvis:
             y_hat = self._reshape_to_90_model(y_hat)
 
         if y_hat.shape[0] == config.MODEL_OUTPUT_BODY_90:
@@ -503,30 +663,26 @@ class Pipeline:
         jaws_X_pix = jaws_X_pix_hat * self.image.width_resize
         jaws_Y_pix = jaws_Y_pix_hat * self.image.width_resize
 
-        seq = iaa.Sequential(
-            [
-                iaa.Rot90(k=1, keep_size=False),
-                iaa.Resize(
-                    size={
-                        "height": self.image.width_resize,
-                        "width": self.image.num_slices,
-                    },
-                    interpolation="nearest",
-                ),
-            ]
+        steps = (
+            ("rot90", 1),
+            ("resize", self.image.width_resize, self.image.num_slices),
         )
 
         # Swap columns to original dicom coordinate system
         isocenters_pix[:, [2, 0]] = isocenters_pix[:, [0, 2]]
 
-        iso_kps = KeypointsOnImage(
-            [Keypoint(x=iso[2], y=iso[0]) for iso in isocenters_pix],
-            shape=self.image.pixels.shape,
+        image_original = np.empty(
+            (
+                self.image.width_resize,
+                self.image.num_slices,
+                *self.image.pixels.shape[2:],
+            ),
+            self.image.pixels.dtype,
+        )
+        transform_image(self.image.pixels, steps, out=image_original)
+        iso_kps_tmp = transform_keypoints(
+            isocenters_pix[:, [2, 0]], self.image.pixels.shape[:2], steps
         )
-
-        image_original, iso_kps_transf = seq(image=self.image.pixels, keypoints=iso_kps)
-
-        iso_kps_tmp = iso_kps_transf.to_xy_array()
         iso_kps_tmp[get_zero_row_idx(isocenters_pix)] = 0
 
         iso_3d_pix_transf = np.insert(iso_kps_tmp, 1, isocenters_pix[:, 1], axis=1)
@@ -543,32 +699,80 @@ class Pipeline:
         Args:
             model_output (np.ndarray): Output of regression model.
         """
-        output = self._build_output(model_output)
-
-        isocenters_hat = np.zeros((12, 3))
-        jaws_X_hat = np.zeros((12, 2))
-        jaws_Y_hat = np.zeros((12, 2))
-        for i in range(12):
-            for j in range(3):
-                isocenters_hat[i, j] = output[3 * i + j]
-                if j < 2:
-                    jaws_X_hat[i, j] = output[36 + 2 * i + j]
-                    jaws_Y_hat[i, j] = output[60 + 2 * i + j]
-
-        (
-            self.image.pixels,
-            self.field_geometry.isocenters_pix,
-            self.field_geometry.jaws_X_pix,
-            self.field_geometry.jaws_Y_pix,
-        ) = self._inverse_transform(isocenters_hat, jaws_X_hat, jaws_Y_hat)
+        with self.time_stage("postprocess"):
+            output = self._build_output(model_output)
+
+            isocenters_hat = np.zeros((12, 3))
+            jaws_X_hat = np.zeros((12, 2))
+            jaws_Y_hat = np.zeros((12, 2))
+            for i in range(12):
+                for j in range(3):
+                    isocenters_hat[i, j] = output[3 * i + j]
+                    if j < 2:
+                        jaws_X_hat[i, j] = output[36 + 2 * i + j]
+                        jaws_Y_hat[i, j] = output[60 + 2 * i + j]
+
+            (
+                self.image.pixels,
+                self.field_geometry.isocenters_pix,
+                self.field_geometry.jaws_X_pix,
+                self.field_geometry.jaws_Y_pix,
+            ) = self._inverse_transform(isocenters_hat, jaws_X_hat, jaws_Y_hat)
+
+    def get_model_input(self) -> np.ndarray:
+        """Model input built from the preprocessed image.
 
-    def predict(
-        self, ort_session: InferenceSession, local_opt: bool = True
+        Returns:
+            np.ndarray: The input with shape (1, C, H, W) and type float32.
+        """
+        return np.transpose(
+            self.image.pixels[np.newaxis],
+            axes=(0, -1, 1, 2),  # swap (H, W, C) --> (C, H, W)
+        ).astype(np.float32)
+
+    def optimize_locally(self) -> None:
+        """Optimize the postprocessed abdominal field geometry with the local optimization
+        of the collimator angle of the model."""
+        if self.coll_pelvis:
+            from src.local_optimization.optimization_5_355 import (  # pylint: disable=import-outside-toplevel
+                LocalOptimization5355,
+            )
+
+            local_optimization = LocalOptimization5355(
+                self.request_info.model_name,
+                self.image,
+                self.field_geometry,
+            )
+        else:
+            from src.local_optimization.optimization_90 import (  # pylint: disable=import-outside-toplevel
+                LocalOptimization90,
+            )
+
+            local_optimization = LocalOptimization90(
+                self.request_info.model_name,
+                self.image,
+                self.field_geometry,
+            )
+
+        with self.time_stage("local_optimization"):
+            local_optimization.optimize()
+
+        if not config.BUNDLED:
+            from src.visualize import (  # pylint: disable=import-outside-toplevel
+                save_local_opt,
+            )
+
+            with self.time_stage("visualize"):
+                save_local_opt(self.patient_id, self.image, local_optimization)
+
+    def predict_from_output(
+        self, model_output: np.ndarray, local_opt: bool = True
     ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
-        """Execute the entire pipeline to produce predictions from raw data to patient coordinate system.
+        """Postprocess the model's output, optionally optimize it locally, and transform
+        the field geometry to the patient coordinate system.
 
         Args:
-            ort_session (InferenceSession): The ONNX runtime session to run predictions.
+            model_output (np.ndarray): Output of regression model with shape (1, num_outputs).
             local_opt (bool): Whether to perform the local optimization of the model's output
             for the abdominal field geometry. Defaults to True.
 
@@ -576,77 +780,64 @@ class Pipeline:
             tuple[np.ndarray, np.ndarray, np.ndarray]: Isocenters, jaw X apertures, and jaw Y apertures
             in patient coordinate system.
         """
-        self.preprocess()
-
-        model_input = np.transpose(
-            self.image.pixels[np.newaxis],
-            axes=(0, -1, 1, 2),  # swap (H, W, C) --> (C, H, W)
-        ).astype(np.float32)
-
-        input_name = ort_session.get_inputs()[0].name
-        ort_inputs = {input_name: model_input}
-        ort_outs = ort_session.run(None, ort_inputs)  # list of numpy arrays
-        model_output = ort_outs[0]
-
         self.postprocess(model_output)
 
         if local_opt:
-            if config.YML["coll_pelvis"]:
-                from src.local_optimization.optimization_5_355 import (  # pylint: disable=import-outside-toplevel
-                    LocalOptimization5355,
-                )
+            self.optimize_locally()
 
-                local_optimization = LocalOptimization5355(
-                    self.request_info.model_name,
-                    self.image,
-                    self.field_geometry,
-                )
-            else:
-                from src.local_optimization.optimization_90 import (  # pylint: disable=import-outside-toplevel
-                    LocalOptimization90,
-                )
+        if not config.BUNDLED:
+            from src.visualize import (  # pylint: disable=import-outside-toplevel
+                save_field_geometry,
+            )
 
-                local_optimization = LocalOptimization90(
+            with self.time_stage("visualize"):
+                save_field_geometry(
+                    self.patient_id,
                     self.request_info.model_name,
                     self.image,
                     self.field_geometry,
+                    self.coll_pelvis,
                 )
 
-            local_optimization.optimize()
-
-            if not config.BUNDLED:
-                from src.visualize import (  # pylint: disable=import-outside-toplevel
-                    save_local_opt,
-                )
-
-                save_local_opt(self.patient_id, self.image, local_optimization)
-
-        if not config.BUNDLED:
-            from src.visualize import (  # pylint: disable=import-outside-toplevel
-                save_field_geometry,
+        with self.time_stage("field_geometry_transform"):
+            (
+                isocenters_pat_coord,
+                jaws_X_pat_coord,
+                jaws_Y_pat_coord,
+            ) = transform_field_geometry(
+                self.series.headers,
+                self.field_geometry.isocenters_pix,
+                self.field_geometry.jaws_X_pix,
+                self.field_geometry.jaws_Y_pix,
+                from_to="pix_pat",
             )
 
-            save_field_geometry(
-                self.patient_id,
-                self.request_info.model_name,
-                self.image,
-                self.field_geometry,
-            )
-
-        (
-            isocenters_pat_coord,
-            jaws_X_pat_coord,
-            jaws_Y_pat_coord,
-        ) = transform_field_geometry(
-            self.rtstruct.series_data,
-            self.field_geometry.isocenters_pix,
-            self.field_geometry.jaws_X_pix,
-            self.field_geometry.jaws_Y_pix,
-            from_to="pix_pat",
-        )
-
         return (
             isocenters_pat_coord,
             adjust_to_max_aperture(jaws_X_pat_coord),
             adjust_to_max_aperture(jaws_Y_pat_coord, 175),
         )
+
+    def predict(
+        self, ort_session: InferenceSession, local_opt: bool = True
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Execute the entire pipeline to produce predictions from raw data to patient coordinate system.
+
+        Args:
+            ort_session (InferenceSession): The ONNX runtime session to run predictions.
+            local_opt (bool): Whether to perform the local optimization of the model's output
+            for the abdominal field geometry. Defaults to True.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: Isocenters, jaw X apertures, and jaw Y apertures
+            in patient coordinate system.
+        """
+        self.preprocess()
+
+        input_name = ort_session.get_inputs()[0].name
+        ort_inputs = {input_name: self.get_model_input()}
+        with self.time_stage("inference"):
+            ort_outs = ort_session.run(None, ort_inputs)  # list of numpy arrays
+        model_output = ort_outs[0]
+
+        return self.predict_from_output(model_output, local_opt)
@@ -0,0 +1,71 @@
+"""Module implementing the streaming computation of the coronal projections
+used to build the model's input."""
+
+import warnings
+import numpy as np
+
+# Per-column sums and counts of the non-zero masked pixels, and projection of the mask of a slice
+SliceProjection = tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def project_slice(img_2d: np.ndarray, mask_2d: np.ndarray) -> SliceProjection:
+    """Project a masked axial slice along the coronal direction.
+
+    Args:
+        img_2d (np.ndarray): CT slice, axis0=y, axis1=x.
+        mask_2d (np.ndarray): Boolean mask of the slice, axis0=y, axis1=x.
+
+    Returns:
+        SliceProjection: The sums, counts and mask projection of each column (x).
+    """
+    masked_img_2d = np.where(mask_2d, img_2d, 0)
+    non_zero = masked_img_2d != 0
+
+    return (
+        masked_img_2d.sum(  # pylint: disable=unexpected-keyword-arg
+            axis=0, where=non_zero, dtype=np.float64
+        ),
+        non_zero.sum(axis=0),
+        mask_2d.any(axis=0),
+    )
+
+
+class CoronalAccumulator:
+    """Accumulate, one axial slice at a time, the coronal (axis0=y) projections of a masked CT:
+    per-column sums and counts of the non-zero masked pixels, and the projection of the mask.
+    The results are identical to projecting the 3D volumes, while the memory scales with one slice.
+    """
+
+    def __init__(self, num_columns: int, num_slices: int) -> None:
+        self.sums = np.zeros((num_columns, num_slices))
+        self.counts = np.zeros((num_columns, num_slices), dtype=np.int64)
+        self.mask_any = np.zeros((num_columns, num_slices), dtype=bool)
+
+    def add_slice(self, index: int, img_2d: np.ndarray, mask_2d: np.ndarray) -> None:
+        """Add the contribution of an axial slice.
+
+        Args:
+            index (int): Index of the slice in the series (z pixel coordinate).
+            img_2d (np.ndarray): CT slice, axis0=y, axis1=x.
+            mask_2d (np.ndarray): Boolean mask of the slice, axis0=y, axis1=x.
+        """
+        self.set_slice(index, project_slice(img_2d, mask_2d))
+
+    def set_slice(self, index: int, projection: SliceProjection) -> None:
+        """Set the contribution of an axial slice, projected with project_slice.
+
+        Args:
+            index (int): Index of the slice in the series (z pixel coordinate).
+            projection (SliceProjection): The projection of the slice.
+        """
+        self.sums[:, index], self.counts[:, index], self.mask_any[:, index] = projection
+
+    def mean(self) -> np.ndarray:
+        """Mean of the non-zero masked pixels along the coronal direction.
+
+        Returns:
+            np.ndarray: The 2D mean image (axis0=x, axis1=z), NaN where no pixel was non-zero.
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            return self.sums / self.counts
@@ -0,0 +1,178 @@
+"""Module implementing the process-wide cache of the rasterized ROI masks.
+
+The masks are cached by RTSTRUCT SOPInstanceUID, ROI name and digest of the ROI contours,
+since the treatment planning system keeps the SOPInstanceUID when the contours are edited.
+"""
+
+import hashlib
+import threading
+import weakref
+import numpy as np
+from pydicom import Dataset
+from rt_utils import RTStruct
+from src import config
+from src.cache import LRUCache
+from src.roi.rasterize import (
+    RoiMask,
+    rasterize_coronal_projections,
+    rasterize_rois,
+)
+
+
+class PackedRoiMask:
+    """Bounding-box cropped ROI mask stored with 1 bit per pixel."""
+
+    def __init__(self, roi_mask: RoiMask) -> None:
+        self.shape = roi_mask.shape
+        self.offset = roi_mask.offset
+        self.cropped_shape = roi_mask.mask.shape
+        self.bits = np.packbits(roi_mask.mask)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the packed mask."""
+        return self.bits.nbytes
+
+    def unpack(self) -> RoiMask:
+        """Unpack the mask.
+
+        Returns:
+            RoiMask: A new cropped mask.
+        """
+        mask = np.unpackbits(self.bits, count=int(np.prod(self.cropped_shape)))
+
+        return RoiMask(
+            self.shape, self.offset, mask.reshape(self.cropped_shape).astype(bool)
+        )
+
+
+MASK_CACHE = LRUCache(
+    "ROI mask",
+    max_bytes=config.YML["mask_cache_mb"] * 1024**2,
+    sizeof=lambda value: value.nbytes,
+)
+
+
+# Digest of the contours of each ROI, computed once for each RTSTRUCT wrapper
+_CONTOUR_DIGESTS: weakref.WeakKeyDictionary[RTStruct, dict[str, str]] = (
+    weakref.WeakKeyDictionary()
+)
+_CONTOUR_DIGESTS_LOCK = threading.Lock()
+CONTOUR_DATA_TAG = 0x30060050
+
+
+def _get_contour_data_bytes(contour: Dataset) -> bytes:
+    """ContourData of a contour as written in the file, without converting the values to float."""
+    element = contour.get_item(CONTOUR_DATA_TAG)
+    if element is None or element.value is None:
+        return b""
+    if isinstance(element.value, bytes):
+        return element.value.rstrip(b" \x00")
+
+    return "\\".join(str(value) for value in element.value).encode()
+
+
+def get_contour_digests(ds: Dataset) -> dict[str, str]:
+    """Digest of the ContourData of each ROI. ROIs are matched as in RTStruct.get_roi_mask_by_name.
+
+    Args:
+        ds (Dataset): The RTSTRUCT dataset.
+
+    Returns:
+        dict[str, str]: The digest of each ROI name, empty for the ROIs without contours.
+    """
+    digests: dict[str, str] = {}
+    for roi_contour in ds.ROIContourSequence:
+        roi_number = str(roi_contour.ReferencedROINumber)
+        # Only the first contour sequence of each ROI is used, as in rt_utils
+        if roi_number not in digests:
+            digest = hashlib.sha1()
+            for contour in getattr(roi_contour, "ContourSequence", []):
+                digest.update(_get_contour_data_bytes(contour))
+                digest.update(b";")
+            digests[roi_number] = digest.hexdigest()
+
+    roi_numbers: dict[str, str] = {}
+    for structure_roi in ds.StructureSetROISequence:
+        roi_numbers.setdefault(structure_roi.ROIName, str(structure_roi.ROINumber))
+
+    return {
+        roi_name: digests.get(roi_number, "")
+        for roi_name, roi_number in roi_numbers.items()
+    }
+
+
+def _get_key(rtstruct: RTStruct, roi_name: str, kind: str) -> tuple[str, str, str, str]:
+    """Key of the cache: (RTSTRUCT SOPInstanceUID, ROI name, digest of the contours, kind of mask)."""
+    with _CONTOUR_DIGESTS_LOCK:
+        digests = _CONTOUR_DIGESTS.get(rtstruct)
+        if digests is None:
+            digests = _CONTOUR_DIGESTS[rtstruct] = get_contour_digests(rtstruct.ds)
+
+    return rtstruct.ds.SOPInstanceUID, roi_name, digests.get(roi_name, ""), kind
+
+
+def get_roi_masks(rtstruct: RTStruct, roi_names: list[str]) -> dict[str, RoiMask]:
+    """Get the 3D masks of the ROIs. The ROIs not cached are rasterized together in a single pass.
+
+    Args:
+        rtstruct (RTStruct): The RTSTRUCT wrapper.
+        roi_names (list[str]): The names of the ROIs.
+
+    Returns:
+        dict[str, RoiMask]: The bounding-box cropped mask of each ROI.
+    """
+    roi_masks: dict[str, RoiMask] = {}
+    for roi_name in roi_names:
+        packed_mask = MASK_CACHE.get(_get_key(rtstruct, roi_name, "3d"))
+        if packed_mask is not None:
+            roi_masks[roi_name] = packed_mask.unpack()
+
+    missing_roi_names = [name for name in roi_names if name not in roi_masks]
+    if missing_roi_names:
+        for roi_name, roi_mask in rasterize_rois(rtstruct, missing_roi_names).items():
+            MASK_CACHE.put(_get_key(rtstruct, roi_name, "3d"), PackedRoiMask(roi_mask))
+            roi_masks[roi_name] = roi_mask
+
+    return roi_masks
+
+
+def get_roi_coronal_masks(
+    rtstruct: RTStruct, roi_names: list[str], direct: bool = True
+) -> dict[str, np.ndarray]:
+    """Get the coronal projections of the masks of the ROIs, rasterizing only the ROIs not cached.
+    Only the projections are cached, not the 3D masks they are computed from.
+
+    Args:
+        rtstruct (RTStruct): The RTSTRUCT wrapper.
+        roi_names (list[str]): The names of the ROIs.
+        direct (bool): Whether to rasterize the contours directly in the coronal plane
+        instead of projecting the 3D masks. Both give the same masks. Defaults to True.
+
+    Returns:
+        dict[str, np.ndarray]: The 2D boolean mask of each ROI, axis0=x, axis1=z.
+    """
+    masks_2d: dict[str, np.ndarray] = {}
+    for roi_name in roi_names:
+        mask_2d = MASK_CACHE.get(_get_key(rtstruct, roi_name, "coronal"))
+        if mask_2d is not None:
+            masks_2d[roi_name] = mask_2d
+
+    missing_roi_names = [name for name in roi_names if name not in masks_2d]
+    if missing_roi_names:
+        if direct:
+            new_masks_2d = rasterize_coronal_projections(rtstruct, missing_roi_names)
+        else:
+            new_masks_2d = {
+                roi_name: roi_mask.coronal_projection()
+                for roi_name, roi_mask in rasterize_rois(
+                    rtstruct, missing_roi_names
+                ).items()
+            }
+
+        for roi_name, mask_2d in new_masks_2d.items():
+            mask_2d.flags.writeable = False
+            MASK_CACHE.put(_get_key(rtstruct, roi_name, "coronal"), mask_2d)
+            masks_2d[roi_name] = mask_2d
+
+    return masks_2d
@@ -0,0 +1,349 @@
+"""Module implementing the rasterization of the RTSTRUCT contours."""
+
+from dataclasses import dataclass
+from typing import Iterator
+import cv2 as cv
+import numpy as np
+from pydicom import Dataset
+from rt_utils import RTStruct
+from rt_utils.image_helper import (
+    apply_transformation_to_3d_points,
+    get_patient_to_pixel_transformation_matrix,
+)
+from src import config
+from src.dicom.loader import get_executor
+
+# Polygons in pixel coordinates of each ROI, grouped by slice index
+ContoursByRoi = dict[str, dict[int, list[np.ndarray]]]
+
+
+def get_contour_pixels(
+    contour_data: list[float], transformation_matrix: np.ndarray
+) -> np.ndarray:
+    """Transform the contour points to (x, y) pixel coordinates, rounded as in rt_utils.
+
+    Args:
+        contour_data (list[float]): The flat ContourData (x, y, z) in patient coordinate system.
+        transformation_matrix (np.ndarray): The patient to pixel transformation matrix.
+
+    Returns:
+        np.ndarray: Array of shape (n_points, 2) with the integer (x, y) pixel coordinates.
+    """
+    points = np.reshape(contour_data, [len(contour_data) // 3, 3])
+    pixels = apply_transformation_to_3d_points(points, transformation_matrix)[:, :2]
+
+    return np.around(pixels).astype(np.int32)
+
+
+def get_slice_mask_shape(rtstruct: RTStruct) -> tuple[int, int]:
+    """Shape of the slice masks, (Columns, Rows) as in rt_utils."""
+    return int(rtstruct.series_data[0].Columns), int(rtstruct.series_data[0].Rows)
+
+
+def group_contours_by_uid(
+    ds: Dataset, roi_names: list[str], transformation_matrix: np.ndarray
+) -> dict[str, dict[str, list[np.ndarray]]]:
+    """Collect the contours of the given ROIs in a single pass over the ROIContourSequence,
+    grouped by the SOPInstanceUID of the slice they reference. ROIs are matched as in
+    RTStruct.get_roi_mask_by_name.
+
+    Args:
+        ds (Dataset): The RTSTRUCT dataset.
+        roi_names (list[str]): The names of the ROIs.
+        transformation_matrix (np.ndarray): The patient to pixel transformation matrix.
+
+    Raises:
+        RTStruct.ROIException: If a ROI does not exist in the RTSTRUCT.
+
+    Returns:
+        dict[str, dict[str, list[np.ndarray]]]: Mapping between ROI name, SOPInstanceUID and polygons
+        in pixel coordinates. ROIs without contours are mapped to an empty dict.
+    """
+    roi_numbers: dict[str, str] = {}
+    for structure_roi in ds.StructureSetROISequence:
+        roi_numbers.setdefault(structure_roi.ROIName, str(structure_roi.ROINumber))
+
+    requested_rois: dict[str, list[str]] = {}
+    for roi_name in roi_names:
+        if roi_name not in roi_numbers:
+            raise RTStruct.ROIException(
+                f"ROI of name `{roi_name}` does not exist in RTStruct"
+            )
+        requested_rois.setdefault(roi_numbers[roi_name], []).append(roi_name)
+
+    contours_by_roi: dict[str, dict[str, list[np.ndarray]]] = {
+        roi_name: {} for roi_name in roi_names
+    }
+    for roi_contour in ds.ROIContourSequence:
+        roi_number = str(roi_contour.ReferencedROINumber)
+        # Only the first contour sequence of each ROI is used, as in rt_utils
+        for roi_name in requested_rois.pop(roi_number, []):
+            contours_by_uid = contours_by_roi[roi_name]
+            for contour in getattr(roi_contour, "ContourSequence", []):
+                pixels = get_contour_pixels(contour.ContourData, transformation_matrix)
+                for contour_image in contour.ContourImageSequence:
+                    contours_by_uid.setdefault(
+                        contour_image.ReferencedSOPInstanceUID, []
+                    ).append(pixels)
+
+    return contours_by_roi
+
+
+def group_contours(rtstruct: RTStruct, roi_names: list[str]) -> ContoursByRoi:
+    """Collect the contours of the given ROIs in a single pass over the ROIContourSequence.
+    ROIs and slices are matched as in RTStruct.get_roi_mask_by_name.
+
+    Args:
+        rtstruct (RTStruct): The RTSTRUCT wrapper.
+        roi_names (list[str]): The names of the ROIs.
+
+    Raises:
+        RTStruct.ROIException: If a ROI does not exist in the RTSTRUCT.
+
+    Returns:
+        ContoursByRoi: Mapping between ROI name, slice index and polygons in pixel coordinates.
+        ROIs without contours are mapped to an empty dict.
+    """
+    series_data = rtstruct.series_data
+    contours_by_uid = group_contours_by_uid(
+        rtstruct.ds,
+        roi_names,
+        get_patient_to_pixel_transformation_matrix(series_data),
+    )
+    slice_indexes = {s.SOPInstanceUID: i for i, s in enumerate(series_data)}
+
+    return {
+        roi_name: {
+            slice_indexes[uid]: polygons
+            for uid, polygons in contours.items()
+            if uid in slice_indexes
+        }
+        for roi_name, contours in contours_by_uid.items()
+    }
+
+
+def fill_slice_mask(
+    polygons_by_roi: list[list[np.ndarray]], mask_shape: tuple[int, int]
+) -> np.ndarray:
+    """Rasterize the union of the ROIs on a slice, each ROI filled separately as in rt_utils.
+
+    Args:
+        polygons_by_roi (list[list[np.ndarray]]): The polygons in pixel coordinates of each ROI on the slice.
+        mask_shape (tuple[int, int]): Shape of the mask (see get_slice_mask_shape).
+
+    Returns:
+        np.ndarray: Boolean mask of the slice, axis0=y, axis1=x.
+    """
+    mask_2d = np.zeros(mask_shape, dtype=bool)
+    for polygons in polygons_by_roi:
+        slice_mask = np.zeros(mask_shape, dtype=np.uint8)
+        cv.fillPoly(img=slice_mask, pts=polygons, color=1)
+        mask_2d |= slice_mask.astype(bool)
+
+    return mask_2d
+
+
+def iter_slice_masks(rtstruct: RTStruct, roi_names: list[str]) -> Iterator[np.ndarray]:
+    """Rasterize the union of the given ROIs one axial slice at a time.
+    Each slice mask is identical to the corresponding slice of RTStruct.get_roi_mask_by_name.
+
+    Args:
+        rtstruct (RTStruct): The RTSTRUCT wrapper.
+        roi_names (list[str]): The names of the ROIs.
+
+    Yields:
+        np.ndarray: Boolean mask of each slice in series order, axis0=y, axis1=x.
+    """
+    contours_by_roi = group_contours(rtstruct, roi_names)
+    mask_shape = get_slice_mask_shape(rtstruct)
+
+    for i in range(len(rtstruct.series_data)):
+        yield fill_slice_mask(
+            [
+                contours_by_slice[i]
+                for contours_by_slice in contours_by_roi.values()
+                if i in contours_by_slice
+            ],
+            mask_shape,
+        )
+
+
+@dataclass
+class RoiMask:
+    """3D mask of a ROI, stored only inside its bounding box."""
+
+    shape: tuple[int, int, int]  # full mask shape, axis0=y, axis1=x, axis2=z
+    offset: tuple[int, int, int]  # (y, x, z) pixel of the bounding box origin
+    mask: np.ndarray  # boolean mask inside the bounding box
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the cropped mask."""
+        return self.mask.nbytes
+
+    def _bbox_slices(self) -> tuple[slice, slice, slice]:
+        return tuple(
+            slice(start, start + size)
+            for start, size in zip(self.offset, self.mask.shape)
+        )
+
+    def add_to(self, mask_3d: np.ndarray) -> None:
+        """Add the ROI to a full-size 3D mask in place (logical OR).
+
+        Args:
+            mask_3d (np.ndarray): Boolean mask with the full shape.
+        """
+        mask_3d[self._bbox_slices()] |= self.mask
+
+    def to_volume(self) -> np.ndarray:
+        """Full-size 3D mask, as returned by RTStruct.get_roi_mask_by_name.
+
+        Returns:
+            np.ndarray: The 3D boolean mask, axis0=y, axis1=x, axis2=z.
+        """
+        mask_3d = np.zeros(self.shape, dtype=bool)
+        self.add_to(mask_3d)
+
+        return mask_3d
+
+    def coronal_projection(self) -> np.ndarray:
+        """Projection of the mask along the coronal direction (axis0=y).
+
+        Returns:
+            np.ndarray: The 2D boolean mask, axis0=x, axis1=z.
+        """
+        _, bbox_x, bbox_z = self._bbox_slices()
+        projection = np.zeros(self.shape[1:], dtype=bool)
+        projection[bbox_x, bbox_z] = self.mask.any(axis=0)
+
+        return projection
+
+
+def _get_bounding_box(
+    contours_by_slice: dict[int, list[np.ndarray]], mask_shape: tuple[int, int]
+) -> tuple[int, int, int, int, int, int]:
+    """Bounding box (y_min, y_max, x_min, x_max, z_min, z_max) of the contours, clipped to the image.
+    The box is empty (min > max) if no contour lies inside the image."""
+    if not contours_by_slice:
+        return 0, -1, 0, -1, 0, -1
+
+    pixels = np.concatenate(
+        [polygon for polygons in contours_by_slice.values() for polygon in polygons]
+    )
+    x_min, y_min = np.maximum(pixels.min(axis=0), 0)
+    x_max, y_max = np.minimum(
+        pixels.max(axis=0), [mask_shape[1] - 1, mask_shape[0] - 1]
+    )
+
+    return (
+        int(y_min),
+        int(y_max),
+        int(x_min),
+        int(x_max),
+        min(contours_by_slice),
+        max(contours_by_slice),
+    )
+
+
+def rasterize_rois(rtstruct: RTStruct, roi_names: list[str]) -> dict[str, RoiMask]:
+    """Rasterize several ROIs with a single pass over the contour data.
+    Each ROI is filled only inside its bounding box, and the slices are spread across a thread pool.
+    The masks are identical to those of RTStruct.get_roi_mask_by_name.
+
+    Args:
+        rtstruct (RTStruct): The RTSTRUCT wrapper.
+        roi_names (list[str]): The names of the ROIs.
+
+    Returns:
+        dict[str, RoiMask]: The bounding-box cropped mask of each ROI.
+    """
+    contours_by_roi = group_contours(rtstruct, roi_names)
+    mask_shape = get_slice_mask_shape(rtstruct)
+    shape = (*mask_shape, len(rtstruct.series_data))
+
+    roi_masks: dict[str, RoiMask] = {}
+    for roi_name, contours_by_slice in contours_by_roi.items():
+        y_min, y_max, x_min, x_max, z_min, z_max = _get_bounding_box(
+            contours_by_slice, mask_shape
+        )
+        roi_masks[roi_name] = RoiMask(
+            shape,
+            (y_min, x_min, z_min),
+            np.zeros(
+                (
+                    max(y_max - y_min + 1, 0),
+                    max(x_max - x_min + 1, 0),
+                    z_max - z_min + 1,
+                ),
+                dtype=bool,
+            ),
+        )
+
+    def _rasterize_slice(index: int) -> None:
+        # Each task writes a distinct slice of the cropped masks
+        for roi_name, contours_by_slice in contours_by_roi.items():
+            roi_mask = roi_masks[roi_name]
+            if index not in contours_by_slice or roi_mask.mask.size == 0:
+                continue
+
+            y_offset, x_offset, z_offset = roi_mask.offset
+            slice_mask = np.zeros(roi_mask.mask.shape[:2], dtype=np.uint8)
+            cv.fillPoly(
+                img=slice_mask,
+                pts=contours_by_slice[index],
+                color=1,
+                offset=(-x_offset, -y_offset),
+            )
+            roi_mask.mask[..., index - z_offset] = slice_mask.astype(bool)
+
+    slice_indexes = sorted(
+        {index for contours in contours_by_roi.values() for index in contours}
+    )
+    executor = get_executor(
+        "thread", config.YML["rasterization_workers"], "rasterization"
+    )
+    for _ in executor.map(_rasterize_slice, slice_indexes):
+        pass
+
+    return roi_masks
+
+
+def rasterize_coronal_projections(
+    rtstruct: RTStruct, roi_names: list[str]
+) -> dict[str, np.ndarray]:
+    """Rasterize the coronal projection of several ROIs directly in the (x, z) plane, without the 3D masks.
+
+    The filled polygon of a contour is connected, hence its projection on the x axis is the
+    interval between its leftmost and rightmost vertices. Contours crossing the top or bottom
+    border of the image are filled on the slice instead, since the clipped polygon may be narrower.
+    The result is identical to RTStruct.get_roi_mask_by_name(roi_name).any(axis=0).
+
+    Args:
+        rtstruct (RTStruct): The RTSTRUCT wrapper.
+        roi_names (list[str]): The names of the ROIs.
+
+    Returns:
+        dict[str, np.ndarray]: The 2D boolean mask of each ROI, axis0=x, axis1=z.
+    """
+    height, width = get_slice_mask_shape(rtstruct)
+
+    projections: dict[str, np.ndarray] = {}
+    for roi_name, contours_by_slice in group_contours(rtstruct, roi_names).items():
+        projection = np.zeros((width, len(rtstruct.series_data)), dtype=bool)
+        for i, polygons in contours_by_slice.items():
+            for pixels in polygons:
+                x_pixels, y_pixels = pixels[:, 0], pixels[:, 1]
+
+                if y_pixels.min() >= 0 and y_pixels.max() < height:
+                    x_min = max(x_pixels.min(), 0)
+                    x_max = min(x_pixels.max(), width - 1)
+                    if x_min <= x_max:
+                        projection[x_min : x_max + 1, i] = True
+                else:
+                    slice_mask = np.zeros((height, width), dtype=np.uint8)
+                    cv.fillPoly(img=slice_mask, pts=[pixels], color=1)
+                    projection[:, i] |= slice_mask.any(axis=0)
+
+        projections[roi_name] = projection
+
+    return projections
@@ -0,0 +1,323 @@
+"""Module implementing the asynchronous prediction jobs.
+
+A job runs the whole pipeline of a request in a bounded pool of worker threads,
+recording the progress of each stage, so that the client can poll it instead of blocking.
+The timings of the stages of each finished job are written to the trace log (see src.serving.trace).
+
+A request identical to a job queued or running, with the same model, variant, ROIs and DICOM files
+(e.g. sent again by the client after a timeout), shares that job instead of running the pipeline again.
+The DICOM files are fingerprinted through the DICOM index if configured (see src.dicom.index),
+so that the folder is not listed again at each request.
+Uploaded patients (see src.dicom.upload) are not coalesced, and always run in a thread of the server.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from onnxruntime import InferenceSession
+from src import config
+from src.batch import PipelineOutput
+from src.dicom.index import get_index
+from src.dicom.series_cache import get_folder_fingerprint
+from src.dicom.upload import UploadedPatient
+from src.pipeline import RequestInfo
+from src.serving.metrics import (
+    COALESCED_REQUESTS,
+    StageTiming,
+    count_error,
+    get_labels,
+    track_request,
+)
+from src.serving.trace import timings_to_json, write_trace
+from src.serving.workers import InvalidRequestError, WorkerPool, run_pipeline
+
+STAGES: tuple[str, ...] = ("load", "preprocess", "inference", "postprocess")
+
+
+class JobQueueFullError(Exception):
+    """Raised when the number of queued jobs reached job_queue_size."""
+
+
+@dataclass
+class Job:
+    """Prediction job and its progress."""
+
+    job_id: str
+    request_info: RequestInfo
+    status: str = "queued"  # queued, running, done or failed
+    stages: dict[str, str] = field(
+        default_factory=lambda: {stage: "pending" for stage in STAGES}
+    )
+    result: PipelineOutput | None = None
+    error: str | None = None
+    error_status: int | None = None  # HTTP status code of the error
+    coalesced: int = 0  # number of identical requests sharing the job
+    # Wall and CPU time of the stages of the pipeline, in the order they finished
+    timings: list[StageTiming] = field(default_factory=list)
+    created_at: float = field(default_factory=time.monotonic)
+    started_at: float | None = None
+    finished_at: float | None = None
+    _finished: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        """Whether the job is done or failed."""
+        return self._finished.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until the job is finished.
+
+        Args:
+            timeout (float | None): Maximum waiting time in seconds. Defaults to None (no timeout).
+
+        Returns:
+            bool: Whether the job is finished.
+        """
+        return self._finished.wait(timeout)
+
+    def start_stage(self, stage: str) -> None:
+        """Mark the running stage as done and start the next one."""
+        if self.finished:
+            return
+        for previous_stage, state in self.stages.items():
+            if state == "running":
+                self.stages[previous_stage] = "done"
+        self.stages[stage] = "running"
+
+    def finish(self, error: str | None = None, error_status: int | None = None) -> None:
+        """Mark the job as done, or failed if error is given, and wake up the waiting threads."""
+        for stage, state in self.stages.items():
+            if state == "running":
+                self.stages[stage] = "failed" if error else "done"
+        self.status = "failed" if error else "done"
+        self.error = error
+        self.error_status = error_status
+        self.finished_at = time.monotonic()
+        self._finished.set()
+
+
+def _get_files_fingerprint(dicom_path: str) -> tuple | None:
+    """Fingerprint of the DICOM files of a request: from the DICOM index if configured
+    (the RTSTRUCT and the slices of its series), otherwise from a scan of the folder."""
+    index = get_index()
+    if index is None:
+        return get_folder_fingerprint(dicom_path)
+
+    index.update(dicom_path)
+    indexed_series = index.find_series(dicom_path)
+
+    return None if indexed_series is None else indexed_series.fingerprint
+
+
+def get_coalescing_key(request_info: RequestInfo) -> str | None:
+    """Requests with the same key have the same result: same model, variant, ROIs and DICOM files.
+
+    Args:
+        request_info (RequestInfo): The request.
+
+    Returns:
+        str | None: The key. None if the DICOM files cannot be fingerprinted, e.g. if they change
+        during the scan: the request is not coalesced.
+    """
+    try:
+        fingerprint = _get_files_fingerprint(request_info.dicom_path)
+    except (OSError, sqlite3.Error) as exc:
+        logging.warning(
+            "Not coalescing the request for %s: %s", request_info.dicom_path, exc
+        )
+        return None
+    if fingerprint is None:
+        return None
+
+    return json.dumps(
+        [
+            get_labels(request_info.model_name, request_info.coll_pelvis),
+            request_info.model_name,
+            request_info.dicom_path,
+            fingerprint,
+            request_info.ptv_name,
+            request_info.oars_name,
+        ]
+    )
+
+
+def get_timings_json(job: Job) -> dict:
+    """JSON content of the timings of a finished job.
+
+    Args:
+        job (Job): The job.
+
+    Returns:
+        dict: The "QueueSeconds" before the job started, the "TotalSeconds" until it finished,
+        and the wall and CPU time of the "Stages" (see src.serving.trace.timings_to_json).
+    """
+    return {
+        "QueueSeconds": round(job.started_at - job.created_at, 6),
+        "TotalSeconds": round(job.finished_at - job.created_at, 6),
+        "Stages": timings_to_json(job.timings),
+    }
+
+
+def _trace(job: Job) -> None:
+    """Write the record of a finished job to the trace log."""
+    request_info = job.request_info
+    model_name, variant = get_labels(request_info.model_name, request_info.coll_pelvis)
+    write_trace(
+        {
+            "JobId": job.job_id,
+            "PatientId": os.path.basename(request_info.dicom_path),
+            "DicomPath": request_info.dicom_path,
+            "Model": model_name,
+            "Variant": variant,
+            "Status": job.status,
+            "ErrorStatus": job.error_status,
+            "Error": job.error,
+            "Coalesced": job.coalesced,
+            **get_timings_json(job),
+        }
+    )
+
+
+class JobManager:
+    """Run the prediction jobs in a pool of job_workers threads. With worker processes
+    (see src.serving.workers), each thread waits for the pipeline run by a worker,
+    hence the pool has at least worker_processes threads.
+    At most job_queue_size jobs wait in the queue, and the last job_history finished jobs are kept.
+    """
+
+    def __init__(self) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(config.YML["job_workers"], config.YML["worker_processes"]),
+            thread_name_prefix="job",
+        )
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        # Jobs queued or running by coalescing key
+        self._in_flight: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        request_info: RequestInfo,
+        ort_session: InferenceSession,
+        worker_pool: WorkerPool | None = None,
+        upload: UploadedPatient | None = None,
+    ) -> Job:
+        """Queue a prediction job. If coalesce_requests is set in config.yml, and an identical job
+        is queued or running, that job is returned instead.
+
+        Args:
+            request_info (RequestInfo): The request.
+            ort_session (InferenceSession): The ONNX runtime session of the requested model.
+            worker_pool (WorkerPool | None): The pool of worker processes running the pipeline.
+            Defaults to None: the pipeline runs in a thread of the server with ort_session.
+            upload (UploadedPatient | None): The uploaded series and RTSTRUCT of the request,
+            whose timings start the timings of the job. Defaults to None: read from the DICOM folder.
+
+        Raises:
+            JobQueueFullError: If job_queue_size jobs are already queued.
+
+        Returns:
+            Job: The queued job, or the identical job in flight.
+        """
+        key = (
+            get_coalescing_key(request_info)
+            if config.YML["coalesce_requests"] and upload is None
+            else None
+        )
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                job.coalesced += 1
+                COALESCED_REQUESTS.inc(
+                    get_labels(request_info.model_name, request_info.coll_pelvis)
+                )
+                logging.info("Coalesced request with job %s.", job.job_id)
+                return job
+
+            queued = sum(job.status == "queued" for job in self._jobs.values())
+            if queued >= config.YML["job_queue_size"]:
+                raise JobQueueFullError(f"{queued} jobs are already queued.")
+
+            job = Job(uuid.uuid4().hex, request_info)
+            if upload is not None:
+                job.timings.extend(upload.timings)
+                worker_pool = None  # the uploaded series is in the memory of the server
+            elif worker_pool is not None and not worker_pool.hold():
+                # Replaced by the hot reload since the request arrived
+                worker_pool = None
+            self._jobs[job.job_id] = job
+            if key is not None:
+                self._in_flight[key] = job
+            self._evict()
+
+        self._executor.submit(self._run, job, ort_session, worker_pool, key, upload)
+
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """Get a job by id.
+
+        Args:
+            job_id (str): The id returned by submit.
+
+        Returns:
+            Job | None: The job. None if the id is unknown or the job was evicted.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _evict(self) -> None:
+        """Remove the oldest finished jobs beyond job_history."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(len(finished) - config.YML["job_history"], 0)]:
+            del self._jobs[job_id]
+
+    def _run(
+        self,
+        job: Job,
+        ort_session: InferenceSession,
+        worker_pool: WorkerPool | None,
+        key: str | None,
+        upload: UploadedPatient | None = None,
+    ) -> None:
+        job.status = "running"
+        job.started_at = time.monotonic()
+        request_info = job.request_info
+        with track_request(request_info.model_name, request_info.coll_pelvis):
+            try:
+                if worker_pool is None:
+                    job.result = run_pipeline(
+                        request_info, ort_session, job.start_stage, job.timings, upload
+                    )
+                else:
+                    job.result = worker_pool.run(
+                        job.job_id, request_info, job.start_stage, job.timings
+                    )
+            except InvalidRequestError as exc:
+                logging.warning("Invalid request: %s", exc)
+                job.finish(str(exc), 400)
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                logging.exception("Job %s failed.", job.job_id)
+                job.finish(str(exc), 500)
+            else:
+                job.finish()
+            finally:
+                if worker_pool is not None:
+                    worker_pool.release()
+
+        if job.error_status is not None:
+            count_error(
+                request_info.model_name, request_info.coll_pelvis, job.error_status
+            )
+        _trace(job)
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._evict()
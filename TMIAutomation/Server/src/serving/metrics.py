@@ -0,0 +1,365 @@
+"""Module implementing the metrics of the server, exposed at /metrics in the Prometheus text format.
+
+The duration of each stage of the pipeline is recorded in a histogram by model name and variant
+(the folder of the collimator angle, 5_355 or 90), together with the number of requests, errors
+and requests in flight of the pipelines and of the HTTP endpoints. The worker processes
+(see src.serving.workers) buffer their observations, sent back to the server with each result.
+The stages of a single request can also be collected as StageTiming, for its response and the trace log.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator
+from src import config
+
+# Stages of the pipeline timed by time_stage
+STAGES: tuple[str, ...] = (
+    "upload",
+    "dicom_load",
+    "dicom_decode",
+    "rasterize",
+    "preprocess",
+    "inference",
+    "postprocess",
+    "local_optimization",
+    "visualize",
+    "field_geometry_transform",
+)
+
+# Upper bounds in seconds of the buckets of the duration histograms
+BUCKETS: tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+@dataclass
+class StageTiming:
+    """Timing of a stage of the pipeline of a request."""
+
+    stage: str
+    start: float  # UNIX time of the start
+    wall_seconds: float
+    cpu_seconds: float  # CPU time of the thread running the stage, without the ONNX runtime threads
+    failed: bool = False
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+    return f"{{{pairs}}}"
+
+
+class _Metric:
+    """Metric with a value for each combination of the label values."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, labels: tuple[str, ...], amount: float) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        """Lines of the metric in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.label_names, labels)} {value:g}"
+                )
+
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def inc(self, labels: tuple[str, ...] = (), amount: float = 1.0) -> None:
+        """Increase the count of the label values."""
+        self._add(labels, amount)
+
+
+class Gauge(_Metric):
+    """Value going up and down, e.g. the number of requests in flight."""
+
+    kind = "gauge"
+
+    def inc(self, labels: tuple[str, ...] = (), amount: float = 1.0) -> None:
+        """Increase the value of the label values."""
+        self._add(labels, amount)
+
+    def dec(self, labels: tuple[str, ...] = (), amount: float = 1.0) -> None:
+        """Decrease the value of the label values."""
+        self._add(labels, -amount)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...],
+        buckets: tuple[float, ...] = BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = buckets
+        # Count of each bucket (not cumulative), the last one above the largest bound, and sum
+        self._histograms: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, labels: tuple[str, ...], value: float) -> None:
+        """Record a value of the label values."""
+        index = next(
+            (i for i, bound in enumerate(self.buckets) if value <= bound),
+            len(self.buckets),
+        )
+        with self._lock:
+            counts, total = self._histograms.setdefault(
+                labels, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        label_names = (*self.label_names, "le")
+        with self._lock:
+            for labels, (counts, total) in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, float("inf")), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(label_names, (*labels, le))} {cumulative}"
+                    )
+                label_str = _format_labels(self.label_names, labels)
+                lines.append(f"{self.name}_sum{label_str} {total[0]:g}")
+                lines.append(f"{self.name}_count{label_str} {cumulative}")
+
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "tmi_stage_duration_seconds",
+    "Duration of the stages of the pipeline.",
+    ("stage", "model", "variant"),
+)
+PIPELINE_REQUESTS = Counter(
+    "tmi_pipeline_requests_total",
+    "Requests of a pipeline run by /predict, /jobs and /predict_batch.",
+    ("model", "variant"),
+)
+PIPELINE_ERRORS = Counter(
+    "tmi_pipeline_errors_total",
+    "Failed requests of a pipeline, and those rejected with 503.",
+    ("model", "variant", "status"),
+)
+PIPELINE_IN_FLIGHT = Gauge(
+    "tmi_pipeline_in_flight",
+    "Requests of a pipeline running.",
+    ("model", "variant"),
+)
+COALESCED_REQUESTS = Counter(
+    "tmi_coalesced_requests_total",
+    "Requests sharing the job of an identical request in flight.",
+    ("model", "variant"),
+)
+HTTP_REQUESTS = Counter(
+    "tmi_http_requests_total",
+    "HTTP requests by endpoint and status code.",
+    ("endpoint", "method", "status"),
+)
+HTTP_IN_FLIGHT = Gauge(
+    "tmi_http_requests_in_flight",
+    "HTTP requests being handled.",
+    ("endpoint",),
+)
+
+METRICS: tuple[_Metric, ...] = (
+    STAGE_SECONDS,
+    PIPELINE_REQUESTS,
+    PIPELINE_ERRORS,
+    PIPELINE_IN_FLIGHT,
+    COALESCED_REQUESTS,
+    HTTP_REQUESTS,
+    HTTP_IN_FLIGHT,
+)
+
+# Observations (stage, model, variant, seconds) not recorded yet, in a worker process
+_BUFFER: list[tuple[str, str, str, float]] | None = None
+
+
+def get_labels(model_name: str, coll_pelvis: bool | None = None) -> tuple[str, str]:
+    """Model and variant labels of a request.
+
+    Args:
+        model_name (str): The name of the model. Unknown names are labeled "unknown".
+        coll_pelvis (bool | None): Collimator angle of the model. Defaults to None: coll_pelvis in config.yml.
+
+    Returns:
+        tuple[str, str]: The model name and the folder of the variant, e.g. ("body_cnn", "5_355").
+    """
+    if model_name not in (config.MODEL_NAME_BODY, config.MODEL_NAME_ARMS):
+        model_name = "unknown"
+    if coll_pelvis is None:
+        coll_pelvis = config.YML["coll_pelvis"]
+
+    return model_name, config.get_model_dir(coll_pelvis)
+
+
+def observe_stage(
+    stage: str, model_name: str, coll_pelvis: bool | None, seconds: float
+) -> None:
+    """Record the duration of a stage, or buffer it in a worker process.
+
+    Args:
+        stage (str): One of STAGES.
+        model_name (str): The name of the model.
+        coll_pelvis (bool | None): Collimator angle of the model.
+        seconds (float): The duration.
+    """
+    observation = (stage, *get_labels(model_name, coll_pelvis), seconds)
+    if _BUFFER is not None:
+        _BUFFER.append(observation)
+    else:
+        record_observations([observation])
+
+
+@contextmanager
+def time_stage(
+    stage: str,
+    model_name: str,
+    coll_pelvis: bool | None = None,
+    timings: list[StageTiming] | None = None,
+) -> Iterator[None]:
+    """Time a stage of the pipeline. Stages raising an exception are not recorded in the metrics.
+
+    Args:
+        stage (str): One of STAGES.
+        model_name (str): The name of the model.
+        coll_pelvis (bool | None): Collimator angle of the model. Defaults to None: coll_pelvis in config.yml.
+        timings (list[StageTiming] | None): Where the timing of the stage is appended, also if it fails.
+        Defaults to None: only recorded in the metrics.
+    """
+    start_time = time.time()
+    start, start_cpu = time.perf_counter(), time.thread_time()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        wall_seconds = time.perf_counter() - start
+        if timings is not None:
+            timings.append(
+                StageTiming(
+                    stage,
+                    start_time,
+                    wall_seconds,
+                    time.thread_time() - start_cpu,
+                    failed,
+                )
+            )
+    observe_stage(stage, model_name, coll_pelvis, wall_seconds)
+
+
+def buffer_observations() -> None:
+    """Buffer the observations of this process, to be sent with take_observations."""
+    global _BUFFER  # pylint: disable=global-statement
+    _BUFFER = []
+
+
+def take_observations() -> list[tuple[str, str, str, float]]:
+    """Get and clear the buffered observations.
+
+    Returns:
+        list[tuple[str, str, str, float]]: The stage, model, variant and seconds of each observation.
+    """
+    global _BUFFER  # pylint: disable=global-statement
+    observations, _BUFFER = _BUFFER or [], []
+
+    return observations
+
+
+def record_observations(observations: list[tuple[str, str, str, float]]) -> None:
+    """Record the observations of the stages, e.g. sent by a worker process.
+
+    Args:
+        observations (list[tuple[str, str, str, float]]): The stage, model, variant and seconds
+        of each observation.
+    """
+    for stage, model_name, variant, seconds in observations:
+        STAGE_SECONDS.observe((stage, model_name, variant), seconds)
+
+
+@contextmanager
+def track_request(model_name: str, coll_pelvis: bool | None = None) -> Iterator[None]:
+    """Count a request of a pipeline and keep it in flight until the end of the block.
+
+    Args:
+        model_name (str): The name of the model.
+        coll_pelvis (bool | None): Collimator angle of the model. Defaults to None: coll_pelvis in config.yml.
+    """
+    labels = get_labels(model_name, coll_pelvis)
+    PIPELINE_REQUESTS.inc(labels)
+    PIPELINE_IN_FLIGHT.inc(labels)
+    try:
+        yield
+    finally:
+        PIPELINE_IN_FLIGHT.dec(labels)
+
+
+def count_error(model_name: str, coll_pelvis: bool | None, status: int) -> None:
+    """Count a failed request of a pipeline.
+
+    Args:
+        model_name (str): The name of the model.
+        coll_pelvis (bool | None): Collimator angle of the model.
+        status (int): The HTTP status code of the error.
+    """
+    PIPELINE_ERRORS.inc((*get_labels(model_name, coll_pelvis), str(status)))
+
+
+def render() -> str:
+    """All the metrics in the Prometheus text format.
+
+    Returns:
+        str: The exposition text.
+    """
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
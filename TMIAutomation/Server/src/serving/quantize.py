@@ -0,0 +1,336 @@
+"""Offline tool producing quantized variants of the models, with a geometric accuracy gate.
+
+For each model loaded by the server (see src.serving.sessions.get_model_variants), the variants are
+written next to the model, e.g. models/5_355/body_cnn.int8_dynamic.onnx:
+- int8_dynamic: INT8 weights, activations quantized at run time.
+- int8_static: INT8 weights and activations, calibrated on the preprocessed inputs of the cases.
+- fp16: FP16 weights, with float32 inputs and outputs.
+
+The gate runs the original and the quantized model through the full pipeline on the cases, and reports
+the maximum deviation of the isocenters and of the jaw apertures in mm in patient coordinates,
+and the speed-up of the inference. The variants within the tolerance are accepted in
+models/<dir>/quantization.json, and the server loads them with model_precision in config.yml.
+A variant is evaluated from a staging file, and replaces the served variant only once accepted.
+
+The cases are a JSON file with the body of /predict_batch. Run from the server folder, e.g.:
+    python -m src.serving.quantize cases.json --precision int8_dynamic int8_static fp16 --tolerance-mm 1
+"""
+
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from typing import Callable
+from functools import partial
+from dataclasses import dataclass, asdict
+import numpy as np
+import onnx
+from onnxruntime import InferenceSession
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+from onnxruntime.transformers.float16 import convert_float_to_float16
+from src import config
+from src.batch import PipelineOutput
+from src.pipeline import Pipeline, RequestInfo
+from src.serving.sessions import (
+    PRECISIONS,
+    get_model_key,
+    get_model_path,
+    get_model_variants,
+    get_quantization_report_path,
+    get_session_options,
+)
+
+
+@dataclass
+class GateResult:
+    """Result of the accuracy gate for a quantized model."""
+
+    accepted: bool
+    cases: int
+    isocenter_mm: float  # maximum distance between the isocenters
+    jaw_mm: float  # maximum difference of the jaw apertures
+    speedup: float  # inference time of the original model / of the quantized model
+    tolerance_mm: float
+
+
+class _CalibrationReader(CalibrationDataReader):
+    """Feeds the preprocessed inputs one by one to the static quantization."""
+
+    def __init__(self, input_name: str, model_inputs: np.ndarray) -> None:
+        self._inputs = iter(
+            {input_name: model_inputs[i : i + 1]} for i in range(len(model_inputs))
+        )
+
+    def get_next(self) -> dict[str, np.ndarray] | None:
+        return next(self._inputs, None)
+
+
+def quantize_model(
+    model_path: str, output_path: str, precision: str, calibration_inputs: np.ndarray
+) -> None:
+    """Write the quantized variant of a model.
+
+    Args:
+        model_path (str): Path to the float32 model.
+        output_path (str): Path to the quantized model.
+        precision (str): One of PRECISIONS, except float32.
+        calibration_inputs (np.ndarray): Preprocessed inputs with shape (N, C, H, W),
+        used by the static quantization.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, os.path.basename(output_path))
+        if precision == "int8_dynamic":
+            quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+        elif precision == "int8_static":
+            preprocessed_path = os.path.join(tmp_dir, "preprocessed.onnx")
+            quant_pre_process(model_path, preprocessed_path, skip_symbolic_shape=True)
+            input_name = onnx.load(model_path).graph.input[0].name
+            quantize_static(
+                preprocessed_path,
+                tmp_path,
+                _CalibrationReader(input_name, calibration_inputs),
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+            )
+        elif precision == "fp16":
+            onnx.save(
+                convert_float_to_float16(onnx.load(model_path), keep_io_types=True),
+                tmp_path,
+            )
+        else:
+            raise ValueError(f"Unknown precision {precision}.")
+
+        shutil.move(tmp_path, output_path)
+
+
+def _predict(
+    request_info: RequestInfo, ort_session: InferenceSession
+) -> PipelineOutput:
+    """Full pipeline, with the same random state for the local optimization of every model."""
+    random.seed(0)
+    np.random.seed(0)
+
+    return Pipeline(request_info).predict(ort_session)
+
+
+def _time_inference(
+    ort_session: InferenceSession, model_inputs: np.ndarray, repeat: int
+) -> float:
+    """Median time in seconds to run the model on each input."""
+    input_name = ort_session.get_inputs()[0].name
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(len(model_inputs)):
+            ort_session.run(None, {input_name: model_inputs[i : i + 1]})
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+def evaluate(
+    request_infos: list[RequestInfo],
+    reference_outputs: list[PipelineOutput],
+    reference_time: float,
+    ort_session: InferenceSession,
+    model_inputs: np.ndarray,
+    tolerance_mm: float,
+    repeat: int,
+) -> GateResult:
+    """Run the accuracy gate of a quantized model.
+
+    Args:
+        request_infos (list[RequestInfo]): The cases.
+        reference_outputs (list[PipelineOutput]): Outputs of the pipeline with the original model.
+        reference_time (float): Inference time of the original model on model_inputs.
+        ort_session (InferenceSession): Session of the quantized model.
+        model_inputs (np.ndarray): Preprocessed inputs of the cases with shape (N, C, H, W).
+        tolerance_mm (float): Maximum deviation of the isocenters and jaw apertures.
+        repeat (int): Number of repetitions of the timing.
+
+    Returns:
+        GateResult: The result.
+    """
+    isocenter_mm, jaw_mm = 0.0, 0.0
+    for request_info, reference in zip(request_infos, reference_outputs):
+        isocenters, jaws_X, jaws_Y = _predict(request_info, ort_session)
+        isocenter_mm = max(
+            isocenter_mm,
+            float(np.linalg.norm(isocenters - reference[0], axis=-1).max()),
+        )
+        jaw_mm = max(
+            jaw_mm,
+            float(np.abs(jaws_X - reference[1]).max()),
+            float(np.abs(jaws_Y - reference[2]).max()),
+        )
+
+    return GateResult(
+        accepted=bool(request_infos)
+        and isocenter_mm <= tolerance_mm
+        and jaw_mm <= tolerance_mm,
+        cases=len(request_infos),
+        isocenter_mm=isocenter_mm,
+        jaw_mm=jaw_mm,
+        speedup=reference_time / _time_inference(ort_session, model_inputs, repeat),
+        tolerance_mm=tolerance_mm,
+    )
+
+
+def gate_model(
+    model_path: str,
+    output_path: str,
+    precision: str,
+    calibration_inputs: np.ndarray,
+    evaluate_session: Callable[[InferenceSession], GateResult],
+) -> GateResult:
+    """Quantize a model next to the served variant, and replace the served variant only if accepted.
+    The served variant and the report are left as they are while the quantized model is evaluated,
+    since a running server may reload them at any time.
+
+    Args:
+        model_path (str): Path to the float32 model.
+        output_path (str): Path to the quantized model loaded by the server.
+        precision (str): One of PRECISIONS, except float32.
+        calibration_inputs (np.ndarray): Preprocessed inputs with shape (N, C, H, W),
+        used by the static quantization.
+        evaluate_session (Callable[[InferenceSession], GateResult]): Runs the accuracy gate
+        on the session of the quantized model.
+
+    Returns:
+        GateResult: The result of the gate.
+    """
+    staging_path = f"{output_path}.staging"
+    try:
+        quantize_model(model_path, staging_path, precision, calibration_inputs)
+        result = evaluate_session(InferenceSession(staging_path, get_session_options()))
+        if result.accepted:
+            # Replaced at once, since a running server may reload the model
+            os.replace(staging_path, output_path)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    return result
+
+
+def write_report(
+    model_name: str, coll_pelvis: bool, results: dict[str, GateResult]
+) -> None:
+    """Add the results of a model to the report of the gate, read by the server.
+
+    Args:
+        model_name (str): The name of the model, body_cnn or arms_cnn.
+        coll_pelvis (bool): Collimator angle of the model.
+        results (dict[str, GateResult]): The result of each precision.
+    """
+    report_path = get_quantization_report_path(coll_pelvis)
+    try:
+        with open(report_path, "r", encoding="utf-8") as report_file:
+            report = json.load(report_file)
+    except (OSError, ValueError):
+        report = {}
+
+    report.setdefault(model_name, {}).update(
+        {precision: asdict(result) for precision, result in results.items()}
+    )
+    with open(report_path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+def _load_cases(cases_path: str) -> list[RequestInfo]:
+    with open(cases_path, "r", encoding="utf-8") as cases_file:
+        items = json.load(cases_file)["requests"]
+
+    return [
+        RequestInfo(
+            item["model_name"],
+            item["dicom_path"],
+            item["ptv_name"],
+            item["oars_name"],
+            item.get("coll_pelvis", config.YML["coll_pelvis"]),
+        )
+        for item in items
+    ]
+
+
+def main() -> None:
+    """Script entry point."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("cases", help="JSON file with the body of /predict_batch.")
+    parser.add_argument(
+        "--precision", nargs="+", choices=PRECISIONS[1:], default=PRECISIONS[1:]
+    )
+    parser.add_argument("--tolerance-mm", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    request_infos = _load_cases(args.cases)
+    # The preprocessed input does not depend on the model
+    model_inputs = []
+    for request_info in request_infos:
+        pipeline = Pipeline(request_info)
+        pipeline.preprocess()
+        model_inputs.append(pipeline.get_model_input())
+
+    print(
+        f"{'model':>14} {'precision':>12} {'cases':>5} {'isocenter [mm]':>14} "
+        f"{'jaw [mm]':>8} {'speed-up':>8} {'accepted':>8}"
+    )
+    for model_name, coll_pelvis in get_model_variants():
+        model_path = get_model_path(model_name, coll_pelvis)
+        if not os.path.exists(model_path):
+            continue
+
+        cases = [
+            i
+            for i, request_info in enumerate(request_infos)
+            if request_info.model_name == model_name
+            and request_info.coll_pelvis == coll_pelvis
+        ]
+        case_inputs = np.concatenate([model_inputs[i] for i in cases] or model_inputs)
+        original = InferenceSession(model_path, get_session_options())
+        reference_outputs = [_predict(request_infos[i], original) for i in cases]
+        reference_time = _time_inference(original, case_inputs, args.repeat)
+
+        results = {}
+        for precision in args.precision:
+            results[precision] = result = gate_model(
+                model_path,
+                get_model_path(model_name, coll_pelvis, precision),
+                precision,
+                np.concatenate(model_inputs),
+                partial(
+                    evaluate,
+                    [request_infos[i] for i in cases],
+                    reference_outputs,
+                    reference_time,
+                    model_inputs=case_inputs,
+                    tolerance_mm=args.tolerance_mm,
+                    repeat=args.repeat,
+                ),
+            )
+            print(
+                f"{get_model_key(model_name, coll_pelvis):>14} {precision:>12} "
+                f"{result.cases:>5} {result.isocenter_mm:>14.2f} {result.jaw_mm:>8.2f} "
+                f"{result.speedup:>8.2f} {str(result.accepted):>8}"
+            )
+
+        write_report(model_name, coll_pelvis, results)
+
+
+if __name__ == "__main__":
+    main()
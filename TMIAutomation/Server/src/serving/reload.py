@@ -0,0 +1,280 @@
+"""Module implementing the hot reload of config.yml and of the models, without restarting the server.
+
+A daemon thread polls config.yml and the models of the current collimator angle every reload_poll_seconds.
+A new configuration is applied at once. If the models, coll_pelvis or the settings of the sessions changed,
+new sessions (and worker processes) are loaded and warmed up in the background, then swapped in atomically.
+Each request uses the models current when it arrives, so the requests in flight finish on the old sessions.
+The thread pools, caches, port and storage watcher keep the settings read at the server start.
+"""
+
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass
+import yaml
+from onnxruntime import InferenceSession
+from src import config
+from src.serving.scheduler import BatchScheduler, add_schedulers
+from src.serving.sessions import (
+    get_model_key,
+    get_model_variants,
+    get_quantization_report_path,
+    get_served_model_path,
+)
+from src.serving.warmup import READINESS, Readiness, load_models, warm_up
+from src.serving.workers import WorkerPool
+
+# Keys of config.yml, besides the ort_* keys, that require loading the models again
+MODEL_KEYS: tuple[str, ...] = (
+    "coll_pelvis",
+    "inference_batch_window_ms",
+    "load_all_variants",
+    "max_batch_size",
+    "model_precision",
+    "warmup",
+)
+
+
+@dataclass(frozen=True)
+class ModelSet:
+    """Models loaded together, swapped atomically by the hot reload."""
+
+    coll_pelvis: bool  # collimator angle of the requests that do not choose it
+    # Session of each model key, e.g. body_cnn/5_355 (see src.serving.sessions)
+    ort_sessions: dict[str, InferenceSession | BatchScheduler | None]
+    worker_pool: WorkerPool | None = None  # None if the pipelines run in the server
+
+    def get_session(
+        self, model_name: str, coll_pelvis: bool | None = None
+    ) -> InferenceSession | BatchScheduler | None:
+        """Get the session of a model variant.
+
+        Args:
+            model_name (str): The name of the model, body_cnn or arms_cnn.
+            coll_pelvis (bool | None): Collimator angle of the model. Defaults to None: that of the model set.
+
+        Returns:
+            InferenceSession | BatchScheduler | None: The session. None if the model name is unknown
+            or the variant is not loaded.
+        """
+        if coll_pelvis is None:
+            coll_pelvis = self.coll_pelvis
+
+        return self.ort_sessions.get(get_model_key(model_name, coll_pelvis))
+
+
+_MODELS: ModelSet | None = None
+
+
+def get_models() -> ModelSet | None:
+    """Get the current models. A request should get them once, to use the same models until the end.
+
+    Returns:
+        ModelSet | None: The models. None before the models are loaded at the server start.
+    """
+    return _MODELS
+
+
+def set_models(models: ModelSet) -> None:
+    """Swap in the models, also setting config.ORT_SESSION_BODY and config.ORT_SESSION_ARMS.
+
+    Args:
+        models (ModelSet): The new models.
+    """
+    global _MODELS  # pylint: disable=global-statement
+    _MODELS = models
+    config.ORT_SESSION_BODY = models.get_session(config.MODEL_NAME_BODY)
+    config.ORT_SESSION_ARMS = models.get_session(config.MODEL_NAME_ARMS)
+
+
+def _get_model_settings(yml: dict) -> dict:
+    return {
+        key: value
+        for key, value in yml.items()
+        if key in MODEL_KEYS or key.startswith("ort_")
+    }
+
+
+def _get_models_fingerprint(yml: dict) -> tuple[tuple[str, int, int] | None, ...]:
+    """Path, modification time and size of the model files of the variants in yml,
+    and of the reports of the quantization gate."""
+    paths = [
+        get_served_model_path(model_name, coll_pelvis, yml)
+        for model_name, coll_pelvis in get_model_variants(yml)
+    ]
+    paths += sorted(
+        {
+            get_quantization_report_path(coll_pelvis)
+            for _, coll_pelvis in get_model_variants(yml)
+        }
+    )
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            fingerprint.append(None)
+
+    return tuple(fingerprint)
+
+
+def apply_config(yml: dict) -> None:
+    """Replace the configuration read from config.yml.
+
+    Args:
+        yml (dict): The new configuration.
+    """
+    changed_keys = sorted(
+        key
+        for key in yml.keys() | config.YML.keys()
+        if yml.get(key) != config.YML.get(key)
+    )
+    config.YML = yml
+    config.MODEL_DIR = config.get_model_dir(yml["coll_pelvis"])
+    logging.getLogger().setLevel(yml["log_level"])
+    logging.info("Reloaded config.yml, changed: %s.", ", ".join(changed_keys))
+
+
+def _retire(models: ModelSet) -> None:
+    """Release the replaced models once their requests in flight are finished."""
+    for ort_session in models.ort_sessions.values():
+        if isinstance(ort_session, BatchScheduler):
+            ort_session.close()
+    if models.worker_pool is not None:
+        models.worker_pool.retire()
+
+
+def reload_models(yml: dict) -> bool:
+    """Load and warm up the models for the configuration, then swap them in.
+    The current models are kept if a model that is currently loaded cannot be loaded.
+
+    Args:
+        yml (dict): The configuration.
+
+    Returns:
+        bool: Whether the models were swapped in.
+    """
+    start = time.perf_counter()
+    current = get_models()
+    readiness = Readiness()
+    ort_sessions = load_models(yml, readiness)
+    missing = [
+        model_name
+        for model_name, ort_session in ort_sessions.items()
+        if ort_session is None and current.ort_sessions.get(model_name) is not None
+    ]
+    if missing:
+        logging.error(
+            "Could not reload %s: keeping the current models.", ", ".join(missing)
+        )
+        return False
+
+    if yml["warmup"]:
+        warm_up(ort_sessions, readiness)
+    readiness.finished = True
+
+    worker_pool = None
+    if yml["worker_processes"] > 0:
+        # The worker processes read the new config.yml at start
+        worker_pool = WorkerPool(yml["worker_processes"], yml["worker_threads"])
+        worker_pool.start()
+
+    set_models(ModelSet(yml["coll_pelvis"], add_schedulers(ort_sessions), worker_pool))
+    vars(READINESS).update(vars(readiness))
+    _retire(current)
+    logging.info("Reloaded the models in %.2f s.", time.perf_counter() - start)
+
+    return True
+
+
+class HotReloader:
+    """Polls config.yml and the model files, applying the changes.
+    A change of the model files is applied once they did not change for one poll, as when being copied.
+    """
+
+    def __init__(self, poll_seconds: float | None = None) -> None:
+        self.poll_seconds = (
+            config.YML["reload_poll_seconds"] if poll_seconds is None else poll_seconds
+        )
+        self._config_mtime_ns = os.stat("config.yml").st_mtime_ns
+        # Configuration and model files of the current models
+        self._models_yml = config.YML
+        self._models_fingerprint = _get_models_fingerprint(config.YML)
+        self._seen_fingerprint = self._models_fingerprint
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def check_once(self) -> bool:
+        """Apply the changes of config.yml, and reload the models if needed.
+
+        Returns:
+            bool: Whether the models were reloaded.
+        """
+        config_mtime_ns = os.stat("config.yml").st_mtime_ns
+        if config_mtime_ns != self._config_mtime_ns:
+            self._config_mtime_ns = config_mtime_ns
+            try:
+                yml = config.read_yml()
+            except yaml.YAMLError:
+                logging.exception("Could not reload config.yml.")
+                return False
+            missing_keys = config.YML.keys() - (
+                yml.keys() if isinstance(yml, dict) else set()
+            )
+            if missing_keys:
+                logging.error(
+                    "Could not reload config.yml, missing: %s.",
+                    ", ".join(sorted(missing_keys)),
+                )
+                return False
+            if yml != config.YML:
+                apply_config(yml)
+
+        yml = config.YML
+        fingerprint = _get_models_fingerprint(yml)
+        if fingerprint != self._seen_fingerprint:
+            self._seen_fingerprint = fingerprint
+            return False
+
+        # The worker processes read config.yml only at start
+        models_yml_changed = (
+            yml != self._models_yml
+            if yml["worker_processes"] > 0
+            else _get_model_settings(yml) != _get_model_settings(self._models_yml)
+        )
+        if fingerprint == self._models_fingerprint and not models_yml_changed:
+            return False
+
+        # Not retried until the files or config.yml change again
+        self._models_yml = yml
+        self._models_fingerprint = fingerprint
+
+        return reload_models(yml)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.check_once()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logging.exception("Could not reload the configuration or the models.")
+
+    def start(self) -> None:
+        """Poll config.yml and the models in a daemon thread, unless reload_poll_seconds is 0."""
+        if self.poll_seconds <= 0:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="hot-reloader", daemon=True
+        )
+        self._thread.start()
+        logging.info("Watching config.yml and the models for changes.")
+
+    def stop(self) -> None:
+        """Stop polling and wait for the ongoing reload to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
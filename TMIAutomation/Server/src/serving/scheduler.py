@@ -0,0 +1,225 @@
+"""Module implementing the micro-batching of the inferences of concurrent requests.
+
+A scheduler sits in front of the ONNX runtime session of a model, with the same run/get_inputs interface.
+It collects the inputs of concurrent pipelines for up to inference_batch_window_ms after the first one
+(or until max_batch_size rows), runs a single batched inference, and hands each caller its rows.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+import numpy as np
+from onnxruntime import InferenceSession
+from src import config
+
+
+@dataclass
+class SchedulerStats:
+    """Counters of the scheduler, used to tune the batching window."""
+
+    queue_depth: int = 0  # requests waiting for the next batch
+    requests: int = 0
+    batches: int = 0
+    # Number of batches of each size (rows)
+    batch_sizes: dict[int, int] = field(default_factory=dict)
+    wait_seconds_total: float = 0.0  # time from the request to its batch
+    wait_seconds_max: float = 0.0
+
+
+@dataclass
+class _Request:
+    inputs: np.ndarray
+    enqueued_at: float = field(default_factory=time.monotonic)
+    future: Future = field(default_factory=Future)
+
+
+class BatchScheduler:
+    """Micro-batching scheduler of a model, used in place of its InferenceSession.
+    Models with a fixed batch size are run directly, without batching.
+    """
+
+    def __init__(
+        self, ort_session: InferenceSession, window_seconds: float, max_batch_size: int
+    ) -> None:
+        self.ort_session = ort_session
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._queue: deque[_Request] = deque()
+        self._condition = threading.Condition()
+        self._stats = SchedulerStats()
+        self._closed = False
+
+        batch_size = ort_session.get_inputs()[0].shape[0]
+        self.batching = not isinstance(batch_size, int) or batch_size <= 0
+        if self.batching:
+            threading.Thread(
+                target=self._dispatch, name="inference-scheduler", daemon=True
+            ).start()
+
+    @property
+    def stats(self) -> SchedulerStats:
+        """Snapshot of the scheduler counters."""
+        with self._condition:
+            return SchedulerStats(
+                queue_depth=len(self._queue),
+                requests=self._stats.requests,
+                batches=self._stats.batches,
+                batch_sizes=dict(self._stats.batch_sizes),
+                wait_seconds_total=self._stats.wait_seconds_total,
+                wait_seconds_max=self._stats.wait_seconds_max,
+            )
+
+    def get_inputs(self) -> list:
+        """Inputs of the model, as InferenceSession.get_inputs."""
+        return self.ort_session.get_inputs()
+
+    def get_outputs(self) -> list:
+        """Outputs of the model, as InferenceSession.get_outputs."""
+        return self.ort_session.get_outputs()
+
+    def run(
+        self, output_names: list[str] | None, input_feed: dict[str, np.ndarray]
+    ) -> list[np.ndarray]:
+        """Run the model on the inputs, batched with those of concurrent callers.
+        Same interface as InferenceSession.run: only the rows of the caller are returned.
+
+        Args:
+            output_names (list[str] | None): Names of the outputs. If not None, the model is run directly.
+            input_feed (dict[str, np.ndarray]): The input of the model, with shape (N, C, H, W).
+
+        Returns:
+            list[np.ndarray]: The outputs of the model for the N input rows.
+        """
+        if not self.batching or output_names is not None or len(input_feed) != 1:
+            return self.ort_session.run(output_names, input_feed)
+
+        request = _Request(next(iter(input_feed.values())))
+        with self._condition:
+            closed = self._closed
+            if not closed:
+                self._queue.append(request)
+                self._condition.notify()
+
+        if closed:
+            return self.ort_session.run(None, input_feed)
+
+        return request.future.result()
+
+    def close(self) -> None:
+        """Stop the scheduler thread once the queued requests are run, e.g. when the model is replaced.
+        Later calls to run are not batched."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _collect_batch(self) -> list[_Request]:
+        """Wait for the first request, then for the window or a full batch, and pop the batch.
+        Empty if the scheduler is closed and no request is queued."""
+        with self._condition:
+            while not self._queue:
+                if self._closed:
+                    return []
+                self._condition.wait()
+
+            deadline = self._queue[0].enqueued_at + self.window_seconds
+            queued_rows = sum(len(request.inputs) for request in self._queue)
+            while queued_rows < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+                queued_rows = sum(len(request.inputs) for request in self._queue)
+
+            # The first request is always taken, even if larger than max_batch_size
+            batch = [self._queue.popleft()]
+            rows = len(batch[0].inputs)
+            while self._queue:
+                next_rows = len(self._queue[0].inputs)
+                if rows + next_rows > self.max_batch_size:
+                    break
+                rows += next_rows
+                batch.append(self._queue.popleft())
+
+            now = time.monotonic()
+            self._stats.requests += len(batch)
+            self._stats.batches += 1
+            self._stats.batch_sizes[rows] = self._stats.batch_sizes.get(rows, 0) + 1
+            for request in batch:
+                wait_seconds = now - request.enqueued_at
+                self._stats.wait_seconds_total += wait_seconds
+                self._stats.wait_seconds_max = max(
+                    self._stats.wait_seconds_max, wait_seconds
+                )
+
+        return batch
+
+    def _dispatch(self) -> None:
+        input_name = self.ort_session.get_inputs()[0].name
+        while batch := self._collect_batch():
+            try:
+                outputs = self.ort_session.run(
+                    None,
+                    {input_name: np.concatenate([request.inputs for request in batch])},
+                )
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                logging.exception(
+                    "Batched inference of %d requests failed.", len(batch)
+                )
+                for request in batch:
+                    request.future.set_exception(exc)
+                continue
+
+            start = 0
+            for request in batch:
+                stop = start + len(request.inputs)
+                request.future.set_result([output[start:stop] for output in outputs])
+                start = stop
+
+
+SCHEDULERS: dict[str, BatchScheduler] = {}
+
+
+def add_schedulers(
+    ort_sessions: dict[str, InferenceSession | None],
+) -> dict[str, InferenceSession | BatchScheduler | None]:
+    """Put a scheduler in front of each loaded session, if inference_batch_window_ms in config.yml is > 0.
+    Models sharing a session share its scheduler. The schedulers replace those in SCHEDULERS, by model key.
+
+    Args:
+        ort_sessions (dict[str, InferenceSession | None]): The session of each model key, None if not loaded.
+
+    Returns:
+        dict[str, InferenceSession | BatchScheduler | None]: The scheduler of each loaded model,
+        or the sessions unchanged if batching is disabled.
+    """
+    if config.YML["inference_batch_window_ms"] <= 0:
+        return ort_sessions
+
+    schedulers = {}
+    schedulers_by_session: dict[int, BatchScheduler] = {}
+    for model_key, ort_session in ort_sessions.items():
+        if ort_session is None:
+            schedulers[model_key] = None
+            continue
+
+        if id(ort_session) not in schedulers_by_session:
+            schedulers_by_session[id(ort_session)] = BatchScheduler(
+                ort_session,
+                config.YML["inference_batch_window_ms"] / 1000,
+                config.YML["max_batch_size"],
+            )
+        schedulers[model_key] = schedulers_by_session[id(ort_session)]
+
+    SCHEDULERS.clear()
+    SCHEDULERS.update(
+        {
+            model_key: scheduler
+            for model_key, scheduler in schedulers.items()
+            if scheduler is not None
+        }
+    )
+
+    return schedulers
@@ -0,0 +1,395 @@
+"""Module implementing the loading of the ONNX runtime sessions of the models.
+
+The body and arms models are loaded for the collimator angle of the pelvis fields set in config.yml,
+and with load_all_variants also for the other angle, so that each request can choose its variant.
+Each session is identified by its model key, e.g. body_cnn/5_355. Identical model files share
+the same session, and with ort_shared_arena the sessions share the memory arena of the environment.
+With model_precision, the quantized variant of the models is loaded if accepted by the gate
+of src.serving.quantize, otherwise the float32 model.
+
+The session options are read from the ort_* keys of config.yml. With ort_model_cache set to "onnx" or "ort",
+the graph optimized at the first start is saved next to the models and loaded at the next starts,
+skipping the graph optimizations.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import platform
+import threading
+from typing import Iterator
+import onnxruntime
+from src import config
+
+GRAPH_OPTIMIZATION_LEVELS: dict[str, onnxruntime.GraphOptimizationLevel] = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES: dict[str, onnxruntime.ExecutionMode] = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+
+# float32 is the original model, the others are produced by src.serving.quantize
+PRECISIONS: tuple[str, ...] = ("float32", "int8_dynamic", "int8_static", "fp16")
+
+_SHARED_ARENA_REGISTERED = False
+_SHARED_ARENA_LOCK = threading.Lock()
+
+
+def get_model_key(model_name: str, coll_pelvis: bool | None = None) -> str:
+    """Key of the session of a model variant.
+
+    Args:
+        model_name (str): The name of the model, body_cnn or arms_cnn.
+        coll_pelvis (bool | None): Collimator angle of the model. Defaults to None: coll_pelvis in config.yml.
+
+    Returns:
+        str: The key, e.g. body_cnn/5_355.
+    """
+    if coll_pelvis is None:
+        coll_pelvis = config.YML["coll_pelvis"]
+
+    return f"{model_name}/{config.get_model_dir(coll_pelvis)}"
+
+
+def get_model_variants(yml: dict | None = None) -> list[tuple[str, bool]]:
+    """Models to load: the body and arms models for the collimator angle in config.yml,
+    then for the other angle if load_all_variants is true.
+
+    Args:
+        yml (dict | None): The configuration. Defaults to the current config.yml.
+
+    Returns:
+        list[tuple[str, bool]]: The name and collimator angle of each model.
+    """
+    yml = config.YML if yml is None else yml
+    coll_pelvis_variants = [yml["coll_pelvis"]]
+    if yml["load_all_variants"]:
+        coll_pelvis_variants.append(not yml["coll_pelvis"])
+
+    return [
+        (model_name, coll_pelvis)
+        for coll_pelvis in coll_pelvis_variants
+        for model_name in (config.MODEL_NAME_BODY, config.MODEL_NAME_ARMS)
+    ]
+
+
+def get_model_path(
+    model_name: str, coll_pelvis: bool | None = None, precision: str = "float32"
+) -> str:
+    """Path of the ONNX model for a collimator angle.
+
+    Args:
+        model_name (str): The name of the model, body_cnn or arms_cnn.
+        coll_pelvis (bool | None): Collimator angle of the model. Defaults to None: coll_pelvis in config.yml.
+        precision (str): One of PRECISIONS. Defaults to float32: the original model.
+
+    Returns:
+        str: Path to the .onnx file, e.g. models/5_355/body_cnn.int8_dynamic.onnx for a quantized model.
+    """
+    if coll_pelvis is None:
+        coll_pelvis = config.YML["coll_pelvis"]
+    file_name = (
+        f"{model_name}.onnx"
+        if precision == "float32"
+        else f"{model_name}.{precision}.onnx"
+    )
+
+    return os.path.join("models", config.get_model_dir(coll_pelvis), file_name)
+
+
+def get_quantization_report_path(coll_pelvis: bool | None = None) -> str:
+    """Path of the report of the quantization gate, in the folder of the models.
+
+    Args:
+        coll_pelvis (bool | None): Collimator angle of the models. Defaults to None: coll_pelvis in config.yml.
+
+    Returns:
+        str: Path to quantization.json.
+    """
+    if coll_pelvis is None:
+        coll_pelvis = config.YML["coll_pelvis"]
+
+    return os.path.join(
+        "models", config.get_model_dir(coll_pelvis), "quantization.json"
+    )
+
+
+def is_precision_accepted(model_name: str, coll_pelvis: bool, precision: str) -> bool:
+    """Whether the quantized model was accepted by the gate of src.serving.quantize.
+
+    Args:
+        model_name (str): The name of the model, body_cnn or arms_cnn.
+        coll_pelvis (bool): Collimator angle of the model.
+        precision (str): One of PRECISIONS.
+
+    Returns:
+        bool: True for float32, or if the report accepts the precision and the model file exists.
+    """
+    if precision == "float32":
+        return True
+
+    try:
+        with open(
+            get_quantization_report_path(coll_pelvis), "r", encoding="utf-8"
+        ) as report_file:
+            report = json.load(report_file)
+    except (OSError, ValueError):
+        return False
+
+    return report.get(model_name, {}).get(precision, {}).get(
+        "accepted", False
+    ) and os.path.exists(get_model_path(model_name, coll_pelvis, precision))
+
+
+def get_served_model_path(
+    model_name: str, coll_pelvis: bool, yml: dict | None = None
+) -> str:
+    """Path of the model loaded by the server: the model_precision variant in config.yml if accepted
+    by the quantization gate, otherwise the float32 model.
+
+    Args:
+        model_name (str): The name of the model, body_cnn or arms_cnn.
+        coll_pelvis (bool): Collimator angle of the model.
+        yml (dict | None): The configuration. Defaults to the current config.yml.
+
+    Returns:
+        str: Path to the .onnx file.
+    """
+    yml = config.YML if yml is None else yml
+    precision = yml["model_precision"]
+    if not is_precision_accepted(model_name, coll_pelvis, precision):
+        precision = "float32"
+
+    return get_model_path(model_name, coll_pelvis, precision)
+
+
+def _register_shared_arena() -> None:
+    """Register once the CPU memory arena of the environment, used by the sessions with ort_shared_arena."""
+    global _SHARED_ARENA_REGISTERED  # pylint: disable=global-statement
+    with _SHARED_ARENA_LOCK:
+        if _SHARED_ARENA_REGISTERED:
+            return
+
+        memory_info = onnxruntime.OrtMemoryInfo(
+            "Cpu",
+            onnxruntime.OrtAllocatorType.ORT_ARENA_ALLOCATOR,
+            0,
+            onnxruntime.OrtMemType.DEFAULT,
+        )
+        # Default arena settings
+        onnxruntime.create_and_register_allocator(
+            memory_info, onnxruntime.OrtArenaCfg(0, -1, -1, -1)
+        )
+        _SHARED_ARENA_REGISTERED = True
+
+
+def get_session_options(
+    intra_op_threads: int | None = None, yml: dict | None = None
+) -> onnxruntime.SessionOptions:
+    """Session options from the ort_* keys of config.yml.
+
+    Args:
+        intra_op_threads (int | None): Number of threads used within each operator.
+        Defaults to ort_intra_op_threads in config.yml (0 is the ONNX runtime default).
+        yml (dict | None): The configuration. Defaults to the current config.yml.
+
+    Returns:
+        onnxruntime.SessionOptions: The options.
+    """
+    yml = config.YML if yml is None else yml
+    session_options = onnxruntime.SessionOptions()
+    session_options.intra_op_num_threads = (
+        yml["ort_intra_op_threads"] if intra_op_threads is None else intra_op_threads
+    )
+    session_options.inter_op_num_threads = yml["ort_inter_op_threads"]
+    session_options.execution_mode = EXECUTION_MODES[yml["ort_execution_mode"]]
+    session_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[
+        yml["ort_graph_optimization"]
+    ]
+    session_options.enable_cpu_mem_arena = yml["ort_enable_cpu_mem_arena"]
+    session_options.enable_mem_pattern = yml["ort_enable_mem_pattern"]
+    if yml["ort_enable_cpu_mem_arena"] and yml["ort_shared_arena"]:
+        _register_shared_arena()
+        session_options.add_session_config_entry("session.use_env_allocators", "1")
+
+    return session_options
+
+
+def get_cached_model_path(model_path: str, yml: dict | None = None) -> str:
+    """Path of the optimized model in the cache folder next to the model folder, e.g. models/5_355.cache.
+    The file name contains a hash of the model file, of the optimization level and of the ONNX runtime
+    version and platform, since optimized graphs may contain hardware specific operators.
+
+    Args:
+        model_path (str): Path to the .onnx model.
+        yml (dict | None): The configuration. Defaults to the current config.yml.
+
+    Returns:
+        str: Path to the optimized model, with the extension given by ort_model_cache in config.yml.
+    """
+    yml = config.YML if yml is None else yml
+    stat = os.stat(model_path)
+    digest = hashlib.sha1(
+        (
+            f"{stat.st_mtime_ns}:{stat.st_size}:{yml['ort_graph_optimization']}:"
+            f"{onnxruntime.__version__}:{platform.machine()}:{platform.system()}"
+        ).encode()
+    ).hexdigest()[:16]
+    model_dir, file_name = os.path.split(model_path)
+    model_name = os.path.splitext(file_name)[0]
+
+    return os.path.join(
+        f"{model_dir}.cache", f"{model_name}-{digest}.{yml['ort_model_cache']}"
+    )
+
+
+def _create_cached_session(
+    model_path: str, session_options: onnxruntime.SessionOptions, yml: dict
+) -> onnxruntime.InferenceSession:
+    """Load the optimized model from the cache, or optimize the model and save it to the cache."""
+    cached_model_path = get_cached_model_path(model_path, yml)
+    if os.path.exists(cached_model_path):
+        session_options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+        )
+        logging.info("Loading optimized model from %s.", cached_model_path)
+        return onnxruntime.InferenceSession(cached_model_path, session_options)
+
+    os.makedirs(os.path.dirname(cached_model_path), exist_ok=True)
+    # Written to a temporary file first, since several worker processes may start together
+    root, ext = os.path.splitext(cached_model_path)
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    session_options.optimized_model_filepath = tmp_path
+    try:
+        ort_session = onnxruntime.InferenceSession(model_path, session_options)
+        os.replace(tmp_path, cached_model_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logging.info("Saved optimized model to %s.", cached_model_path)
+
+    return ort_session
+
+
+def load_session(
+    model_name: str,
+    intra_op_threads: int | None = None,
+    yml: dict | None = None,
+    coll_pelvis: bool | None = None,
+) -> onnxruntime.InferenceSession | None:
+    """Load the ONNX runtime session of a model, using the optimized model cache if enabled.
+
+    Args:
+        model_name (str): The name of the model, body_cnn or arms_cnn.
+        intra_op_threads (int | None): Number of threads used within each operator.
+        Defaults to ort_intra_op_threads in config.yml.
+        yml (dict | None): The configuration. Defaults to the current config.yml.
+        coll_pelvis (bool | None): Collimator angle of the model. Defaults to None: coll_pelvis in yml.
+
+    Returns:
+        onnxruntime.InferenceSession | None: The session. None if the model could not be loaded.
+    """
+    yml = config.YML if yml is None else yml
+    if coll_pelvis is None:
+        coll_pelvis = yml["coll_pelvis"]
+    precision = yml["model_precision"]
+    if not is_precision_accepted(model_name, coll_pelvis, precision):
+        logging.warning(
+            "The %s variant of %s was not accepted by the quantization gate: loading the float32 model.",
+            precision,
+            get_model_key(model_name, coll_pelvis),
+        )
+        precision = "float32"
+    model_path = get_model_path(model_name, coll_pelvis, precision)
+    ort_session = None
+    if yml["ort_model_cache"]:
+        try:
+            ort_session = _create_cached_session(
+                model_path, get_session_options(intra_op_threads, yml), yml
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception(
+                "Could not use the optimized model cache for %s.", model_name
+            )
+
+    if ort_session is None:
+        try:
+            ort_session = onnxruntime.InferenceSession(
+                model_path, get_session_options(intra_op_threads, yml)
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception(
+                "Could not load model %s from %s.", model_name, model_path
+            )
+            return None
+
+    logging.info("Loaded model %s from %s.", model_name, model_path)
+
+    return ort_session
+
+
+def _get_file_digest(path: str) -> str | None:
+    """SHA-1 of the file content. None if the file cannot be read."""
+    digest = hashlib.sha1()
+    try:
+        with open(path, "rb") as model_file:
+            while chunk := model_file.read(1 << 20):
+                digest.update(chunk)
+    except OSError:
+        return None
+
+    return digest.hexdigest()
+
+
+def iter_sessions(
+    intra_op_threads: int | None = None, yml: dict | None = None
+) -> Iterator[tuple[str, onnxruntime.InferenceSession | None]]:
+    """Load the sessions of the model variants one by one (see get_model_variants).
+    Variants with identical model files share the same session.
+
+    Args:
+        intra_op_threads (int | None): Number of threads used within each operator.
+        Defaults to ort_intra_op_threads in config.yml.
+        yml (dict | None): The configuration. Defaults to the current config.yml.
+
+    Yields:
+        tuple[str, onnxruntime.InferenceSession | None]: The model key and the session, None if not loaded.
+    """
+    ort_sessions_by_digest: dict[str, onnxruntime.InferenceSession] = {}
+    for model_name, coll_pelvis in get_model_variants(yml):
+        model_key = get_model_key(model_name, coll_pelvis)
+        digest = _get_file_digest(get_served_model_path(model_name, coll_pelvis, yml))
+        if digest in ort_sessions_by_digest:
+            logging.info(
+                "Model %s shares the session of an identical model.", model_key
+            )
+            yield model_key, ort_sessions_by_digest[digest]
+            continue
+
+        ort_session = load_session(model_name, intra_op_threads, yml, coll_pelvis)
+        if ort_session is not None and digest is not None:
+            ort_sessions_by_digest[digest] = ort_session
+        yield model_key, ort_session
+
+
+def load_sessions(
+    intra_op_threads: int | None = None, yml: dict | None = None
+) -> dict[str, onnxruntime.InferenceSession | None]:
+    """Load the sessions of the model variants (see get_model_variants).
+
+    Args:
+        intra_op_threads (int | None): Number of threads used within each operator.
+        Defaults to ort_intra_op_threads in config.yml.
+        yml (dict | None): The configuration. Defaults to the current config.yml.
+
+    Returns:
+        dict[str, onnxruntime.InferenceSession | None]: The session of each model key, None if not loaded.
+    """
+    return dict(iter_sessions(intra_op_threads, yml))
@@ -0,0 +1,80 @@
+"""Module implementing the trace log of the prediction jobs.
+
+With trace_log set in config.yml, each finished job appends a JSON line to logs/trace.jsonl
+with the patient, the model, the status, the time in the queue, and the wall and CPU time
+of each stage of the pipeline (see src.serving.metrics.StageTiming). The file is rotated
+at trace_log_mb, keeping the previous 5 files.
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from src import config
+from src.serving.metrics import StageTiming
+
+TRACE_PATH: str = "logs/trace.jsonl"
+
+_LOGGER: logging.Logger | None = None
+_LOGGER_LOCK = threading.Lock()
+
+
+def _get_logger() -> logging.Logger:
+    """Logger writing the messages as they are to the trace file, created at the first call."""
+    global _LOGGER  # pylint: disable=global-statement
+    with _LOGGER_LOCK:
+        if _LOGGER is None:
+            handler = RotatingFileHandler(
+                TRACE_PATH,
+                maxBytes=int(config.YML["trace_log_mb"] * 1024**2),
+                backupCount=5,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _LOGGER = logging.getLogger("trace")
+            _LOGGER.addHandler(handler)
+            _LOGGER.setLevel(logging.INFO)
+            _LOGGER.propagate = False  # not in logs/app.log
+
+    return _LOGGER
+
+
+def timings_to_json(timings: list[StageTiming]) -> list[dict]:
+    """JSON content of the timings of the stages, in the order they finished.
+
+    Args:
+        timings (list[StageTiming]): The timings.
+
+    Returns:
+        list[dict]: The "Stage", its "StartSeconds" since the start of the first stage,
+        "WallSeconds", "CpuSeconds", and whether it "Failed", for each stage.
+    """
+    start = min((timing.start for timing in timings), default=0.0)
+
+    return [
+        {
+            "Stage": timing.stage,
+            "StartSeconds": round(timing.start - start, 6),
+            "WallSeconds": round(timing.wall_seconds, 6),
+            "CpuSeconds": round(timing.cpu_seconds, 6),
+            "Failed": timing.failed,
+        }
+        for timing in timings
+    ]
+
+
+def write_trace(record: dict) -> None:
+    """Append a record to the trace log, with its UTC "Time", unless trace_log is false in config.yml.
+
+    Args:
+        record (dict): JSON content of the record.
+    """
+    if not config.YML["trace_log"]:
+        return
+
+    record = {"Time": datetime.now(timezone.utc).isoformat(), **record}
+    try:
+        _get_logger().info(json.dumps(record))
+    except (OSError, TypeError, ValueError):
+        logging.exception("Could not write the trace log.")
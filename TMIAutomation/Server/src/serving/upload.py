@@ -0,0 +1,107 @@
+"""Module implementing the streamed upload of a patient to /predict_upload.
+
+The multipart/form-data body is parsed while it is received, without writing temporary files:
+the "request" field with the JSON fields of the request, then one file part for each DICOM file
+of the CT series and RTSTRUCT. Each file is handed to a SeriesReceiver (see src.dicom.upload)
+as soon as its part is complete. Sending the "request" field and the RTSTRUCT first lets the
+slices be projected during the upload.
+"""
+
+import json
+import time
+from typing import BinaryIO, Callable
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+from src.dicom.upload import SeriesReceiver, UploadedPatient
+from src.serving.metrics import StageTiming, observe_stage
+
+CHUNK_BYTES: int = 256 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when the upload exceeds max_upload_mb."""
+
+
+def receive_upload(
+    stream: BinaryIO,
+    boundary: bytes,
+    max_bytes: int,
+    on_request: Callable[[dict], list[str]],
+) -> tuple[dict, UploadedPatient]:
+    """Parse a streamed multipart/form-data upload, decoding the DICOM files as they arrive.
+
+    Args:
+        stream (BinaryIO): The body of the HTTP request.
+        boundary (bytes): The boundary of the multipart body.
+        max_bytes (int): Maximum size of the body.
+        on_request (Callable[[dict], list[str]]): Called with the JSON fields of the "request" field,
+        returning the names of the PTV ROIs. Raises ValueError if the fields are invalid.
+
+    Raises:
+        UploadTooLargeError: If the body exceeds max_bytes.
+        ValueError: If the body, the "request" field, or the DICOM files are invalid.
+
+    Returns:
+        tuple[dict, UploadedPatient]: The JSON fields of the request, and the uploaded patient.
+    """
+    start_time = time.time()
+    start, start_cpu = time.perf_counter(), time.thread_time()
+    decoder = MultipartDecoder(boundary)
+    receiver = SeriesReceiver()
+    request_fields: dict | None = None
+    part: Field | File | None = None
+    chunks: list[bytes] = []
+    received = 0
+    complete = False
+
+    while not complete:
+        chunk = stream.read(CHUNK_BYTES)
+        received += len(chunk)
+        if received > max_bytes:
+            raise UploadTooLargeError(f"The upload exceeds {max_bytes} bytes.")
+        decoder.receive_data(chunk or None)
+
+        event = decoder.next_event()
+        while not isinstance(event, NeedData):
+            if isinstance(event, Epilogue):
+                complete = True
+                break
+            if isinstance(event, (Field, File)):
+                part, chunks = event, []
+            elif isinstance(event, Data):
+                chunks.append(event.data)
+                if not event.more_data:
+                    data = b"".join(chunks)
+                    chunks = []
+                    if isinstance(part, File):
+                        receiver.add_file(part.filename or part.name, data)
+                    elif part.name == "request":
+                        request_fields = json.loads(data)
+                        receiver.set_ptv_roi_names(on_request(request_fields))
+            event = decoder.next_event()
+
+        if not chunk and not complete:
+            raise ValueError("The multipart body ended before its closing boundary.")
+
+    if request_fields is None:
+        raise ValueError('Missing "request" field in the upload.')
+    upload = receiver.finish()
+
+    wall_seconds = time.perf_counter() - start
+    upload.timings.append(
+        StageTiming("upload", start_time, wall_seconds, time.thread_time() - start_cpu)
+    )
+    observe_stage(
+        "upload",
+        request_fields.get("model_name", ""),
+        request_fields.get("coll_pelvis"),
+        wall_seconds,
+    )
+
+    return request_fields, upload
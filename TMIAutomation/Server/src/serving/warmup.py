@@ -0,0 +1,246 @@
+"""Module implementing the warm-up of the server at startup and its readiness status.
+
+The first request after start is slower than the next ones: ONNX runtime allocates its memory arena
+and kernel caches at the first run, and the image transforms, local optimization and visualization modules
+are imported by the pipeline at the first request, to bind the port quickly at start.
+The warm-up runs a synthetic input through each loaded model, then postprocesses and locally optimizes
+the output of a synthetic patient for each collimator angle, so that the client can wait for /ready
+before sending real work.
+"""
+
+import time
+import logging
+import importlib
+import threading
+from dataclasses import dataclass, field
+import numpy as np
+from onnxruntime import InferenceSession
+from src import config
+from src.pipeline import Image, Pipeline, RequestInfo
+from src.serving.sessions import get_model_key, get_model_variants, iter_sessions
+
+# Numpy type of the synthetic input for each ONNX tensor type
+INPUT_DTYPES: dict[str, type] = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+}
+
+
+@dataclass
+class ModelStatus:
+    """Load and warm-up status of a model."""
+
+    loaded: bool = False
+    load_seconds: float | None = None
+    warmed_up: bool = False
+    warmup_seconds: float | None = None
+    error: str | None = None
+
+
+@dataclass
+class Readiness:
+    """Readiness of the server: status of the models and of the pipeline modules."""
+
+    models: dict[str, ModelStatus] = field(default_factory=dict)
+    modules_warmed_up: bool = False
+    modules_seconds: float | None = None
+    modules_error: str | None = None
+    finished: bool = False  # warm-up finished, successfully or not
+
+    @property
+    def ready(self) -> bool:
+        """Whether the warm-up finished and at least one model is loaded."""
+        return self.finished and any(status.loaded for status in self.models.values())
+
+
+READINESS = Readiness()
+
+
+def load_models(
+    yml: dict | None = None, readiness: Readiness = READINESS
+) -> dict[str, InferenceSession | None]:
+    """Load the sessions of the model variants, recording the load status and time.
+
+    Args:
+        yml (dict | None): The configuration. Defaults to the current config.yml.
+        readiness (Readiness): Where the status is recorded. Defaults to READINESS.
+
+    Returns:
+        dict[str, InferenceSession | None]: The session of each model key, None if not loaded.
+    """
+    ort_sessions = {}
+    start = time.perf_counter()
+    for model_key, ort_session in iter_sessions(yml=yml):
+        ort_sessions[model_key] = ort_session
+        readiness.models[model_key] = ModelStatus(
+            loaded=ort_session is not None,
+            load_seconds=time.perf_counter() - start,
+            error=None if ort_session else "Could not load the model.",
+        )
+        start = time.perf_counter()
+
+    return ort_sessions
+
+
+def warm_up_session(ort_session: InferenceSession) -> None:
+    """Run the model once on a zero input with batch size 1 (or the fixed dimensions of the model).
+
+    Args:
+        ort_session (InferenceSession): The ONNX runtime session.
+    """
+    ort_inputs = {}
+    for model_input in ort_session.get_inputs():
+        shape = [
+            dim if isinstance(dim, int) and dim > 0 else 1 for dim in model_input.shape
+        ]
+        ort_inputs[model_input.name] = np.zeros(
+            shape, dtype=INPUT_DTYPES.get(model_input.type, np.float32)
+        )
+    ort_session.run(None, ort_inputs)
+
+
+def get_synthetic_pipeline(model_name: str, coll_pelvis: bool) -> Pipeline:
+    """Pipeline of a synthetic patient: a PTV from head to feet, 300 slices 5 mm apart.
+
+    Args:
+        model_name (str): The name of the model, body_cnn or arms_cnn.
+        coll_pelvis (bool): Collimator angle of the model.
+
+    Returns:
+        Pipeline: The preprocessed pipeline, ready for postprocess.
+    """
+    pixel_spacing, slice_thickness, num_slices = 1.2, 5.0, 300
+    image = Image(
+        pixel_spacing,
+        slice_thickness,
+        slice_thickness / pixel_spacing,
+        num_slices,
+        width_resize=512,
+    )
+    # Coronal projections, axis0=x, axis1=z
+    ptv_mask = np.zeros((image.width_resize, num_slices))
+    ptv_mask[106:406, 10:290] = 1
+    ptv_img = ptv_mask * np.linspace(0.2, 0.8, num_slices)
+    oars = np.zeros_like(ptv_mask)
+    oars[206:306, 150:200] = 1
+    request_info = RequestInfo(model_name, "warmup", "", [], coll_pelvis)
+
+    return Pipeline.from_projections(
+        request_info, image, np.stack((ptv_img, 0.3 * ptv_mask, oars), axis=-1)
+    )
+
+
+def get_synthetic_output(model_name: str, image: Image) -> np.ndarray:
+    """Output of a 90 model for the synthetic patient: isocenters evenly spaced from head to feet,
+    200 mm jaw apertures. The output of a 5_355 model has the same layout once reshaped.
+
+    Args:
+        model_name (str): The name of the model, body_cnn or arms_cnn.
+        image (Image): The image of the synthetic patient.
+
+    Returns:
+        np.ndarray: The output with shape (1, num_outputs).
+    """
+    jaw_x = 200 / (image.pixel_spacing * image.width_resize)
+    jaw_y = 200 / (image.slice_thickness * image.num_slices)
+    if model_name == config.MODEL_NAME_BODY:
+        y_hat = np.zeros(config.MODEL_OUTPUT_BODY_90)
+        y_hat[0:4] = [0.85, 0.65, 0.4, 0.15]  # isocenters
+        y_hat[4:18] = [-jaw_x, jaw_x] * 7
+        y_hat[18:21] = -jaw_y
+        y_hat[21:25] = [-jaw_y, jaw_y] * 2  # head
+    else:
+        y_hat = np.zeros(config.MODEL_OUTPUT_ARMS_90)
+        y_hat[0:2] = [0.2, 0.8]  # arms
+        y_hat[2:7] = [0.9, 0.7, 0.5, 0.3, 0.1]  # isocenters
+        y_hat[7:23] = [-jaw_x, jaw_x] * 8
+        y_hat[23:26] = -jaw_y
+        y_hat[26:30] = [-jaw_y, jaw_y] * 2  # head
+
+    return y_hat[np.newaxis]
+
+
+def warm_up_modules(ort_sessions: dict[str, InferenceSession | None]) -> None:
+    """Postprocess and locally optimize the field geometry of a synthetic patient once
+    for the collimator angle of each loaded model, importing the modules used by the pipeline
+    after the inference.
+
+    Args:
+        ort_sessions (dict[str, InferenceSession | None]): The session of each model key, None if not loaded.
+    """
+    warmed_up_angles = set()
+    for model_name, coll_pelvis in get_model_variants():
+        if (
+            ort_sessions.get(get_model_key(model_name, coll_pelvis)) is None
+            or coll_pelvis in warmed_up_angles
+        ):
+            continue
+
+        pipeline = get_synthetic_pipeline(model_name, coll_pelvis)
+        pipeline.postprocess(get_synthetic_output(model_name, pipeline.image))
+        pipeline.optimize_locally()
+        warmed_up_angles.add(coll_pelvis)
+    if not config.BUNDLED:
+        importlib.import_module("src.visualize")
+
+
+def warm_up(
+    ort_sessions: dict[str, InferenceSession | None],
+    readiness: Readiness = READINESS,
+) -> None:
+    """Warm up the loaded models and the pipeline modules, recording the status and time.
+    Failures are logged and reported, without stopping the server.
+
+    Args:
+        ort_sessions (dict[str, InferenceSession | None]): The session of each model key, None if not loaded.
+        readiness (Readiness): Where the status is recorded. Defaults to READINESS.
+    """
+    for model_key, ort_session in ort_sessions.items():
+        status = readiness.models.setdefault(
+            model_key, ModelStatus(loaded=ort_session is not None)
+        )
+        if ort_session is None:
+            continue
+
+        start = time.perf_counter()
+        try:
+            warm_up_session(ort_session)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            logging.exception("Could not warm up model %s.", model_key)
+            status.error = str(exc)
+            continue
+        status.warmup_seconds = time.perf_counter() - start
+        status.warmed_up = True
+        logging.info("Warmed up model %s in %.2f s.", model_key, status.warmup_seconds)
+
+    start = time.perf_counter()
+    try:
+        warm_up_modules(ort_sessions)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logging.exception("Could not warm up the pipeline modules.")
+        readiness.modules_error = str(exc)
+    else:
+        readiness.modules_seconds = time.perf_counter() - start
+        readiness.modules_warmed_up = True
+        logging.info(
+            "Warmed up the pipeline modules in %.2f s.", readiness.modules_seconds
+        )
+
+    readiness.finished = True
+
+
+def start_warm_up(ort_sessions: dict[str, InferenceSession | None]) -> None:
+    """Warm up in a background thread, so that the server answers /ready in the meantime.
+    If warmup is false in config.yml, the server is ready as soon as the models are loaded.
+
+    Args:
+        ort_sessions (dict[str, InferenceSession | None]): The session of each model key, None if not loaded.
+    """
+    if not config.YML["warmup"]:
+        READINESS.finished = True
+        return
+
+    threading.Thread(
+        target=warm_up, args=(ort_sessions,), name="warmup", daemon=True
+    ).start()
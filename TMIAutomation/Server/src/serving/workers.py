@@ -0,0 +1,272 @@
+"""Module implementing the execution of the pipelines, in the server process or in a pool of worker processes.
+
+With worker_processes > 0 in config.yml, the pipelines run in worker processes started with the server,
+so that concurrent requests are not serialized by the GIL. Each worker loads the models once
+at startup and limits its numpy/BLAS and ONNX runtime threads to worker_threads, so that
+the workers together do not oversubscribe the cores.
+"""
+
+import logging
+import threading
+import multiprocessing
+from multiprocessing.queues import Queue
+from multiprocessing.synchronize import Semaphore
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+from onnxruntime import InferenceSession
+from threadpoolctl import threadpool_limits
+from src import config
+from src.batch import PipelineOutput, run_batched
+from src.dicom.upload import UploadedPatient
+from src.pipeline import Pipeline, RequestInfo
+from src.serving.metrics import (
+    StageTiming,
+    buffer_observations,
+    record_observations,
+    take_observations,
+)
+from src.serving.sessions import get_model_key, load_sessions
+from src.serving.warmup import warm_up
+
+
+class InvalidRequestError(Exception):
+    """Raised when the DICOM folder or the ROIs of a request are invalid."""
+
+
+def run_pipeline(
+    request_info: RequestInfo,
+    ort_session: InferenceSession,
+    start_stage: Callable[[str], None],
+    timings: list[StageTiming] | None = None,
+    upload: UploadedPatient | None = None,
+) -> PipelineOutput:
+    """Run the pipeline of a request stage by stage: load, preprocess, inference and postprocess.
+
+    Args:
+        request_info (RequestInfo): The request.
+        ort_session (InferenceSession): The ONNX runtime session of the requested model.
+        start_stage (Callable[[str], None]): Called with the name of each stage when it starts.
+        timings (list[StageTiming] | None): Where the timing of each stage of the pipeline is appended,
+        also if the pipeline fails. Defaults to None: not collected.
+        upload (UploadedPatient | None): The uploaded series and RTSTRUCT.
+        Defaults to None: read from the DICOM folder of the request.
+
+    Raises:
+        InvalidRequestError: If the DICOM folder or the ROIs of the request are invalid.
+
+    Returns:
+        PipelineOutput: Isocenters, jaw X apertures, and jaw Y apertures in patient coordinate system.
+    """
+    start_stage("load")
+    try:
+        pipeline = Pipeline(request_info, timings, upload)
+    except (FileNotFoundError, ValueError) as exc:
+        raise InvalidRequestError(str(exc)) from exc
+
+    start_stage("preprocess")
+    pipeline.preprocess()
+
+    start_stage("inference")
+    with pipeline.time_stage("inference"):
+        model_output = run_batched(ort_session, pipeline.get_model_input())
+
+    start_stage("postprocess")
+    return pipeline.predict_from_output(model_output)
+
+
+# State of a worker process
+_WORKER_SESSIONS: dict[str, InferenceSession | None] = {}
+_WORKER_PROGRESS: Queue | None = None
+
+
+def _init_worker(threads: int, progress: Queue, ready: Semaphore) -> None:
+    """Initializer of the worker processes: limit the threads, load and warm up the models."""
+    global _WORKER_PROGRESS  # pylint: disable=global-statement
+    threadpool_limits(limits=threads)
+    _WORKER_SESSIONS.update(load_sessions(intra_op_threads=threads))
+    if config.YML["warmup"]:
+        warm_up(_WORKER_SESSIONS)
+    _WORKER_PROGRESS = progress
+    buffer_observations()
+    ready.release()
+
+
+def _ping(_: int) -> None:
+    pass
+
+
+def _run_in_worker(job_id: str, request_info: RequestInfo) -> tuple[
+    PipelineOutput | Exception,
+    list[tuple[str, str, str, float]],
+    list[StageTiming],
+]:
+    """Run the pipeline, returning its output, or its exception if it failed,
+    with the observations of the metrics and the timings of the stages."""
+    model_key = get_model_key(request_info.model_name, request_info.coll_pelvis)
+    ort_session = _WORKER_SESSIONS.get(model_key)
+    if ort_session is None:
+        raise RuntimeError(f"Model {model_key} is not loaded.")
+
+    timings = []
+    try:
+        pipeline_output = run_pipeline(
+            request_info,
+            ort_session,
+            lambda stage: _WORKER_PROGRESS.put((job_id, stage)),
+            timings,
+        )
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        # Returned, to also report the timings of the failed pipelines
+        if not isinstance(exc, InvalidRequestError):
+            logging.exception("Job %s failed in the worker process.", job_id)
+        return exc, take_observations(), timings
+
+    return pipeline_output, take_observations(), timings
+
+
+class WorkerPool:
+    """Pool of worker processes running the pipelines.
+    The stages started by the workers are sent back to the server through a queue.
+    A job holds the pool from its submission to its end, so that a pool replaced by the hot reload
+    is shut down only once its jobs, queued or running, are finished.
+    """
+
+    def __init__(self, processes: int, threads: int) -> None:
+        self.processes = processes
+        # Workers are spawned as on Windows, also where fork is available,
+        # since forking the multithreaded server process is unsafe
+        context = multiprocessing.get_context("spawn")
+        self._progress = context.Queue()
+        self._ready = context.Semaphore(0)
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(threads, self._progress, self._ready),
+        )
+        self._start_stage_callbacks: dict[str, Callable[[str], None]] = {}
+        self._lock = threading.Lock()
+        self._holds = 0  # jobs queued or running
+        self._retired = False
+        self._shut_down = False
+        threading.Thread(
+            target=self._dispatch_progress, name="worker-progress", daemon=True
+        ).start()
+
+    def _dispatch_progress(self) -> None:
+        while (progress := self._progress.get()) is not None:
+            job_id, stage = progress
+            with self._lock:
+                start_stage = self._start_stage_callbacks.get(job_id)
+            if start_stage is not None:
+                start_stage(stage)
+
+    def start(self) -> None:
+        """Start all the worker processes and wait until they loaded and warmed up the models."""
+        # The pool starts a new process for each task submitted while the others are busy
+        for _ in self._executor.map(_ping, range(self.processes)):
+            pass
+        for _ in range(self.processes):
+            self._ready.acquire()  # pylint: disable=consider-using-with
+        logging.info("Started %d worker processes.", self.processes)
+
+    def run(
+        self,
+        job_id: str,
+        request_info: RequestInfo,
+        start_stage: Callable[[str], None],
+        timings: list[StageTiming] | None = None,
+    ) -> PipelineOutput:
+        """Run the pipeline of a request in a worker process, waiting for the result.
+
+        Args:
+            job_id (str): Id of the job, used to report the progress.
+            request_info (RequestInfo): The request.
+            start_stage (Callable[[str], None]): Called with the name of each stage when it starts.
+            timings (list[StageTiming] | None): Where the timing of each stage of the pipeline is appended,
+            also if the pipeline fails. Defaults to None: not collected.
+
+        Raises:
+            InvalidRequestError: If the DICOM folder or the ROIs of the request are invalid.
+
+        Returns:
+            PipelineOutput: Isocenters, jaw X apertures, and jaw Y apertures in patient coordinate system.
+        """
+        with self._lock:
+            self._start_stage_callbacks[job_id] = start_stage
+        try:
+            pipeline_output, observations, worker_timings = self._executor.submit(
+                _run_in_worker, job_id, request_info
+            ).result()
+        finally:
+            with self._lock:
+                del self._start_stage_callbacks[job_id]
+        record_observations(observations)
+        if timings is not None:
+            timings.extend(worker_timings)
+        if isinstance(pipeline_output, Exception):
+            raise pipeline_output
+
+        return pipeline_output
+
+    def hold(self) -> bool:
+        """Hold the pool for a job until release is called, delaying the shutdown of a retired pool.
+
+        Returns:
+            bool: Whether the pool is held. False if the pool is retired and already shutting down.
+        """
+        with self._lock:
+            if self._shut_down:
+                return False
+            self._holds += 1
+
+        return True
+
+    def release(self) -> None:
+        """Release a hold of a job, shutting down the retired pool after its last job."""
+        with self._lock:
+            self._holds -= 1
+            shut_down = self._retired and self._holds == 0 and not self._shut_down
+            self._shut_down |= shut_down
+        if shut_down:
+            self._shutdown_in_background()
+
+    def retire(self) -> None:
+        """Shut down the pool once it is not held anymore, e.g. when the models are replaced."""
+        with self._lock:
+            self._retired = True
+            shut_down = self._holds == 0 and not self._shut_down
+            self._shut_down |= shut_down
+        if shut_down:
+            self._shutdown_in_background()
+
+    def _shutdown_in_background(self) -> None:
+        threading.Thread(
+            target=self.shutdown, name="worker-shutdown", daemon=True
+        ).start()
+
+    def shutdown(self) -> None:
+        """Wait for the running pipelines, then stop the worker processes."""
+        self._executor.shutdown(wait=True)
+        self._progress.put(None)
+        logging.info("Stopped %d worker processes.", self.processes)
+
+
+_WORKER_POOL: WorkerPool | None = None
+_WORKER_POOL_LOCK = threading.Lock()
+
+
+def get_worker_pool() -> WorkerPool | None:
+    """Get the pool of worker_processes processes set in config.yml, creating it at the first call.
+
+    Returns:
+        WorkerPool | None: The pool. None if worker_processes is 0: the pipelines run in the server process.
+    """
+    global _WORKER_POOL  # pylint: disable=global-statement
+    with _WORKER_POOL_LOCK:
+        if _WORKER_POOL is None and config.YML["worker_processes"] > 0:
+            _WORKER_POOL = WorkerPool(
+                config.YML["worker_processes"], config.YML["worker_threads"]
+            )
+
+    return _WORKER_POOL
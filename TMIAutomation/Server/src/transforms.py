@@ -0,0 +1,120 @@
+"""Module implementing the image transforms of the pipeline as precomputed index maps.
+
+Nearest-neighbor resizes and rotations by multiples of 90 degrees only move pixels: the flat index
+of the source pixel of each output pixel is computed once for each input shape and sequence of steps,
+and the transform is a single gather. The images and keypoints are identical to those of the
+imgaug Sequential of Resize(interpolation="nearest") and Rot90(keep_size=False) that they replace.
+"""
+
+from functools import lru_cache
+import numpy as np
+
+# Step of a transform: ("resize", height, width) with nearest-neighbor interpolation,
+# or ("rot90", k) for k clockwise rotations by 90 degrees, as in imgaug
+Step = tuple[str, int] | tuple[str, int, int]
+
+
+def _get_nearest_indices(src_size: int, dst_size: int) -> np.ndarray:
+    """Source index of each destination index of a nearest-neighbor resize along an axis,
+    computed as in cv2.resize with INTER_NEAREST (used by imgaug)."""
+    inverse_scale = 1.0 / (dst_size / src_size)
+
+    return np.minimum(
+        np.floor(np.arange(dst_size) * inverse_scale).astype(np.intp), src_size - 1
+    )
+
+
+@lru_cache(maxsize=64)
+def get_index_map(input_shape: tuple[int, int], steps: tuple[Step, ...]) -> np.ndarray:
+    """Index map of a sequence of steps. The map is cached and read-only.
+
+    Args:
+        input_shape (tuple[int, int]): Shape (H, W) of the input image.
+        steps (tuple[Step, ...]): The steps, applied in order.
+
+    Raises:
+        ValueError: If a step is unknown.
+
+    Returns:
+        np.ndarray: Flat index in the input image of each pixel of the output image.
+    """
+    index = np.arange(input_shape[0] * input_shape[1]).reshape(input_shape)
+    for step in steps:
+        if step[0] == "resize":
+            _, height, width = step
+            rows = _get_nearest_indices(index.shape[0], height)
+            columns = _get_nearest_indices(index.shape[1], width)
+            index = index[rows[:, np.newaxis], columns[np.newaxis, :]]
+        elif step[0] == "rot90":
+            index = np.rot90(index, -step[1])  # np.rot90 rotates counterclockwise
+        else:
+            raise ValueError(f"Unknown transform step {step}.")
+
+    index = np.ascontiguousarray(index)
+    index.flags.writeable = False
+
+    return index
+
+
+def transform_image(
+    image: np.ndarray, steps: tuple[Step, ...], out: np.ndarray | None = None
+) -> np.ndarray:
+    """Apply the steps to the image with a single gather.
+
+    Args:
+        image (np.ndarray): Image with shape (H, W) or (H, W, C).
+        steps (tuple[Step, ...]): The steps, applied in order.
+        out (np.ndarray | None): Contiguous array with the type of the image where the output is written.
+        Defaults to None: a new array.
+
+    Returns:
+        np.ndarray: The transformed image.
+    """
+    index = get_index_map(image.shape[:2], steps)
+    channels = image.shape[2:]
+    if out is None:
+        out = np.empty((*index.shape, *channels), dtype=image.dtype)
+
+    np.take(
+        image.reshape(-1, *channels),
+        index.reshape(-1),
+        axis=0,
+        out=out.reshape(-1, *channels),
+    )
+
+    return out
+
+
+def transform_keypoints(
+    xy: np.ndarray, input_shape: tuple[int, int], steps: tuple[Step, ...]
+) -> np.ndarray:
+    """Apply the steps to subpixel keypoints, with the arithmetic of imgaug.
+
+    Args:
+        xy (np.ndarray): The (x, y) coordinates of the keypoints with shape (N, 2).
+        input_shape (tuple[int, int]): Shape (H, W) of the input image.
+        steps (tuple[Step, ...]): The steps, applied in order.
+
+    Raises:
+        ValueError: If a step is unknown.
+
+    Returns:
+        np.ndarray: The transformed (x, y) coordinates with type float32, as KeypointsOnImage.to_xy_array.
+    """
+    x, y = np.asarray(xy[:, 0]), np.asarray(xy[:, 1])
+    height, width = input_shape
+    for step in steps:
+        if step[0] == "resize":
+            if (step[1], step[2]) != (height, width):
+                x = (x.astype(np.float32) / width) * step[2]
+                y = (y.astype(np.float32) / height) * step[1]
+                height, width = step[1], step[2]
+        elif step[0] == "rot90":
+            for _ in range(step[1] % 4):
+                # imgaug rotates each keypoint as a scalar, promoted to float64
+                x, y = height - y.astype(np.float64), x
+                height, width = width, height
+        else:
+            raise ValueError(f"Unknown transform step {step}.")
+
+    return np.stack((x, y), axis=-1).astype(np.float32)
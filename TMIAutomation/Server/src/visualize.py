@@ -1,6 +1,9 @@
 """Module implementing debug visualizations."""
 
 import os
+import threading
+import functools
+from typing import Callable
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
@@ -11,6 +14,18 @@ from src import config
 
 matplotlib.use("agg")
 
+# pyplot draws on a global figure: the plots of concurrent requests are drawn one at a time
+_PYPLOT_LOCK = threading.Lock()
+
+
+def _with_pyplot_lock(func: Callable) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _PYPLOT_LOCK:
+            return func(*args, **kwargs)
+
+    return wrapper
+
 
 def save_input_img(patient_id: str, image: Image) -> None:
     """Save the input image for the model.
@@ -19,8 +34,7 @@ def save_input_img(patient_id: str, image: Image) -> None:
         patient_id (str): The patient ID used to name the saved image.
         image (Image): The original image with shape (H, W, C).
     """
-    if not os.path.exists("logs/input_img/"):
-        os.makedirs("logs/input_img/")
+    os.makedirs("logs/input_img/", exist_ok=True)
 
     plt.imsave(
         f"logs/input_img/input_img_{patient_id}.png",
@@ -28,6 +42,7 @@ def save_input_img(patient_id: str, image: Image) -> None:
     )
 
 
+@_with_pyplot_lock
 def save_local_opt(
     patient_id: str, image: Image, local_optimization: LocalOptimization
 ) -> None:
@@ -73,15 +88,19 @@ def save_local_opt(
             linewidths=0.5,
         )
 
-    if not os.path.exists("logs/local_opt/"):
-        os.makedirs("logs/local_opt/")
+    os.makedirs("logs/local_opt/", exist_ok=True)
 
     plt.savefig(f"logs/local_opt/local_opt_{patient_id}.png")
     plt.close()
 
 
+@_with_pyplot_lock
 def save_field_geometry(
-    patient_id: str, model_name: str, image: Image, field_geometry: FieldGeometry
+    patient_id: str,
+    model_name: str,
+    image: Image,
+    field_geometry: FieldGeometry,
+    coll_pelvis: bool | None = None,
 ) -> None:
     """Save the image and field geometry.
 
@@ -90,7 +109,11 @@ def save_field_geometry(
         model_name (str): The model name.
         image (Image): The original image with shape (H, W, C).
         field_geometry (FieldGeometry): The field geometry in pixel space.
+        coll_pelvis (bool | None): Collimator angle of the model. Defaults to None: coll_pelvis in config.yml.
     """
+    if coll_pelvis is None:
+        coll_pelvis = config.YML["coll_pelvis"]
+
     plt.imshow(
         image.pixels[..., 0],
         cmap="gray",
@@ -110,7 +133,7 @@ def save_field_geometry(
     if model_name == config.MODEL_NAME_ARMS:
         linestyles[-2] = "-"  # same linestyle for isocenters on the arms
         angles[-2:] = 0
-    if config.YML["coll_pelvis"]:
+    if coll_pelvis:
         angles[:2] = 0
 
     for i, (iso, jaw_X, jaw_Y, angle) in enumerate(
@@ -163,8 +186,7 @@ def save_field_geometry(
             )
         )
 
-    if not os.path.exists("logs/field_geometry/"):
-        os.makedirs("logs/field_geometry/")
+    os.makedirs("logs/field_geometry/", exist_ok=True)
 
     plt.savefig(f"logs/field_geometry/field_geometry_{patient_id}.png")
     plt.close()
@@ -0,0 +1,183 @@
+"""Fixtures of the tests: synthetic CT series and RTSTRUCTs written to temporary folders.
+
+src.config reads config.yml from the working directory, hence the tests run from the server folder:
+    python -m pytest
+"""
+
+import os
+from typing import Callable
+import numpy as np
+import pytest
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+from rt_utils import RTStructBuilder
+from src import config
+from src.serving.sessions import load_sessions
+
+ORIGIN_MM: float = -100.0
+PIXEL_SPACING_MM: float = 3.0
+SLICE_THICKNESS_MM: float = 5.0
+
+
+@pytest.fixture(autouse=True)
+def isolated_config(tmp_path, monkeypatch) -> None:
+    """Keep the files written by the server inside the temporary folder of the test."""
+    monkeypatch.setitem(
+        config.YML, "dicom_index_path", str(tmp_path / "dicom_index.sqlite")
+    )
+    monkeypatch.setitem(config.YML, "volume_store_dir", str(tmp_path / ".volumes"))
+    monkeypatch.setitem(config.YML, "trace_log", False)
+    monkeypatch.setitem(config.YML, "watch_dir", "")
+
+
+def write_ct_series(
+    folder: str, num_slices: int = 40, rows: int = 64, seed: int = 0
+) -> None:
+    """Write a CT series of random int16 slices, 5 mm apart, in reverse z order on disk."""
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    study_uid, series_uid, frame_uid = generate_uid(), generate_uid(), generate_uid()
+    for i in range(num_slices):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = CTImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = FileDataset(None, {}, file_meta=meta, preamble=b"\0" * 128)
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.Modality = "CT"
+        ds.PatientID = os.path.basename(folder)
+        ds.PatientName = "Test"
+        ds.PatientSex = "O"
+        ds.PatientBirthDate = ""
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.FrameOfReferenceUID = frame_uid
+        ds.StudyDate = ds.SeriesDate = "20240101"
+        ds.StudyTime = ds.SeriesTime = "000000"
+        ds.StudyID = "1"
+        ds.SeriesNumber = 1
+        ds.SeriesDescription = "CT"
+        ds.ReferringPhysicianName = ""
+        ds.AccessionNumber = ""
+        ds.ImagePositionPatient = [ORIGIN_MM, ORIGIN_MM, 500.0 - SLICE_THICKNESS_MM * i]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [PIXEL_SPACING_MM, PIXEL_SPACING_MM]
+        ds.SliceThickness = SLICE_THICKNESS_MM
+        ds.Rows = ds.Columns = rows
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.RescaleIntercept = 0
+        ds.RescaleSlope = 1
+        ds.InstanceNumber = i + 1
+        ds.PixelData = (
+            rng.integers(-1000, 1500, size=(rows, rows)).astype(np.int16).tobytes()
+        )
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.save_as(os.path.join(folder, f"CT.{i:04d}.dcm"))
+
+
+def write_patient(folder: str, seed: int = 0) -> None:
+    """Write a CT series of 40 slices of 64x64 pixels and a RTSTRUCT with the PTV (with a hole),
+    the junction, the body and two OARs."""
+    rows, num_slices = 64, 40
+    write_ct_series(folder, num_slices, rows, seed)
+    rtstruct = RTStructBuilder.create_new(folder)
+    boxes = {
+        "PTV_Total": np.s_[12:50, 14:50, 3:36],
+        "PTV_Junction": np.s_[20:30, 20:40, 36:38],
+        "Lens_L": np.s_[5:8, 40:44, 30:33],
+        "Intestino": np.s_[25:45, 15:35, 8:20],
+        "Body": np.s_[8:56, 10:54, 2:38],
+    }
+    for name, box in boxes.items():
+        mask = np.zeros((rows, rows, num_slices), dtype=bool)
+        mask[box] = True
+        if name == "PTV_Total":
+            mask[30:34, 30:34, 10:12] = False
+        rtstruct.add_roi(mask=mask, name=name)
+    rtstruct.save(os.path.join(folder, "RTSTRUCT.dcm"))
+
+
+@pytest.fixture
+def ct_folder(tmp_path) -> str:
+    """Folder with a CT series of 8 slices of 64x64 pixels, without RTSTRUCT."""
+    folder = str(tmp_path / "CT")
+    write_ct_series(folder, num_slices=8)
+    return folder
+
+
+@pytest.fixture
+def make_patient(tmp_path) -> Callable[..., str]:
+    """Factory writing a synthetic patient (see write_patient) to a new folder, returning its path."""
+
+    def _make_patient(patient_id: str = "P1", seed: int = 0) -> str:
+        folder = str(tmp_path / "storage" / patient_id)
+        write_patient(folder, seed)
+        return folder
+
+    return _make_patient
+
+
+def write_model(path: str, num_outputs: int, seed: int = 0) -> None:
+    """Write an ONNX model with the input and output of the isocenter models:
+    the sigmoid of a random linear map of the channel means of an (N, 3, 512, 512) input.
+    """
+    rng = np.random.default_rng(seed)
+    weights = numpy_helper.from_array(
+        rng.normal(0, 1, (3, num_outputs)).astype(np.float32), "weights"
+    )
+    bias = numpy_helper.from_array(
+        rng.normal(0, 0.1, (num_outputs,)).astype(np.float32), "bias"
+    )
+    nodes = [
+        helper.make_node("GlobalAveragePool", ["input"], ["pooled"]),
+        helper.make_node("Flatten", ["pooled"], ["flat"]),
+        helper.make_node("MatMul", ["flat", "weights"], ["linear"]),
+        helper.make_node("Add", ["linear", "bias"], ["logits"]),
+        helper.make_node("Sigmoid", ["logits"], ["output"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "isocenters",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["N", 3, 512, 512])],
+        [
+            helper.make_tensor_value_info(
+                "output", TensorProto.FLOAT, ["N", num_outputs]
+            )
+        ],
+        [weights, bias],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    onnx.save(model, path)
+
+
+@pytest.fixture
+def ort_sessions(tmp_path, monkeypatch) -> dict:
+    """Sessions of the four model variants, written to models/ in the temporary folder,
+    which becomes the working directory."""
+    for model_dir, model_name, num_outputs in (
+        ("5_355", config.MODEL_NAME_BODY, config.MODEL_OUTPUT_BODY_5_355),
+        ("5_355", config.MODEL_NAME_ARMS, config.MODEL_OUTPUT_ARMS_5_355),
+        ("90", config.MODEL_NAME_BODY, config.MODEL_OUTPUT_BODY_90),
+        ("90", config.MODEL_NAME_ARMS, config.MODEL_OUTPUT_ARMS_90),
+    ):
+        write_model(
+            str(tmp_path / "models" / model_dir / f"{model_name}.onnx"),
+            num_outputs,
+            seed=num_outputs,
+        )
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(config.YML, "load_all_variants", True)
+    monkeypatch.setitem(config.YML, "model_precision", "float32")
+    monkeypatch.setitem(config.YML, "ort_model_cache", "")
+
+    return load_sessions()
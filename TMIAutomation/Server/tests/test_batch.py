@@ -0,0 +1,58 @@
+"""Tests of src.batch: the batched requests give the outputs of the requests run one at a time."""
+
+import numpy as np
+from src import config
+from src.batch import predict_batch, run_batched
+from src.pipeline import Pipeline, RequestInfo
+from src.serving.sessions import get_model_key
+
+PTV_NAME = "PTV_Total" if config.BUNDLED else ["PTV_Total", ["PTV_Junction"]]
+OARS_NAME = ["Lens_L", "Intestino"]
+
+
+def _predict(request_info: RequestInfo, ort_sessions: dict) -> tuple:
+    """Output of the request run alone, as by /predict."""
+    pipeline = Pipeline(request_info)
+    pipeline.preprocess()
+    ort_session = ort_sessions[
+        get_model_key(request_info.model_name, request_info.coll_pelvis)
+    ]
+    model_output = run_batched(ort_session, pipeline.get_model_input())
+
+    return pipeline.predict_from_output(model_output, local_opt=False)
+
+
+def test_batch_equals_single_requests(make_patient, ort_sessions):
+    first, second = make_patient("P1", seed=1), make_patient("P2", seed=2)
+    request_infos = [
+        RequestInfo(config.MODEL_NAME_ARMS, first, PTV_NAME, OARS_NAME),
+        RequestInfo(config.MODEL_NAME_BODY, second, PTV_NAME, OARS_NAME),
+        # Same preprocessing as the first request, with other models
+        RequestInfo(config.MODEL_NAME_BODY, first, PTV_NAME, OARS_NAME),
+        RequestInfo(config.MODEL_NAME_ARMS, first, PTV_NAME, OARS_NAME, False),
+        RequestInfo(config.MODEL_NAME_BODY, first, PTV_NAME, OARS_NAME, False),
+        RequestInfo(config.MODEL_NAME_ARMS, first, PTV_NAME, ["Lens_L"]),
+    ]
+
+    # The local optimization is stochastic
+    results = predict_batch(request_infos, ort_sessions, local_opt=False)
+
+    for request_info, result in zip(request_infos, results):
+        assert result.error is None
+        expected = _predict(request_info, ort_sessions)
+        for output, expected_output in zip(result.output, expected):
+            np.testing.assert_array_equal(output, expected_output)
+
+
+def test_invalid_request_does_not_fail_batch(make_patient, ort_sessions):
+    dicom_path = make_patient()
+    request_infos = [
+        RequestInfo(config.MODEL_NAME_ARMS, dicom_path, PTV_NAME, ["Missing"]),
+        RequestInfo(config.MODEL_NAME_ARMS, dicom_path, PTV_NAME, OARS_NAME),
+        RequestInfo(config.MODEL_NAME_ARMS, f"{dicom_path}_missing", PTV_NAME, []),
+    ]
+
+    results = predict_batch(request_infos, ort_sessions)
+
+    assert [result.status for result in results] == [400, 200, 400]
+    assert results[1].output is not None
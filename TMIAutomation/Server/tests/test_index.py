@@ -0,0 +1,112 @@
+"""Tests of the incremental updates of src.dicom.index."""
+
+import os
+import shutil
+import threading
+import pytest
+from src.dicom import index as index_module
+from src.dicom.index import DicomIndex
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch) -> DicomIndex:
+    # Trust the modification times of the directories just written
+    monkeypatch.setattr(index_module, "SETTLED_NS", -(10**12))
+    return DicomIndex(str(tmp_path / "index.sqlite"))
+
+
+@pytest.fixture
+def scans(monkeypatch) -> list[str]:
+    """Folders listed by the index."""
+    scanned = []
+    scan_folder = index_module._scan_folder  # pylint: disable=protected-access
+
+    def _scan_folder(folder):
+        scanned.append(folder)
+        return scan_folder(folder)
+
+    monkeypatch.setattr(index_module, "_scan_folder", _scan_folder)
+    return scanned
+
+
+def test_finds_series(make_patient, index):
+    dicom_path = make_patient()
+    index.update(dicom_path)
+
+    indexed_series = index.find_series(dicom_path)
+    assert indexed_series.rt_struct_path == os.path.join(dicom_path, "RTSTRUCT.dcm")
+    # The slices are written in reverse z order
+    assert indexed_series.paths == [
+        os.path.join(dicom_path, f"CT.{i:04d}.dcm") for i in reversed(range(40))
+    ]
+
+
+def test_lists_folder_only_when_changed(make_patient, index, scans):
+    dicom_path = make_patient()
+    index.update(dicom_path)
+    index.update(dicom_path)
+    assert len(scans) == 1
+
+    os.makedirs(os.path.join(dicom_path, "extra"))
+    index.update(dicom_path)
+    index.update(dicom_path)
+    assert len(scans) == 2
+
+    shutil.copy(
+        os.path.join(dicom_path, "CT.0000.dcm"),
+        os.path.join(dicom_path, "extra", "CT.copy.dcm"),
+    )
+    index.update(dicom_path)
+    assert len(scans) == 3
+
+    rt_struct_path = os.path.join(dicom_path, "RTSTRUCT.dcm")
+    stat = os.stat(rt_struct_path)
+    os.utime(rt_struct_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    index.update(dicom_path)
+    assert len(scans) == 4
+    assert (
+        "RTSTRUCT.dcm",
+        stat.st_mtime_ns + 10**9,
+        stat.st_size,
+    ) in index.find_series(dicom_path).fingerprint
+
+
+def test_lists_recently_modified_folder_again(make_patient, index, scans, monkeypatch):
+    monkeypatch.setattr(index_module, "SETTLED_NS", 10**12)
+    dicom_path = make_patient()
+    index.update(dicom_path)
+    index.update(dicom_path)
+    assert len(scans) == 2
+
+
+def test_removes_deleted_files(make_patient, index):
+    dicom_path = make_patient()
+    index.update(dicom_path)
+    os.remove(os.path.join(dicom_path, "CT.0000.dcm"))
+    index.update(dicom_path)
+
+    assert len(index.find_series(dicom_path).paths) == 39
+
+
+def test_updates_folders_in_parallel(make_patient, index, monkeypatch):
+    first, second = make_patient("P1"), make_patient("P2")
+    release = threading.Event()
+    read_entry = index_module._read_entry  # pylint: disable=protected-access
+
+    def _read_entry(path, *args):
+        if path == os.path.join(first, "RTSTRUCT.dcm"):
+            release.wait(10)
+        return read_entry(path, *args)
+
+    monkeypatch.setattr(index_module, "_read_entry", _read_entry)
+    thread = threading.Thread(target=index.update, args=(first,))
+    thread.start()
+    try:
+        index.update(second)  # not blocked by the update of the first folder
+        assert index.find_series(second) is not None
+        assert thread.is_alive()
+    finally:
+        release.set()
+        thread.join()
+
+    assert index.find_series(first) is not None
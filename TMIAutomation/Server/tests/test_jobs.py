@@ -0,0 +1,74 @@
+"""Tests of the coalescing keys of src.serving.jobs."""
+
+import os
+import pytest
+from src import config
+from src.dicom import index as index_module
+from src.dicom.index import DicomIndex
+from src.pipeline import RequestInfo
+from src.serving import jobs as jobs_module
+from src.serving.jobs import get_coalescing_key
+
+PTV_NAME = "PTV_Total" if config.BUNDLED else ["PTV_Total", ["PTV_Junction"]]
+
+
+def _scan_fails(dicom_path):
+    raise AssertionError(f"{dicom_path} was scanned.")
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch) -> DicomIndex:
+    dicom_index = DicomIndex(str(tmp_path / "index.sqlite"))
+    monkeypatch.setattr(index_module, "_INDEX", dicom_index)
+    return dicom_index
+
+
+@pytest.fixture
+def no_index(monkeypatch) -> None:
+    monkeypatch.setitem(config.YML, "dicom_index_path", "")
+    monkeypatch.setattr(index_module, "_INDEX", None)
+
+
+def test_key_from_index(make_patient, index, monkeypatch):
+    monkeypatch.setattr(jobs_module, "get_folder_fingerprint", _scan_fails)
+    dicom_path = make_patient()
+    request_info = RequestInfo(config.MODEL_NAME_ARMS, dicom_path, PTV_NAME, ["Lens_L"])
+
+    key = get_coalescing_key(request_info)
+    assert key is not None
+    assert get_coalescing_key(request_info) == key
+    assert index.find_series(dicom_path) is not None
+
+    rt_struct_path = os.path.join(dicom_path, "RTSTRUCT.dcm")
+    stat = os.stat(rt_struct_path)
+    os.utime(rt_struct_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert get_coalescing_key(request_info) != key
+
+
+@pytest.mark.usefixtures("index")
+def test_no_key_without_rtstruct(ct_folder):
+    request_info = RequestInfo(config.MODEL_NAME_ARMS, ct_folder, PTV_NAME, [])
+
+    assert get_coalescing_key(request_info) is None
+
+
+@pytest.mark.usefixtures("no_index")
+def test_key_from_folder_scan(make_patient):
+    request_info = RequestInfo(
+        config.MODEL_NAME_ARMS, make_patient(), PTV_NAME, ["Lens_L"]
+    )
+
+    assert get_coalescing_key(request_info) is not None
+
+
+@pytest.mark.usefixtures("no_index")
+def test_no_key_if_file_deleted_during_scan(make_patient, monkeypatch):
+    def _get_folder_fingerprint(dicom_path):
+        raise FileNotFoundError(os.path.join(dicom_path, "CT.0000.dcm"))
+
+    monkeypatch.setattr(jobs_module, "get_folder_fingerprint", _get_folder_fingerprint)
+    request_info = RequestInfo(
+        config.MODEL_NAME_ARMS, make_patient(), PTV_NAME, ["Lens_L"]
+    )
+
+    assert get_coalescing_key(request_info) is None
@@ -0,0 +1,89 @@
+"""Tests of the keys of src.roi.mask_cache."""
+
+import os
+import numpy as np
+import pytest
+from pydicom import dcmread
+from src.dicom.series_cache import load_patient_series
+from src.roi import mask_cache as mask_cache_module
+from src.roi.mask_cache import MASK_CACHE, get_roi_coronal_masks, get_roi_masks
+from src.roi.rasterize import rasterize_rois
+
+ROI_NAMES = ["PTV_Total", "Lens_L"]
+
+
+@pytest.fixture(autouse=True)
+def empty_mask_cache():
+    MASK_CACHE.clear()
+    yield
+    MASK_CACHE.clear()
+
+
+@pytest.fixture
+def rasterized(monkeypatch) -> list[list[str]]:
+    """ROI names rasterized by each call to rasterize_rois."""
+    calls = []
+
+    def _rasterize_rois(rtstruct, roi_names):
+        calls.append(list(roi_names))
+        return rasterize_rois(rtstruct, roi_names)
+
+    monkeypatch.setattr(mask_cache_module, "rasterize_rois", _rasterize_rois)
+    return calls
+
+
+def _shift_contours(rt_struct_path: str, roi_name: str, shift_mm: float) -> None:
+    """Rewrite the RTSTRUCT with the contours of a ROI shifted along x, keeping its SOPInstanceUID."""
+    ds = dcmread(rt_struct_path)
+    roi_number = next(
+        roi.ROINumber for roi in ds.StructureSetROISequence if roi.ROIName == roi_name
+    )
+    for roi_contour in ds.ROIContourSequence:
+        if roi_contour.ReferencedROINumber == roi_number:
+            for contour in roi_contour.ContourSequence:
+                contour_data = np.array(contour.ContourData, dtype=float)
+                contour_data[0::3] += shift_mm
+                contour.ContourData = [f"{value:g}" for value in contour_data]
+    ds.save_as(rt_struct_path)
+    stat = os.stat(rt_struct_path)
+    os.utime(rt_struct_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_reuses_cached_masks(make_patient, rasterized):
+    _, rtstruct = load_patient_series(make_patient())
+
+    first = get_roi_masks(rtstruct, ROI_NAMES)
+    second = get_roi_masks(rtstruct, ROI_NAMES)
+
+    assert rasterized == [ROI_NAMES]
+    for roi_name in ROI_NAMES:
+        np.testing.assert_array_equal(
+            second[roi_name].to_volume(), first[roi_name].to_volume()
+        )
+
+
+def test_rasterizes_edited_contours_with_same_uid(make_patient, rasterized):
+    dicom_path = make_patient()
+    _, rtstruct = load_patient_series(dicom_path)
+    old_masks = get_roi_masks(rtstruct, ROI_NAMES)
+    old_coronal_masks = get_roi_coronal_masks(rtstruct, ROI_NAMES)
+
+    _shift_contours(os.path.join(dicom_path, "RTSTRUCT.dcm"), "PTV_Total", 30)
+    _, edited_rtstruct = load_patient_series(dicom_path)
+    assert edited_rtstruct.ds.SOPInstanceUID == rtstruct.ds.SOPInstanceUID
+    masks = get_roi_masks(edited_rtstruct, ROI_NAMES)
+    coronal_masks = get_roi_coronal_masks(edited_rtstruct, ROI_NAMES)
+
+    # Only the edited ROI is rasterized again
+    assert rasterized[-1] == ["PTV_Total"]
+    fresh_mask = rasterize_rois(edited_rtstruct, ["PTV_Total"])["PTV_Total"]
+    np.testing.assert_array_equal(
+        masks["PTV_Total"].to_volume(), fresh_mask.to_volume()
+    )
+    assert not np.array_equal(
+        masks["PTV_Total"].to_volume(), old_masks["PTV_Total"].to_volume()
+    )
+    assert not np.array_equal(
+        coronal_masks["PTV_Total"], old_coronal_masks["PTV_Total"]
+    )
+    np.testing.assert_array_equal(coronal_masks["Lens_L"], old_coronal_masks["Lens_L"])
@@ -0,0 +1,23 @@
+"""Tests of the stages of src.pipeline timed in the timings of a request."""
+
+import pytest
+from src import config
+from src.pipeline import Pipeline, RequestInfo
+
+PTV_NAME = "PTV_Total" if config.BUNDLED else ["PTV_Total", ["PTV_Junction"]]
+
+
+@pytest.mark.parametrize("streaming_preprocess", [False, True])
+def test_times_dicom_decode(make_patient, tmp_path, monkeypatch, streaming_preprocess):
+    monkeypatch.chdir(tmp_path)  # the input image is saved in logs
+    monkeypatch.setitem(config.YML, "streaming_preprocess", streaming_preprocess)
+    request_info = RequestInfo(
+        config.MODEL_NAME_ARMS, make_patient(), PTV_NAME, ["Lens_L"]
+    )
+    timings = []
+
+    Pipeline(request_info, timings).preprocess()
+
+    stages = [timing.stage for timing in timings]
+    assert stages.index("dicom_load") < stages.index("dicom_decode")
+    assert stages.count("dicom_decode") == 1
@@ -0,0 +1,54 @@
+"""Tests of the replacement of the served variants by src.serving.quantize."""
+
+import os
+import numpy as np
+import pytest
+from src import config
+from src.serving.quantize import GateResult, gate_model
+from src.serving.sessions import get_model_path
+
+CALIBRATION_INPUTS = np.zeros((1, 3, 512, 512), dtype=np.float32)
+
+
+def _evaluate(accepted: bool):
+    """Gate running the quantized model once, with a fixed result."""
+
+    def _evaluate_session(ort_session) -> GateResult:
+        assert ort_session.run(None, {"input": CALIBRATION_INPUTS})
+        return GateResult(accepted, 1, 0.0, 0.0, 1.0, 1.0)
+
+    return _evaluate_session
+
+
+@pytest.mark.usefixtures("ort_sessions")
+def test_rejected_variant_keeps_served_model():
+    model_path = get_model_path(config.MODEL_NAME_ARMS, True)
+    output_path = get_model_path(config.MODEL_NAME_ARMS, True, "fp16")
+    with open(output_path, "wb") as served_model:
+        served_model.write(b"served model")
+
+    result = gate_model(
+        model_path, output_path, "fp16", CALIBRATION_INPUTS, _evaluate(False)
+    )
+
+    assert not result.accepted
+    with open(output_path, "rb") as served_model:
+        assert served_model.read() == b"served model"
+    assert not os.path.exists(f"{output_path}.staging")
+
+
+@pytest.mark.usefixtures("ort_sessions")
+def test_accepted_variant_replaces_served_model():
+    model_path = get_model_path(config.MODEL_NAME_ARMS, True)
+    output_path = get_model_path(config.MODEL_NAME_ARMS, True, "fp16")
+    with open(output_path, "wb") as served_model:
+        served_model.write(b"served model")
+
+    result = gate_model(
+        model_path, output_path, "fp16", CALIBRATION_INPUTS, _evaluate(True)
+    )
+
+    assert result.accepted
+    with open(output_path, "rb") as served_model:
+        assert served_model.read() != b"served model"
+    assert not os.path.exists(f"{output_path}.staging")
@@ -0,0 +1,123 @@
+"""Tests of src.roi.rasterize against the masks of rt_utils."""
+
+import copy
+import numpy as np
+import pytest
+from rt_utils import RTStruct, RTStructBuilder
+from src.roi.rasterize import rasterize_coronal_projections, rasterize_rois
+
+
+def _add_contours(
+    rtstruct: RTStruct, name: str, polygons_by_slice: dict[int, list[list]]
+) -> None:
+    """Add a ROI with the given polygons, in (x, y) pixel coordinates, on each slice index."""
+    header = rtstruct.series_data[0]
+    template_mask = np.zeros(
+        (header.Rows, header.Columns, len(rtstruct.series_data)), dtype=bool
+    )
+    template_mask[1:3, 1:3, 0] = True
+    rtstruct.add_roi(mask=template_mask, name=name)
+
+    roi_contour = rtstruct.ds.ROIContourSequence[-1]
+    template = roi_contour.ContourSequence[0]
+    contours = []
+    for index, polygons in polygons_by_slice.items():
+        header = rtstruct.series_data[index]
+        x_origin, y_origin, z = (float(v) for v in header.ImagePositionPatient)
+        spacing = float(header.PixelSpacing[0])
+        for polygon in polygons:
+            contour = copy.deepcopy(template)
+            contour.ContourImageSequence[0].ReferencedSOPInstanceUID = (
+                header.SOPInstanceUID
+            )
+            contour.ContourData = [
+                value
+                for x, y in polygon
+                for value in (x_origin + spacing * x, y_origin + spacing * y, z)
+            ]
+            contour.NumberOfContourPoints = len(polygon)
+            contours.append(contour)
+    roi_contour.ContourSequence = contours
+
+
+@pytest.fixture
+def rtstruct(ct_folder) -> RTStruct:
+    """RTSTRUCT of 64x64 slices with ROIs on which the shortcuts of the coronal rasterization apply."""
+    rtstruct = RTStructBuilder.create_new(ct_folder)
+
+    ring = np.zeros((64, 64, 8), dtype=bool)
+    ring[10:40, 12:50, 1:5] = True
+    ring[18:30, 20:40, 2:4] = False
+    rtstruct.add_roi(mask=ring, name="Ring")
+
+    square = [[10, 10], [30, 10], [30, 30], [10, 30]]
+    _add_contours(
+        rtstruct,
+        "Duplicate",
+        {2: [square, square], 3: [square, [[20, 20], [40, 20], [40, 40]], square]},
+    )
+    _add_contours(
+        rtstruct,
+        "Nested",
+        {1: [square, [[15, 15], [25, 15], [25, 25], [15, 25]]]},
+    )
+    _add_contours(
+        rtstruct,
+        "Clipped",
+        {
+            # Crossing the left and right borders
+            0: [[[-20, 5], [90, 5], [90, 20], [-20, 20]]],
+            # Crossing the top border: the clipped triangle is narrower than its vertices
+            1: [[[5, -40], [60, -40], [32, 10]]],
+            # Crossing the bottom border, and a polygon lying outside the image
+            2: [[[5, 50], [60, 90], [10, 90]], [[70, 10], [80, 10], [80, 20]]],
+            # Entirely above the image
+            3: [[[5, -30], [40, -30], [20, -5]]],
+        },
+    )
+
+    return rtstruct
+
+
+ROI_NAMES: list[str] = ["Ring", "Duplicate", "Nested", "Clipped"]
+
+
+def test_ring_has_inner_contours(rtstruct):
+    contours_by_uid = {}
+    for contour in rtstruct.ds.ROIContourSequence[0].ContourSequence:
+        uid = contour.ContourImageSequence[0].ReferencedSOPInstanceUID
+        contours_by_uid[uid] = contours_by_uid.get(uid, 0) + 1
+    assert max(contours_by_uid.values()) == 2
+
+
+def test_coronal_projections_equal_rt_utils(rtstruct):
+    projections = rasterize_coronal_projections(rtstruct, ROI_NAMES)
+
+    for roi_name in ROI_NAMES:
+        expected = rtstruct.get_roi_mask_by_name(roi_name).any(axis=0)
+        assert expected.any()
+        np.testing.assert_array_equal(projections[roi_name], expected, roi_name)
+
+
+def test_rois_equal_rt_utils(rtstruct):
+    roi_masks = rasterize_rois(rtstruct, ROI_NAMES)
+
+    for roi_name in ROI_NAMES:
+        expected = rtstruct.get_roi_mask_by_name(roi_name)
+        np.testing.assert_array_equal(roi_masks[roi_name].to_volume(), expected)
+        np.testing.assert_array_equal(
+            roi_masks[roi_name].coronal_projection(), expected.any(axis=0)
+        )
+
+
+def test_synthetic_patient_equals_rt_utils(make_patient):
+    folder = make_patient()
+    rtstruct = RTStructBuilder.create_from(folder, f"{folder}/RTSTRUCT.dcm")
+    roi_names = rtstruct.get_roi_names()
+
+    projections = rasterize_coronal_projections(rtstruct, roi_names)
+    for roi_name in roi_names:
+        np.testing.assert_array_equal(
+            projections[roi_name],
+            rtstruct.get_roi_mask_by_name(roi_name).any(axis=0),
+        )
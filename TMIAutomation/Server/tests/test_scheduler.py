@@ -0,0 +1,155 @@
+"""Tests of src.serving.scheduler with concurrent callers."""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import numpy as np
+from src import config
+from src.serving import scheduler as scheduler_module
+from src.serving.scheduler import BatchScheduler, add_schedulers
+
+
+class _EchoSession:
+    """Session returning its input rows, recording the number of rows of each run."""
+
+    def __init__(self, batch_size: int | str = "N", error: Exception | None = None):
+        self.batch_size = batch_size
+        self.error = error
+        self.runs: list[int] = []
+
+    def get_inputs(self) -> list:
+        return [SimpleNamespace(name="input", shape=[self.batch_size, 3])]
+
+    def run(self, _, input_feed: dict[str, np.ndarray]) -> list[np.ndarray]:
+        self.runs.append(len(input_feed["input"]))
+        if self.error is not None:
+            raise self.error
+        return [input_feed["input"].copy(), -input_feed["input"]]
+
+
+def _run_concurrently(
+    scheduler, inputs: list[np.ndarray]
+) -> list[list[np.ndarray] | Exception]:
+    """Call the scheduler from one thread per input, all starting together.
+    The exception raised to a caller is returned as its output."""
+    barrier = threading.Barrier(len(inputs))
+
+    def _run(rows: np.ndarray) -> list[np.ndarray] | Exception:
+        barrier.wait()
+        try:
+            return scheduler.run(None, {"input": rows})
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            return exc
+
+    with ThreadPoolExecutor(len(inputs)) as executor:
+        return list(executor.map(_run, inputs))
+
+
+def test_returns_rows_of_each_caller():
+    session = _EchoSession()
+    scheduler = BatchScheduler(session, window_seconds=0.5, max_batch_size=16)
+    sizes = [1, 3, 2, 1, 4, 1]
+    start = np.cumsum([0, *sizes])
+    inputs = [
+        np.arange(3 * start[i], 3 * start[i + 1]).reshape(-1, 3)
+        for i in range(len(sizes))
+    ]
+
+    outputs = _run_concurrently(scheduler, inputs)
+    scheduler.close()
+
+    for rows, output in zip(inputs, outputs):
+        np.testing.assert_array_equal(output[0], rows)
+        np.testing.assert_array_equal(output[1], -rows)
+    assert session.runs == [sum(sizes)]
+    stats = scheduler.stats
+    assert (stats.requests, stats.batches) == (len(sizes), 1)
+
+
+def test_splits_batches_at_max_batch_size():
+    session = _EchoSession()
+    scheduler = BatchScheduler(session, window_seconds=0.5, max_batch_size=4)
+    inputs = [np.full((3 if i == 0 else 1, 3), i) for i in range(9)]
+
+    outputs = _run_concurrently(scheduler, inputs)
+    scheduler.close()
+
+    for rows, output in zip(inputs, outputs):
+        np.testing.assert_array_equal(output[0], rows)
+    assert sum(session.runs) == 11
+    assert max(session.runs) <= 4
+    assert sum(scheduler.stats.batch_sizes.values()) == len(session.runs)
+
+
+def test_first_request_larger_than_max_batch_size():
+    session = _EchoSession()
+    scheduler = BatchScheduler(session, window_seconds=0.01, max_batch_size=2)
+    rows = np.arange(15).reshape(5, 3)
+
+    np.testing.assert_array_equal(scheduler.run(None, {"input": rows})[0], rows)
+    scheduler.close()
+    assert session.runs == [5]
+
+
+def test_forty_concurrent_callers_equal_one_run(ort_sessions):
+    ort_session = ort_sessions["arms_cnn/5_355"]
+    scheduler = BatchScheduler(ort_session, window_seconds=0.2, max_batch_size=16)
+    inputs = np.random.default_rng(0).random((40, 3, 512, 512), dtype=np.float32)
+
+    outputs = _run_concurrently(scheduler, [row[np.newaxis] for row in inputs])
+    scheduler.close()
+
+    expected = ort_session.run(None, {"input": inputs})[0]
+    np.testing.assert_array_equal(np.concatenate([o[0] for o in outputs]), expected)
+    stats = scheduler.stats
+    assert stats.requests == 40
+    assert max(stats.batch_sizes) <= 16
+    assert stats.queue_depth == 0
+
+
+def test_fixed_batch_size_runs_directly():
+    session = _EchoSession(batch_size=1)
+    scheduler = BatchScheduler(session, window_seconds=0.5, max_batch_size=16)
+    assert not scheduler.batching
+
+    _run_concurrently(scheduler, [np.zeros((1, 3))] * 4)
+    assert session.runs == [1] * 4
+    assert scheduler.stats.batches == 0
+
+
+def test_errors_reach_every_caller():
+    session = _EchoSession(error=RuntimeError("inference failed"))
+    scheduler = BatchScheduler(session, window_seconds=0.2, max_batch_size=16)
+
+    outputs = _run_concurrently(scheduler, [np.zeros((1, 3))] * 3)
+    scheduler.close()
+
+    assert all(output is session.error for output in outputs)
+
+
+def test_runs_directly_once_closed():
+    session = _EchoSession()
+    scheduler = BatchScheduler(session, window_seconds=0.5, max_batch_size=16)
+    scheduler.close()
+
+    scheduler.run(None, {"input": np.zeros((2, 3))})
+    assert session.runs == [2]
+    assert scheduler.stats.batches == 0
+
+
+def test_shared_sessions_share_scheduler(monkeypatch):
+    monkeypatch.setitem(config.YML, "inference_batch_window_ms", 5)
+    monkeypatch.setattr(scheduler_module, "SCHEDULERS", {})
+    session = _EchoSession()
+    schedulers = add_schedulers({"a/5_355": session, "a/90": session, "b/90": None})
+
+    assert schedulers["a/5_355"] is schedulers["a/90"]
+    assert schedulers["b/90"] is None
+    schedulers["a/90"].close()
+
+
+def test_zero_window_disables_schedulers(monkeypatch):
+    monkeypatch.setitem(config.YML, "inference_batch_window_ms", 0)
+    ort_sessions = {"a/5_355": _EchoSession()}
+
+    assert add_schedulers(ort_sessions) is ort_sessions
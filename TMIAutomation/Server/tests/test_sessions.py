@@ -0,0 +1,105 @@
+"""Tests of the ONNX runtime sessions configured from config.yml, and of the optimized model cache."""
+
+import os
+import shutil
+import numpy as np
+import onnxruntime
+from src import config
+from src.serving.sessions import (
+    get_cached_model_path,
+    get_model_path,
+    get_session_options,
+    load_session,
+    load_sessions,
+)
+
+
+def _run(ort_session: onnxruntime.InferenceSession) -> np.ndarray:
+    inputs = np.random.default_rng(0).random((2, 3, 512, 512), dtype=np.float32)
+    return ort_session.run(None, {"input": inputs})[0]
+
+
+def test_session_options_from_config(monkeypatch):
+    for key, value in {
+        "ort_intra_op_threads": 3,
+        "ort_inter_op_threads": 2,
+        "ort_execution_mode": "parallel",
+        "ort_graph_optimization": "basic",
+        "ort_enable_cpu_mem_arena": False,
+        "ort_enable_mem_pattern": False,
+    }.items():
+        monkeypatch.setitem(config.YML, key, value)
+
+    session_options = get_session_options()
+
+    assert session_options.intra_op_num_threads == 3
+    assert session_options.inter_op_num_threads == 2
+    assert session_options.execution_mode == onnxruntime.ExecutionMode.ORT_PARALLEL
+    assert (
+        session_options.graph_optimization_level
+        == onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    )
+    assert not session_options.enable_cpu_mem_arena
+    assert not session_options.enable_mem_pattern
+    assert get_session_options(intra_op_threads=1).intra_op_num_threads == 1
+
+
+def test_shared_arena(monkeypatch):
+    monkeypatch.setitem(config.YML, "ort_enable_cpu_mem_arena", True)
+    monkeypatch.setitem(config.YML, "ort_shared_arena", True)
+
+    session_options = get_session_options()
+
+    assert session_options.get_session_config_entry("session.use_env_allocators") == "1"
+
+
+def test_optimized_model_cache(ort_sessions, monkeypatch):
+    monkeypatch.setitem(config.YML, "ort_model_cache", "ort")
+    monkeypatch.setitem(config.YML, "ort_graph_optimization", "all")
+    model_name = config.MODEL_NAME_BODY
+    cached_model_path = get_cached_model_path(get_model_path(model_name, True))
+    assert os.path.dirname(cached_model_path) == os.path.join("models", "5_355.cache")
+
+    saving_session = load_session(model_name, coll_pelvis=True)
+    assert os.path.exists(cached_model_path)
+    cached_session = load_session(model_name, coll_pelvis=True)
+    assert cached_session.get_session_options().graph_optimization_level == (
+        onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+    )
+
+    expected = _run(ort_sessions[f"{model_name}/5_355"])
+    np.testing.assert_allclose(_run(saving_session), expected, rtol=1e-6)
+    np.testing.assert_allclose(_run(cached_session), expected, rtol=1e-6)
+
+    monkeypatch.setitem(config.YML, "ort_graph_optimization", "basic")
+    assert get_cached_model_path(get_model_path(model_name, True)) != (
+        cached_model_path
+    )
+
+
+def test_invalid_cache_falls_back_to_model(ort_sessions, monkeypatch):
+    monkeypatch.setitem(config.YML, "ort_model_cache", "ort")
+    model_name = config.MODEL_NAME_ARMS
+    cached_model_path = get_cached_model_path(get_model_path(model_name, True))
+    os.makedirs(os.path.dirname(cached_model_path), exist_ok=True)
+    with open(cached_model_path, "wb") as cached_model:
+        cached_model.write(b"not a model")
+
+    ort_session = load_session(model_name, coll_pelvis=True)
+
+    np.testing.assert_array_equal(
+        _run(ort_session), _run(ort_sessions[f"{model_name}/5_355"])
+    )
+
+
+def test_identical_models_share_session(ort_sessions):
+    model_name = config.MODEL_NAME_BODY
+    shutil.copy(get_model_path(model_name, True), get_model_path(model_name, False))
+
+    ort_sessions = load_sessions()
+
+    assert ort_sessions[f"{model_name}/5_355"] is ort_sessions[f"{model_name}/90"]
+    assert (
+        ort_sessions[f"{config.MODEL_NAME_ARMS}/5_355"]
+        is not ort_sessions[f"{config.MODEL_NAME_ARMS}/90"]
+    )
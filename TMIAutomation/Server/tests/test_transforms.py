@@ -0,0 +1,98 @@
+"""Tests of src.transforms against the imgaug augmenters they replace (see requirements-dev.txt)."""
+
+import numpy as np
+import pytest
+from src.transforms import get_index_map, transform_image, transform_keypoints
+
+iaa = pytest.importorskip("imgaug.augmenters")
+augmentables = pytest.importorskip("imgaug.augmentables")
+
+SHAPES = [(512, 40), (512, 100), (512, 333), (512, 600), (37, 511), (64, 64)]
+
+
+def _get_augmenter(step) -> iaa.Augmenter:
+    if step[0] == "resize":
+        return iaa.Resize(
+            size={"height": step[1], "width": step[2]}, interpolation="nearest"
+        )
+
+    return iaa.Rot90(k=step[1], keep_size=False)
+
+
+def _random_steps(rng: np.random.Generator) -> tuple:
+    steps = []
+    for _ in range(rng.integers(1, 4)):
+        if rng.random() < 0.5:
+            steps.append(("resize", *map(int, rng.integers(16, 700, size=2))))
+        else:
+            steps.append(("rot90", int(rng.integers(-3, 4))))
+
+    return tuple(steps)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_pipeline_steps_equal_imgaug(shape):
+    rng = np.random.default_rng(shape[1])
+    image = rng.random((*shape, 3))
+    xy = rng.random((12, 2)) * shape[::-1]
+    forward_steps = (("resize", 512, 512), ("rot90", -1))
+    inverse_steps = (("rot90", 1), ("resize", *shape))
+
+    pixels = iaa.Sequential([_get_augmenter(step) for step in forward_steps])(
+        image=image
+    )
+    np.testing.assert_array_equal(transform_image(image, forward_steps), pixels)
+
+    keypoints = augmentables.KeypointsOnImage(
+        [augmentables.Keypoint(x=x, y=y) for x, y in xy], shape=pixels.shape
+    )
+    image_original, keypoints_original = iaa.Sequential(
+        [_get_augmenter(step) for step in inverse_steps]
+    )(image=pixels, keypoints=keypoints)
+    np.testing.assert_array_equal(
+        transform_image(pixels, inverse_steps), image_original
+    )
+    np.testing.assert_array_equal(
+        transform_keypoints(xy, pixels.shape[:2], inverse_steps),
+        keypoints_original.to_xy_array(),
+    )
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_steps_equal_imgaug(seed):
+    rng = np.random.default_rng(seed)
+    shape = tuple(map(int, rng.integers(8, 600, size=2)))
+    steps = _random_steps(rng)
+    image = rng.integers(-1000, 3000, size=(*shape, 3)).astype(np.int16)
+    xy = rng.random((12, 2)) * shape[::-1]
+
+    keypoints = augmentables.KeypointsOnImage(
+        [augmentables.Keypoint(x=x, y=y) for x, y in xy], shape=image.shape
+    )
+    expected_image, expected_keypoints = iaa.Sequential(
+        [_get_augmenter(step) for step in steps]
+    )(image=image, keypoints=keypoints)
+
+    np.testing.assert_array_equal(transform_image(image, steps), expected_image)
+    np.testing.assert_array_equal(
+        transform_keypoints(xy, shape, steps), expected_keypoints.to_xy_array()
+    )
+
+
+def test_writes_into_out():
+    image = np.random.default_rng(0).random((512, 100, 3))
+    steps = (("resize", 512, 512), ("rot90", -1))
+    out = np.empty((512, 512, 3))
+
+    assert transform_image(image, steps, out=out) is out
+    np.testing.assert_array_equal(out, transform_image(image, steps))
+
+
+def test_index_map_is_cached_and_read_only():
+    steps = (("resize", 512, 512), ("rot90", -1))
+    index = get_index_map((512, 100), steps)
+
+    assert get_index_map((512, 100), steps) is index
+    assert not index.flags.writeable
+    with pytest.raises(ValueError):
+        get_index_map((512, 100), (("flip", 1),))
@@ -0,0 +1,64 @@
+"""Tests of the supersession and eviction of the volumes in src.dicom.volume_store."""
+
+import os
+import shutil
+import numpy as np
+from src import config
+from src.dicom.series import LazySeries
+from src.dicom.volume_store import get_volume_path, open_volume
+
+
+def _stored_volumes() -> list[str]:
+    return sorted(
+        name
+        for name in os.listdir(config.YML["volume_store_dir"])
+        if name.endswith(".npy")
+    )
+
+
+def _touch(path: str) -> None:
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_exports_in_other_folders_are_kept(ct_folder, tmp_path):
+    # Export of the same series into another folder, at another time
+    copy_folder = shutil.copytree(ct_folder, str(tmp_path / "CT_copy"))
+    _touch(os.path.join(copy_folder, "CT.0000.dcm"))
+    series = LazySeries.from_folder(ct_folder)
+    copy_series = LazySeries.from_folder(copy_folder)
+
+    for _ in range(2):
+        np.testing.assert_array_equal(
+            open_volume(LazySeries.from_folder(ct_folder)),
+            open_volume(LazySeries.from_folder(copy_folder)),
+        )
+
+    assert _stored_volumes() == sorted(
+        os.path.basename(get_volume_path(s)) for s in (series, copy_series)
+    )
+
+
+def test_new_export_supersedes_volume_of_same_folder(ct_folder):
+    old_path = get_volume_path(LazySeries.from_folder(ct_folder))
+    open_volume(LazySeries.from_folder(ct_folder))
+
+    _touch(os.path.join(ct_folder, "CT.0000.dcm"))
+    series = LazySeries.from_folder(ct_folder)
+    open_volume(series)
+
+    assert get_volume_path(series) != old_path
+    assert _stored_volumes() == [os.path.basename(get_volume_path(series))]
+
+
+def test_evicts_least_recently_used_volumes(ct_folder, tmp_path, monkeypatch):
+    copy_folder = shutil.copytree(ct_folder, str(tmp_path / "CT_copy"))
+    series = LazySeries.from_folder(ct_folder)
+    open_volume(series)
+    volume_bytes = os.path.getsize(get_volume_path(series))
+    monkeypatch.setitem(config.YML, "volume_store_max_gb", 1.5 * volume_bytes / 1024**3)
+
+    copy_series = LazySeries.from_folder(copy_folder)
+    open_volume(copy_series)
+
+    assert _stored_volumes() == [os.path.basename(get_volume_path(copy_series))]
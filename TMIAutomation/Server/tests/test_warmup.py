@@ -0,0 +1,29 @@
+"""Tests of the warm-up of the models and of the pipeline modules in src.serving.warmup."""
+
+from src.local_optimization.optimization_5_355 import LocalOptimization5355
+from src.local_optimization.optimization_90 import LocalOptimization90
+from src.serving.warmup import Readiness, warm_up
+
+
+def test_warms_up_local_optimization_of_each_angle(ort_sessions, monkeypatch):
+    optimized = []
+    for local_optimization_class in (LocalOptimization5355, LocalOptimization90):
+        optimize = local_optimization_class.optimize
+
+        def _optimize(self, optimize=optimize):
+            optimize(self)
+            optimized.append(type(self))
+
+        monkeypatch.setattr(local_optimization_class, "optimize", _optimize)
+    readiness = Readiness()
+
+    warm_up(ort_sessions, readiness)
+
+    assert readiness.modules_error is None
+    assert readiness.modules_warmed_up
+    assert sorted(optimized, key=lambda cls: cls.__name__) == [
+        LocalOptimization5355,
+        LocalOptimization90,
+    ]
+    assert all(status.warmed_up for status in readiness.models.values())
+    assert readiness.ready
@@ -0,0 +1,111 @@
+"""Tests of src.dicom.watcher on patient folders copied into a temporary storage folder."""
+
+import os
+import shutil
+import pytest
+from src import config
+from src.dicom.series_cache import load_patient_series
+from src.dicom.watcher import StorageWatcher
+from src.roi import mask_cache as mask_cache_module
+from src.roi.mask_cache import MASK_CACHE
+
+
+class _Clock:
+    """Clock advanced by hand."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def storage(tmp_path) -> str:
+    folder = str(tmp_path / "watched")
+    os.makedirs(folder)
+    return folder
+
+
+@pytest.fixture(autouse=True)
+def empty_mask_cache():
+    MASK_CACHE.clear()
+    yield
+    MASK_CACHE.clear()
+
+
+def _cached_kinds(dicom_path: str) -> dict[str, set[str]]:
+    """Kinds of masks of each ROI in the mask cache."""
+    _, rtstruct = load_patient_series(dicom_path)
+    kinds: dict[str, set[str]] = {}
+    for roi_name in rtstruct.get_roi_names():
+        for kind in ("3d", "coronal"):
+            key = mask_cache_module._get_key(  # pylint: disable=protected-access
+                rtstruct, roi_name, kind
+            )
+            if MASK_CACHE.get(key) is not None:
+                kinds.setdefault(roi_name, set()).add(kind)
+
+    return kinds
+
+
+def test_warms_copied_folder_once_quiet(make_patient, storage, monkeypatch):
+    monkeypatch.setitem(config.YML, "streaming_preprocess", False)
+    patient = make_patient()
+    clock = _Clock()
+    watcher = StorageWatcher(storage, quiet_seconds=5, clock=clock)
+    watcher.scan_once(warm=False)
+
+    dicom_path = shutil.copytree(patient, os.path.join(storage, "P1"))
+    assert not watcher.scan_once()
+    clock.now = 4
+    assert not watcher.scan_once()
+    clock.now = 6
+    assert watcher.scan_once() == [dicom_path]
+    clock.now = 20
+    assert not watcher.scan_once()
+
+    assert _cached_kinds(dicom_path) == {
+        "PTV_Total": {"3d"},
+        "PTV_Junction": {"coronal"},
+        "Lens_L": {"coronal"},
+        "Intestino": {"coronal"},
+        "Body": {"coronal"},
+    }
+
+
+def test_waits_for_rtstruct(make_patient, storage):
+    patient = make_patient()
+    watcher = StorageWatcher(storage, quiet_seconds=0, clock=_Clock())
+    watcher.scan_once(warm=False)
+
+    dicom_path = os.path.join(storage, "P1")
+    shutil.copytree(patient, dicom_path, ignore=shutil.ignore_patterns("RTSTRUCT*"))
+    assert not watcher.scan_once()
+
+    shutil.copy(os.path.join(patient, "RTSTRUCT.dcm"), dicom_path)
+    assert watcher.scan_once() == [dicom_path]
+
+
+def test_ignores_folders_present_at_start(make_patient, storage):
+    shutil.copytree(make_patient(), os.path.join(storage, "P1"))
+    watcher = StorageWatcher(storage, quiet_seconds=0, clock=_Clock())
+    watcher.scan_once(warm=False)
+
+    assert not watcher.scan_once()
+
+
+def test_warms_configured_rois(make_patient, storage, monkeypatch):
+    monkeypatch.setitem(config.YML, "watch_ptv_names", ["PTV_Total", "PTV_Junction"])
+    monkeypatch.setitem(config.YML, "watch_oar_names", ["Lens_L", "Missing"])
+    monkeypatch.setitem(config.YML, "streaming_preprocess", False)
+    watcher = StorageWatcher(storage, quiet_seconds=0, clock=_Clock())
+    watcher.scan_once(warm=False)
+
+    dicom_path = shutil.copytree(make_patient(), os.path.join(storage, "P1"))
+    assert watcher.scan_once() == [dicom_path]
+    assert _cached_kinds(dicom_path) == {
+        "PTV_Total": {"3d"},
+        "PTV_Junction": {"3d"},
+        "Lens_L": {"coronal"},
+    }
@@ -0,0 +1,58 @@
+"""Tests of the retirement of a src.serving.workers pool replaced by the hot reload."""
+
+import threading
+import pytest
+from src import config
+from src.pipeline import RequestInfo
+from src.serving.jobs import JobManager
+from src.serving.workers import WorkerPool
+
+
+@pytest.fixture
+def pool(monkeypatch) -> WorkerPool:
+    """Pool whose worker processes are never started, recording its shutdowns."""
+    worker_pool = WorkerPool(1, 1)
+    worker_pool.shutdowns = threading.Semaphore(0)
+    monkeypatch.setattr(worker_pool, "shutdown", worker_pool.shutdowns.release)
+    yield worker_pool
+    WorkerPool.shutdown(worker_pool)
+
+
+def test_retired_pool_shuts_down_after_last_job(pool):
+    assert pool.hold()
+    assert pool.hold()
+    pool.retire()
+    pool.release()
+    assert not pool.shutdowns.acquire(timeout=0.5)
+
+    pool.release()
+    assert pool.shutdowns.acquire(timeout=10)
+    assert not pool.hold()
+
+
+def test_idle_pool_shuts_down_when_retired(pool):
+    assert pool.hold()
+    pool.release()
+    assert not pool.shutdowns.acquire(timeout=0.5)
+
+    pool.retire()
+    assert pool.shutdowns.acquire(timeout=10)
+    assert not pool.hold()
+    pool.retire()
+    assert not pool.shutdowns.acquire(timeout=0.5)
+
+
+def test_job_runs_in_server_once_pool_retired(make_patient, ort_sessions, pool):
+    pool.retire()
+    request_info = RequestInfo(
+        config.MODEL_NAME_ARMS,
+        make_patient(),
+        "PTV_Total" if config.BUNDLED else ["PTV_Total", ["PTV_Junction"]],
+        ["Lens_L"],
+    )
+
+    job = JobManager().submit(request_info, ort_sessions["arms_cnn/5_355"], pool)
+
+    assert job.wait(300)
+    assert job.error_status is None
+    assert job.result is not None